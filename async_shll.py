@@ -0,0 +1,168 @@
+"""
+asyncio ingestion stage for the Sliding HyperLogLog.
+
+AsyncSlidingHLL wraps a SlidingHyperLogLog and feeds it from the event loop without blocking it:
+items are batched, every batch is hashed in an executor (a thread pool by default, or any
+concurrent.futures executor - hash_values is picklable, so a process pool works too), and the hashed batches
+are applied to the sketch on the event loop thread, in arrival order.
+
+    items -> [batch queue] -> hasher task -> [hashed queue] -> applier task -> sketch
+
+Both queues are bounded (max_queue batches): when the sketch falls behind, feed() / consume() wait,
+which pushes back on the producer.
+"""
+
+import asyncio
+import time
+
+from shll import hash_values
+
+
+DEFAULT_BATCH_SIZE = 1000
+DEFAULT_MAX_QUEUE = 16
+
+
+class AsyncSlidingHLL(object):
+    """ asyncio wrapper of a SlidingHyperLogLog.
+    sketch - the wrapped SlidingHyperLogLog (only updated from the event loop thread)
+    batch_size - number of items per batch
+    max_queue - bound of each queue, in batches
+    executor - where batches are hashed (None: the loop's default thread pool)
+    items, batches - number of items / batches applied to the sketch
+    error - the first error met while hashing / applying a batch, raised by the next flush()
+    """
+
+    def __init__(self, sketch, batch_size=DEFAULT_BATCH_SIZE, max_queue=DEFAULT_MAX_QUEUE, executor=None):
+        if batch_size <= 0:
+            raise ValueError("batch_size should be positive")
+        if max_queue <= 0:
+            raise ValueError("max_queue should be positive")
+        self.sketch = sketch
+        self.batch_size = batch_size
+        self.max_queue = max_queue
+        self.executor = executor
+        # the batch being filled: values, timestamps
+        self.values = []
+        self.timestamps = []
+        self.batch_queue = None
+        self.hashed_queue = None
+        self.tasks = []
+        # counters
+        self.items = 0
+        self.batches = 0
+        self.started = None
+        self.latency_sum = 0.0
+        self.latency_max = 0.0
+        # the first error of a batch since the last flush
+        self.error = None
+
+    async def start(self):
+        # starts the hasher and applier tasks (called automatically by feed / consume)
+        if self.tasks:
+            return
+        self.batch_queue = asyncio.Queue(self.max_queue)
+        self.hashed_queue = asyncio.Queue(self.max_queue)
+        self.started = time.perf_counter()
+        self.tasks = [asyncio.ensure_future(self.hasher()), asyncio.ensure_future(self.applier())]
+
+    async def hasher(self):
+        # submits every batch to the executor. the futures are queued in order, so hashing of several
+        # batches can overlap while they are still applied in arrival order
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self.batch_queue.get()
+            if batch is None:
+                await self.hashed_queue.put(None)
+                return
+            values, timestamps, queued = batch
+            future = loop.run_in_executor(self.executor, hash_values, values, self.sketch.b, self.sketch.hash_name)
+            await self.hashed_queue.put((future, timestamps, queued))
+            self.batch_queue.task_done()
+
+    async def applier(self):
+        # applies the hashed batches to the sketch, in order
+        while True:
+            item = await self.hashed_queue.get()
+            if item is None:
+                return
+            future, timestamps, queued = item
+            try:
+                idx, p_w = await future
+                self.sketch.apply_many(idx, p_w, timestamps)
+            except Exception as e:
+                # e.g. an unhashable value: the batch is dropped, flush() raises the error
+                if self.error is None:
+                    self.error = e
+            else:
+                latency = time.perf_counter() - queued
+                self.items += len(timestamps)
+                self.batches += 1
+                self.latency_sum += latency
+                self.latency_max = max(self.latency_max, latency)
+            finally:
+                self.hashed_queue.task_done()
+
+    async def feed(self, value, t):
+        # adds one item. waits when the queues are full (backpressure)
+        self.values.append(value)
+        self.timestamps.append(t)
+        if len(self.values) >= self.batch_size:
+            await self.push()
+
+    async def push(self):
+        # queues the batch being filled
+        await self.start()
+        if not self.values:
+            return
+        batch = (self.values, self.timestamps, time.perf_counter())
+        self.values = []
+        self.timestamps = []
+        await self.batch_queue.put(batch)
+
+    async def consume(self, source):
+        # feeds all the (value, t) pairs of an async iterator, then flushes
+        async for value, t in source:
+            await self.feed(value, t)
+        await self.flush()
+
+    async def flush(self):
+        # waits until every item fed so far is applied to the sketch
+        await self.push()
+        await self.batch_queue.join()
+        await self.hashed_queue.join()
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    async def estimate(self, t, w=0):
+        # EstimateCardinality of the sketch, after every item fed so far is applied
+        await self.flush()
+        return self.sketch.EstimateCardinality(t, w)
+
+    async def close(self):
+        # flushes and stops the tasks
+        if not self.tasks:
+            return
+        await self.flush()
+        await self.batch_queue.put(None)
+        await asyncio.gather(*self.tasks)
+        self.tasks = []
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    def stats(self):
+        # throughput / latency counters. latency is per batch, from being queued until applied
+        elapsed = time.perf_counter() - self.started if self.started is not None else 0.0
+        return {
+            'items': self.items,
+            'batches': self.batches,
+            'queued_batches': self.batch_queue.qsize() + self.hashed_queue.qsize() if self.tasks else 0,
+            'items_per_sec': self.items / elapsed if elapsed > 0 else 0.0,
+            'latency_mean': self.latency_sum / self.batches if self.batches else 0.0,
+            'latency_max': self.latency_max,
+        }
@@ -0,0 +1,230 @@
+# benchmarks for the hll / shll structures.
+# usage: python benchmark.py [name ...] [--sizes 1000000 10000000]
+# with no names, every benchmark is run.
+
+import argparse
+import os
+import pickle
+import random
+import tempfile
+import time
+
+from hashes import HASHES
+from hll import HyperLogLog
+from shll import SlidingHyperLogLog
+
+
+def make_stream(n, seed=0):
+    # fake streaming data: random ints with a non decreasing timestamp t
+    rnd = random.Random(seed)
+    values = [rnd.randint(0, n) for i in range(n)]
+    timestamps = [i // 10 for i in range(n)]
+    return values, timestamps
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - start
+
+
+def bench_add_many(sizes, b=12, W=10000):
+    # Add in a loop vs. one AddMany call on the same stream
+    print("add_many: b=%d W=%d" % (b, W))
+    for n in sizes:
+        values, timestamps = make_stream(n)
+
+        def add_loop():
+            shll = SlidingHyperLogLog(b, W)
+            for val, t in zip(values, timestamps):
+                shll.Add(val, t)
+
+        def add_many():
+            shll = SlidingHyperLogLog(b, W)
+            shll.AddMany(values, timestamps)
+
+        t_loop = timed(add_loop)
+        t_many = timed(add_many)
+        print("  n=%-10d Add loop: %8.2fs  AddMany: %8.2fs  speedup: %.2fx" % (n, t_loop, t_many, t_loop / t_many))
+
+
+def bench_hashes(sizes, b=12, W=10000):
+    # Add in a loop with every hash strategy, on int and on str values
+    print("hashes: b=%d W=%d" % (b, W))
+    for n in sizes:
+        values, timestamps = make_stream(n)
+        str_values = [str(val) for val in values]
+        for hash_name in sorted(HASHES):
+            for kind, vals in (('int', values), ('str', str_values)):
+
+                def add_loop():
+                    shll = SlidingHyperLogLog(b, W, hash_name)
+                    for val, t in zip(vals, timestamps):
+                        shll.Add(val, t)
+
+                print("  n=%-10d %-5s %-4s Add loop: %8.2fs" % (n, hash_name, kind, timed(add_loop)))
+
+
+def bench_memory(sizes, b=16, W=100000):
+    # deep memory size and Add time of the list vs. the compact LFPM storage
+    print("memory: b=%d W=%d" % (b, W))
+    for n in sizes:
+        values, timestamps = make_stream(n)
+        for storage in ('list', 'compact'):
+            shll = SlidingHyperLogLog(b, W, storage=storage)
+
+            def add_loop():
+                for val, t in zip(values, timestamps):
+                    shll.Add(val, t)
+
+            elapsed = timed(add_loop)
+            print("  n=%-10d %-8s memory: %10d bytes  Add loop: %8.2fs" % (n, storage, shll.memory_usage(), elapsed))
+
+
+def bench_estimate(sizes, b=14, W=10000, batch=1000):
+    # a query after every small batch of Adds (dashboard pattern), for both classes
+    print("estimate: b=%d W=%d, a query every %d items" % (b, W, batch))
+    for n in sizes:
+        values, timestamps = make_stream(n)
+        hll = HyperLogLog(b)
+        shll = SlidingHyperLogLog(b, W)
+        t_hll = t_shll = 0.0
+        for start in range(0, n, batch):
+            for val, t in zip(values[start:start + batch], timestamps[start:start + batch]):
+                hll.Add(val)
+                shll.Add(val, t)
+            t_hll += timed(hll.EstimateCardinality)
+            # same t between batches: only the registers touched by the batch are recomputed
+            t_shll += timed(shll.EstimateCardinality, timestamps[-1], W)
+        queries = (n + batch - 1) // batch
+        print("  n=%-10d HyperLogLog: %8.1fus/query  SlidingHyperLogLog: %8.1fus/query"
+              % (n, 1e6 * t_hll / queries, 1e6 * t_shll / queries))
+
+
+def bench_batch(sizes, b=14, W=10000, steps=60):
+    # an alerting grid of (t, w) queries: one EstimateCardinality per query vs. a single EstimateCardinality_batch
+    windows = [W // 1000 or 1, W // 100 or 1, W // 10 or 1, W]
+    print("batch: b=%d W=%d, %d t's x %d w's" % (b, W, steps, len(windows)))
+    for n in sizes:
+        values, timestamps = make_stream(n)
+        shll = SlidingHyperLogLog(b, W)
+        shll.AddMany(values, timestamps)
+        queries = [(timestamps[-1] - k, w) for k in range(steps) for w in windows]
+
+        def one_by_one():
+            for t, w in queries:
+                shll.EstimateCardinality(t, w)
+
+        print("  n=%-10d EstimateCardinality x%d: %7.3fs  EstimateCardinality_batch: %7.3fs" %
+              (n, len(queries), timed(one_by_one), timed(shll.EstimateCardinality_batch, queries)))
+
+
+def bench_serialization(sizes, b=16, W=100000):
+    # pickle vs. to_bytes / from_bytes vs. a memory mapped load, with the first query after loading
+    print("serialization: b=%d W=%d" % (b, W))
+    path = os.path.join(tempfile.mkdtemp(), 'shll.bin')
+    for n in sizes:
+        values, timestamps = make_stream(n)
+        shll = SlidingHyperLogLog(b, W)
+        shll.AddMany(values, timestamps)
+        t = timestamps[-1]
+        pickled = pickle.dumps(shll)
+        shll.save(path)
+        t_pickle = timed(lambda: pickle.loads(pickled).EstimateCardinality(t))
+        t_load = timed(lambda: SlidingHyperLogLog.load(path).EstimateCardinality(t))
+        t_mmap = timed(lambda: SlidingHyperLogLog.load(path, mmap=True).EstimateCardinality(t))
+        print("  n=%-10d pickle: %9d bytes %7.3fs  save/load: %9d bytes %7.3fs  mmap load: %7.3fs"
+              % (n, len(pickled), t_pickle, os.path.getsize(path), t_load, t_mmap))
+
+
+def bench_monotonic(sizes, b=12, W=10000):
+    # integer ticks: the default Add / Merge vs. the monotonic mode, for both storages
+    print("monotonic: b=%d W=%d, integer ticks" % (b, W))
+    for n in sizes:
+        values, timestamps = make_stream(n)
+        for storage in ('list', 'compact'):
+            results = []
+            for monotonic in (False, True):
+                shll = SlidingHyperLogLog(b, W, storage=storage, time_type=int, monotonic=monotonic)
+                other = SlidingHyperLogLog(b, W, storage=storage, time_type=int, monotonic=monotonic)
+
+                def add_loop():
+                    for val, t in zip(values, timestamps):
+                        shll.Add(val, t)
+
+                t_add = timed(add_loop)
+                other.AddMany(values[::2], timestamps[::2])
+                results.append((t_add, timed(shll.Merge, other)))
+            (add_0, merge_0), (add_1, merge_1) = results
+            print("  n=%-10d %-8s Add: %7.3fs -> %7.3fs (%.2fx)  Merge: %7.3fs -> %7.3fs (%.2fx)" %
+                  (n, storage, add_0, add_1, add_0 / add_1, merge_0, merge_1, merge_0 / merge_1))
+
+
+def bench_parallel(sizes, b=14, W=10000):
+    # parallel ingestion with 1, 2, 4, ... processes, up to the number of cores
+    cores = os.cpu_count() or 1
+    counts = sorted(set([1 << k for k in range(cores.bit_length()) if 1 << k <= cores] + [cores]))
+    print("parallel: b=%d W=%d, %d cores" % (b, W, cores))
+    for n in sizes:
+        values, timestamps = make_stream(n)
+        base = None
+        for processes in counts:
+            t_hll = timed(HyperLogLog.from_iterable_parallel, values, b, 'sha1', processes)
+            t_shll = timed(SlidingHyperLogLog.from_stream_parallel, zip(values, timestamps), b, W, 'sha1', 'list', float,
+                           processes)
+            if base is None:
+                base = (t_hll, t_shll)
+            print("  n=%-10d processes=%-3d HyperLogLog: %8.2fs (%.2fx)  SlidingHyperLogLog: %8.2fs (%.2fx)"
+                  % (n, processes, t_hll, base[0] / t_hll, t_shll, base[1] / t_shll))
+
+
+def bench_merge(sizes, b=12, W=10000, count=200):
+    # merging count per-host sketches: chained pairwise Merge vs. a single merge_many, for both classes.
+    # every size n is split between the hosts
+    print("merge: b=%d W=%d, %d sketches" % (b, W, count))
+    for n in sizes:
+        values, timestamps = make_stream(n)
+        hlls = [HyperLogLog(b) for k in range(count)]
+        shlls = [SlidingHyperLogLog(b, W) for k in range(count)]
+        for k in range(count):
+            for val in values[k::count]:
+                hlls[k].Add(val)
+            shlls[k].AddMany(values[k::count], timestamps[k::count])
+
+        def chained(cls, sketches, *args):
+            merged = cls(b, *args)
+            for sketch in sketches:
+                merged.Merge(sketch)
+
+        def many(cls, sketches, *args):
+            cls(b, *args).merge_many(sketches)
+
+        print("  n=%-10d HyperLogLog: Merge x%d: %7.3fs  merge_many: %7.3fs" %
+              (n, count, timed(chained, HyperLogLog, hlls), timed(many, HyperLogLog, hlls)))
+        print("  n=%-10d SlidingHyperLogLog: Merge x%d: %7.3fs  merge_many: %7.3fs" %
+              (n, count, timed(chained, SlidingHyperLogLog, shlls, W), timed(many, SlidingHyperLogLog, shlls, W)))
+
+
+BENCHMARKS = {
+    'add_many': bench_add_many,
+    'batch': bench_batch,
+    'estimate': bench_estimate,
+    'hashes': bench_hashes,
+    'memory': bench_memory,
+    'merge': bench_merge,
+    'monotonic': bench_monotonic,
+    'parallel': bench_parallel,
+    'serialization': bench_serialization,
+}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="hll / shll benchmarks")
+    parser.add_argument('names', nargs='*', help="benchmarks to run, out of: %s (default: all)" % ", ".join(sorted(BENCHMARKS)))
+    parser.add_argument('--sizes', nargs='+', type=int, default=[1000000, 10000000], help="stream sizes")
+    args = parser.parse_args()
+    for name in args.names:
+        if name not in BENCHMARKS:
+            parser.error("unknown benchmark: %s" % name)
+    for name in args.names or sorted(BENCHMARKS):
+        BENCHMARKS[name](args.sizes)
@@ -0,0 +1,276 @@
+# reproducible benchmark and accuracy suite for HyperLogLog / SlidingHyperLogLog.
+#
+# every case is generated from a fixed seed, so two runs (e.g. on two commits) measure the same work.
+# for both classes it measures Add, Merge, EstimateCardinality (and, for the sliding sketch, cached
+# EstimateCardinality and EstimateCardinality_list): ops/sec, p50 / p99 latency, deep memory size and the
+# relative error against the exact count.
+# results are written as JSON, and --compare reports the regressions against an older result file.
+#
+# usage:
+#   python benchmark_suite.py [--out results.json] [--full] [--compare old.json] [--threshold 0.1]
+#   (--b / --W / --n / --dist override the grid)
+
+import argparse
+import json
+import platform
+import random
+import subprocess
+import sys
+import time
+
+from hll import HyperLogLog
+from shll import SlidingHyperLogLog
+
+
+# the default grid is quick (a couple of minutes); --full is the whole range of the structures (hours in pure Python)
+QUICK_GRID = {
+    'b': [4, 8, 12, 16],
+    'W': [1000, 100000],
+    'n': [100, 1000, 10000, 100000],
+    'dist': ['uniform', 'poisson', 'bursty'],
+}
+FULL_GRID = {
+    'b': list(range(4, 17)),
+    'W': [100, 1000, 100000],
+    'n': [10 ** k for k in range(2, 9)],
+    'dist': ['uniform', 'poisson', 'bursty'],
+}
+# the stream spans STREAM_WINDOWS max. windows, so old entries expire
+STREAM_WINDOWS = 4
+# number of individually timed operations for the latency percentiles
+LATENCY_SAMPLES = 10000
+QUERY_REPEATS = 50
+MERGE_REPEATS = 5
+SEED = 2024
+
+
+def values(n, seed):
+    # n distinct values (the exact cardinality is n). the hash makes consecutive ints as good as random ones
+    base = seed << 40
+    return range(base, base + n)
+
+
+def timestamps(n, W, dist, seed):
+    # the timestamps of a stream of n items spanning STREAM_WINDOWS * W units of time:
+    # uniform - constant rate, poisson - exponential inter-arrival times,
+    # bursty - bursts of a geometric number of items (mean 100) sharing the same t, exponential gaps between them
+    span = float(STREAM_WINDOWS * W)
+    rnd = random.Random(seed)
+    if dist == 'uniform':
+        for k in range(n):
+            yield k * span / n
+    elif dist == 'poisson':
+        t = 0.0
+        for k in range(n):
+            t += rnd.expovariate(n / span)
+            yield t
+    elif dist == 'bursty':
+        t = 0.0
+        k = 0
+        while k < n:
+            burst = min(n - k, 1 + int(rnd.expovariate(1 / 100.0)))
+            t += rnd.expovariate(n / span / 100.0)
+            for j in range(burst):
+                yield t
+            k += burst
+    else:
+        raise ValueError("unknown timestamp distribution %r" % dist)
+
+
+def percentile(sorted_samples, q):
+    if not sorted_samples:
+        return 0.0
+    return sorted_samples[min(len(sorted_samples) - 1, int(q * len(sorted_samples)))]
+
+
+def record(results, cls, op, case, count, elapsed, latencies, memory=None, rel_error=None):
+    latencies = sorted(latencies)
+    result = dict(case)
+    result.update({
+        'class': cls,
+        'op': op,
+        'ops_per_sec': count / elapsed if elapsed > 0 else 0.0,
+        'p50_us': 1e6 * percentile(latencies, 0.50),
+        'p99_us': 1e6 * percentile(latencies, 0.99),
+        'memory_bytes': memory,
+        'rel_error': rel_error,
+    })
+    results.append(result)
+    print("  %-18s %-26s %-52s %12.0f ops/s  p50 %8.2fus  p99 %8.2fus%s" % (
+        cls, op, " ".join("%s=%s" % item for item in sorted(case.items())), result['ops_per_sec'],
+        result['p50_us'], result['p99_us'], "" if rel_error is None else "  err %.4f" % rel_error))
+
+
+def timed_calls(func, args_list):
+    # calls func(*args) for each args, timing every call. returns (total, latencies)
+    latencies = []
+    clock = time.perf_counter
+    for args in args_list:
+        start = clock()
+        func(*args)
+        latencies.append(clock() - start)
+    return sum(latencies), latencies
+
+
+def timed_adds(add, items):
+    # feeds all the items: the first LATENCY_SAMPLES ones are timed one by one, the rest as a whole.
+    # returns (total time, latencies)
+    items = iter(items)
+    total, latencies = timed_calls(add, (item for _, item in zip(range(LATENCY_SAMPLES), items)))
+    start = time.perf_counter()
+    for item in items:
+        add(*item)
+    return total + time.perf_counter() - start, latencies
+
+
+def bench_hll(results, b, n):
+    case = {'b': b, 'n': n}
+    hll = HyperLogLog(b)
+    elapsed, latencies = timed_adds(hll.Add, ((val,) for val in values(n, SEED)))
+    rel_error = abs(hll.EstimateCardinality() - n) / float(n)
+    record(results, 'HyperLogLog', 'Add', case, n, elapsed, latencies, hll.memory_usage(), rel_error)
+
+    elapsed, latencies = timed_calls(hll.EstimateCardinality, [()] * QUERY_REPEATS)
+    record(results, 'HyperLogLog', 'EstimateCardinality', case, QUERY_REPEATS, elapsed, latencies)
+
+    # merge with a sketch of n other distinct values: the union has 2n
+    other = HyperLogLog(b)
+    for val in values(n, SEED + 1):
+        other.Add(val)
+    data = hll.to_bytes()
+    targets = [HyperLogLog.from_bytes(data) for k in range(MERGE_REPEATS)]
+    elapsed, latencies = timed_calls(lambda target: target.Merge(other), [(target,) for target in targets])
+    rel_error = abs(targets[0].EstimateCardinality() - 2 * n) / float(2 * n)
+    record(results, 'HyperLogLog', 'Merge', case, MERGE_REPEATS, elapsed, latencies, None, rel_error)
+
+
+def window_counts(n, W, dist, seed, windows):
+    # the exact number of (distinct) items in every window (t_end - w, t_end), from a second pass on the stream
+    t_end = None
+    for t in timestamps(n, W, dist, seed):
+        t_end = t
+    counts = dict.fromkeys(windows, 0)
+    for t in timestamps(n, W, dist, seed):
+        for w in windows:
+            if t >= t_end - w:
+                counts[w] += 1
+    return t_end, counts
+
+
+def bench_shll(results, b, W, n, dist):
+    case = {'b': b, 'W': W, 'n': n, 'dist': dist}
+    windows = [W, W // 10, W // 100 or 1]
+    t_end, counts = window_counts(n, W, dist, SEED, windows)
+
+    shll = SlidingHyperLogLog(b, W)
+    elapsed, latencies = timed_adds(shll.Add, zip(values(n, SEED), timestamps(n, W, dist, SEED)))
+    errors = [abs(shll.EstimateCardinality(t_end, w) - counts[w]) / float(counts[w])
+              for w in windows if counts[w]]
+    rel_error = sum(errors) / len(errors) if errors else None
+    record(results, 'SlidingHyperLogLog', 'Add', case, n, elapsed, latencies, shll.memory_usage(), rel_error)
+
+    # cold queries: the cache is cleared before every query, so each one is a full scan of the registers
+    def cold_estimate(t, w):
+        shll.cache.clear()
+        shll.EstimateCardinality(t, w)
+
+    queries = [(t_end + k * 1e-9, W) for k in range(QUERY_REPEATS)]
+    elapsed, latencies = timed_calls(cold_estimate, queries)
+    record(results, 'SlidingHyperLogLog', 'EstimateCardinality', case, len(queries), elapsed, latencies)
+
+    # cached queries: the same window at an advancing t, each one only recomputes the registers that changed
+    shll.EstimateCardinality(t_end, W)
+    elapsed, latencies = timed_calls(shll.EstimateCardinality, queries)
+    record(results, 'SlidingHyperLogLog', 'EstimateCardinality_cached', case, len(queries), elapsed, latencies)
+
+    queries = [(t_end + k * 1e-9, list(windows)) for k in range(QUERY_REPEATS)]
+    elapsed, latencies = timed_calls(shll.EstimateCardinality_list, queries)
+    record(results, 'SlidingHyperLogLog', 'EstimateCardinality_list', case, len(queries), elapsed, latencies)
+
+    other = SlidingHyperLogLog(b, W)
+    other.AddMany(values(n, SEED + 1), list(timestamps(n, W, dist, SEED + 1)))
+    data = shll.to_bytes()
+    targets = [SlidingHyperLogLog.from_bytes(data) for k in range(MERGE_REPEATS)]
+    elapsed, latencies = timed_calls(lambda target: target.Merge(other), [(target,) for target in targets])
+    record(results, 'SlidingHyperLogLog', 'Merge', case, MERGE_REPEATS, elapsed, latencies)
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def result_key(result):
+    return (result['class'], result['op'], result.get('b'), result.get('W'), result.get('n'), result.get('dist'))
+
+
+def compare(results, baseline, threshold):
+    # prints the cases whose ops/sec dropped by more than threshold (a fraction) vs. the baseline results.
+    # returns the number of regressions
+    old = dict((result_key(result), result) for result in baseline['results'])
+    regressions = 0
+    for result in results:
+        before = old.get(result_key(result))
+        if before is None or not before['ops_per_sec']:
+            continue
+        ratio = result['ops_per_sec'] / before['ops_per_sec']
+        if ratio < 1 - threshold:
+            regressions += 1
+            print("REGRESSION %s: %.0f -> %.0f ops/s (%.2fx)" % (
+                result_key(result), before['ops_per_sec'], result['ops_per_sec'], ratio))
+    print("%d regressions (threshold %.0f%%) against %s" % (regressions, 100 * threshold, baseline['meta'].get('commit')))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="hll / shll benchmark and accuracy suite")
+    parser.add_argument('--out', default='bench_results.json', help="JSON result file")
+    parser.add_argument('--full', action='store_true', help="the full grid (b=4..16, n up to 1e8) - very slow")
+    parser.add_argument('--b', nargs='+', type=int)
+    parser.add_argument('--W', nargs='+', type=int)
+    parser.add_argument('--n', nargs='+', type=int)
+    parser.add_argument('--dist', nargs='+', choices=QUICK_GRID['dist'])
+    parser.add_argument('--compare', help="an older JSON result file to compare against")
+    parser.add_argument('--threshold', type=float, default=0.1, help="ops/sec drop reported as a regression")
+    args = parser.parse_args()
+
+    grid = dict(FULL_GRID if args.full else QUICK_GRID)
+    for name in grid:
+        if getattr(args, name):
+            grid[name] = getattr(args, name)
+
+    results = []
+    print("HyperLogLog")
+    for b in grid['b']:
+        for n in grid['n']:
+            bench_hll(results, b, n)
+    print("SlidingHyperLogLog")
+    for b in grid['b']:
+        for W in grid['W']:
+            for n in grid['n']:
+                for dist in grid['dist']:
+                    bench_shll(results, b, W, n, dist)
+
+    meta = {
+        'commit': git_commit(),
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'seed': SEED,
+        'grid': grid,
+    }
+    with open(args.out, 'w') as f:
+        json.dump({'meta': meta, 'results': results}, f, indent=1)
+    print("results written to %s" % args.out)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
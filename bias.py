@@ -0,0 +1,392 @@
+"""
+Empirical bias correction of the HyperLogLog raw estimate for small cardinalities (as in HyperLogLog++).
+
+The raw estimate alpha_m * m^2 / sum(2^-M[i]) overestimates up to about 5m distinct values. The tables below
+give, for every b, the mean raw estimate and its mean bias at n = 0, m/10, 2m/10, ..., 6m distinct values
+(both divided by m). They were measured by a seeded simulation of uniform hashing (see build_tables, run
+`python bias.py` to print them again). estimate_bias interpolates between the points.
+
+LINEAR_COUNTING_THRESHOLDS are the HyperLogLog++ cardinalities below which linear counting is more accurate
+than the corrected raw estimate, per b.
+"""
+
+import math
+
+# numpy is optional: it is only needed to rebuild the tables (build_tables).
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+# the raw estimate is corrected up to BIAS_RANGE * m
+BIAS_RANGE = 5
+# the tables have a point every m / TABLE_STEPS distinct values, up to TABLE_MAX * m
+TABLE_STEPS = 10
+TABLE_MAX = 6
+SEED = 2024
+
+LINEAR_COUNTING_THRESHOLDS = {
+    4: 10, 5: 20, 6: 40, 7: 80, 8: 220, 9: 400, 10: 900, 11: 1800,
+    12: 3100, 13: 6500, 14: 11500, 15: 20000, 16: 50000,
+}
+
+# b -> the mean raw estimate / m at every table point
+RAW_ESTIMATES = {
+    4: [
+        0.67300, 0.70233, 0.76390, 0.79613, 0.86356, 0.93510, 0.97235, 1.04988,
+        1.08998, 1.17312, 1.25991, 1.30481, 1.39709, 1.44444, 1.54177, 1.64216,
+        1.69358, 1.79807, 1.85159, 1.96002, 2.07038, 2.12631, 2.23973, 2.29699,
+        2.41303, 2.53054, 2.58941, 2.70898, 2.76900, 2.88985, 3.01161, 3.07240,
+        3.19517, 3.25686, 3.38009, 3.50370, 3.56589, 3.68994, 3.75156, 3.87637,
+        4.00062, 4.06246, 4.18779, 4.24999, 4.37538, 4.50004, 4.56214, 4.68790,
+        4.75035, 4.87582, 5.00056, 5.06368, 5.18803, 5.25048, 5.37468, 5.49971,
+        5.56206, 5.68719, 5.74915, 5.87450, 5.99969,
+    ],
+    5: [
+        0.69700, 0.74222, 0.78955, 0.83904, 0.89059, 0.96257, 1.01904, 1.07768,
+        1.13833, 1.20095, 1.28757, 1.35456, 1.42363, 1.49451, 1.56716, 1.66670,
+        1.74358, 1.82125, 1.90035, 1.98098, 2.09054, 2.17365, 2.25817, 2.34321,
+        2.42934, 2.54552, 2.63376, 2.72230, 2.81168, 2.90147, 3.02127, 3.11194,
+        3.20362, 3.29509, 3.38688, 3.50977, 3.60196, 3.69440, 3.78695, 3.87910,
+        4.00315, 4.09624, 4.18906, 4.28159, 4.37623, 4.50165, 4.59520, 4.68867,
+        4.78254, 4.87596, 5.00089, 5.09428, 5.18793, 5.28151, 5.37517, 5.50007,
+        5.59381, 5.68811, 5.78212, 5.87594, 6.00083,
+    ],
+    6: [
+        0.70900, 0.75467, 0.80240, 0.86073, 0.91306, 0.97654, 1.03340, 1.09215,
+        1.16311, 1.22588, 1.30194, 1.36891, 1.43780, 1.52010, 1.59256, 1.67931,
+        1.75521, 1.83271, 1.92495, 2.00484, 2.10014, 2.18246, 2.26633, 2.36527,
+        2.45090, 2.55222, 2.63931, 2.72736, 2.83121, 2.92053, 3.02567, 3.11639,
+        3.20728, 3.31309, 3.40444, 3.51067, 3.60281, 3.69489, 3.80280, 3.89468,
+        4.00319, 4.09659, 4.18933, 4.29761, 4.39085, 4.50015, 4.59361, 4.68702,
+        4.79608, 4.89029, 4.99905, 5.09155, 5.18466, 5.29488, 5.38900, 5.49900,
+        5.59293, 5.68645, 5.79706, 5.89034, 5.99984,
+    ],
+    7: [
+        0.71527, 0.76116, 0.81321, 0.86763, 0.92447, 0.98376, 1.04060, 1.10443,
+        1.17068, 1.23893, 1.30942, 1.37648, 1.45124, 1.52790, 1.60609, 1.68625,
+        1.76182, 1.84547, 1.93071, 2.01767, 2.10560, 2.18831, 2.27858, 2.37065,
+        2.46263, 2.55666, 2.64332, 2.73805, 2.83395, 2.93036, 3.02809, 3.11737,
+        3.21509, 3.31298, 3.41234, 3.51197, 3.60357, 3.70349, 3.80359, 3.90410,
+        4.00500, 4.09740, 4.19833, 4.29834, 4.39917, 4.49994, 4.59319, 4.69452,
+        4.79507, 4.89680, 4.99835, 5.09198, 5.19282, 5.29347, 5.39523, 5.49782,
+        5.59133, 5.69234, 5.79410, 5.89652, 5.99830,
+    ],
+    8: [
+        0.71827, 0.76622, 0.81845, 0.87087, 0.92792, 0.98714, 1.04647, 1.11037,
+        1.17399, 1.24221, 1.31287, 1.38265, 1.45712, 1.53066, 1.60918, 1.68968,
+        1.76836, 1.85174, 1.93345, 2.01994, 2.10801, 2.19388, 2.28403, 2.37230,
+        2.46450, 2.55789, 2.64873, 2.74398, 2.83647, 2.93284, 3.03006, 3.12366,
+        3.22203, 3.31714, 3.41512, 3.51428, 3.60977, 3.70911, 3.80506, 3.90528,
+        4.00570, 4.10297, 4.20370, 4.30095, 4.40236, 4.50436, 4.60126, 4.70188,
+        4.79940, 4.90105, 5.00343, 5.10034, 5.20154, 5.29846, 5.39997, 5.50250,
+        5.60034, 5.70173, 5.79913, 5.90083, 6.00277,
+    ],
+    9: [
+        0.71978, 0.76877, 0.81998, 0.87352, 0.92945, 0.98880, 1.04918, 1.11191,
+        1.17694, 1.24423, 1.31470, 1.38586, 1.45923, 1.53447, 1.61155, 1.69172,
+        1.77203, 1.85396, 1.93707, 2.02185, 2.10981, 2.19707, 2.28580, 2.37528,
+        2.46613, 2.55903, 2.65212, 2.74547, 2.83999, 2.93465, 3.03166, 3.12701,
+        3.22279, 3.31979, 3.41616, 3.51510, 3.61296, 3.71090, 3.80974, 3.90873,
+        4.00881, 4.10731, 4.20591, 4.30534, 4.40476, 4.50579, 4.60457, 4.70396,
+        4.80397, 4.90278, 5.00334, 5.10300, 5.20274, 5.30322, 5.40340, 5.50549,
+        5.60489, 5.70392, 5.80334, 5.90268, 6.00431,
+    ],
+    10: [
+        0.72054, 0.76955, 0.82088, 0.87503, 0.93093, 0.98963, 1.05009, 1.11293,
+        1.17832, 1.24530, 1.31507, 1.38638, 1.45966, 1.53537, 1.61197, 1.69153,
+        1.77207, 1.85391, 1.93785, 2.02313, 2.11013, 2.19724, 2.28600, 2.37636,
+        2.46708, 2.55953, 2.65186, 2.74516, 2.83944, 2.93414, 3.02990, 3.12563,
+        3.22211, 3.31964, 3.41635, 3.51456, 3.61153, 3.70988, 3.80861, 3.90682,
+        4.00632, 4.10482, 4.20390, 4.30438, 4.40390, 4.50293, 4.60275, 4.70216,
+        4.80167, 4.90119, 5.00156, 5.10157, 5.20099, 5.30096, 5.39971, 5.50018,
+        5.59970, 5.69864, 5.79857, 5.89806, 5.99864,
+    ],
+    11: [
+        0.72092, 0.76995, 0.82149, 0.87542, 0.93155, 0.99014, 1.05073, 1.11387,
+        1.17904, 1.24642, 1.31576, 1.38690, 1.46027, 1.53571, 1.61297, 1.69206,
+        1.77237, 1.85474, 1.93834, 2.02304, 2.10950, 2.19656, 2.28564, 2.37579,
+        2.46679, 2.55867, 2.65108, 2.74426, 2.83912, 2.93433, 3.02987, 3.12545,
+        3.22249, 3.31975, 3.41655, 3.51397, 3.61200, 3.71007, 3.80849, 3.90824,
+        4.00713, 4.10577, 4.20541, 4.30468, 4.40378, 4.50322, 4.60194, 4.70184,
+        4.80222, 4.90154, 5.00212, 5.10147, 5.20216, 5.30097, 5.40056, 5.49990,
+        5.59964, 5.69938, 5.79989, 5.89982, 6.00003,
+    ],
+    12: [
+        0.72111, 0.77025, 0.82181, 0.87558, 0.93183, 0.99039, 1.05102, 1.11413,
+        1.17914, 1.24634, 1.31590, 1.38744, 1.46086, 1.53615, 1.61302, 1.69187,
+        1.77225, 1.85464, 1.93831, 2.02390, 2.11049, 2.19791, 2.28715, 2.37735,
+        2.46872, 2.56015, 2.65279, 2.74593, 2.83934, 2.93441, 3.02998, 3.12643,
+        3.22343, 3.31986, 3.41773, 3.51509, 3.61300, 3.71147, 3.81014, 3.90873,
+        4.00744, 4.10653, 4.20518, 4.30380, 4.40285, 4.50249, 4.60207, 4.70179,
+        4.80102, 4.90021, 4.99933, 5.09816, 5.19787, 5.29774, 5.39755, 5.49780,
+        5.59821, 5.69848, 5.79787, 5.89800, 5.99653,
+    ],
+    13: [
+        0.72121, 0.77042, 0.82195, 0.87578, 0.93191, 0.99040, 1.05104, 1.11395,
+        1.17903, 1.24643, 1.31581, 1.38740, 1.46078, 1.53597, 1.61312, 1.69219,
+        1.77251, 1.85512, 1.93882, 2.02392, 2.11008, 2.19735, 2.28654, 2.37672,
+        2.46757, 2.55911, 2.65160, 2.74474, 2.83907, 2.93421, 3.02920, 3.12500,
+        3.22108, 3.31713, 3.41427, 3.51226, 3.61033, 3.70830, 3.80624, 3.90460,
+        4.00316, 4.10261, 4.20171, 4.30039, 4.39981, 4.49981, 4.59907, 4.69892,
+        4.79846, 4.89849, 4.99856, 5.09807, 5.19865, 5.29910, 5.39879, 5.49948,
+        5.59979, 5.69838, 5.79776, 5.89808, 5.99783,
+    ],
+    14: [
+        0.72125, 0.77047, 0.82207, 0.87602, 0.93210, 0.99059, 1.05120, 1.11414,
+        1.17930, 1.24665, 1.31625, 1.38781, 1.46131, 1.53679, 1.61410, 1.69325,
+        1.77411, 1.85662, 1.94044, 2.02508, 2.11157, 2.19917, 2.28834, 2.37818,
+        2.46895, 2.56121, 2.65351, 2.74713, 2.84158, 2.93605, 3.03096, 3.12763,
+        3.22377, 3.32078, 3.41796, 3.51504, 3.61237, 3.71105, 3.80971, 3.90875,
+        4.00745, 4.10619, 4.20586, 4.30569, 4.40538, 4.50535, 4.60476, 4.70437,
+        4.80436, 4.90428, 5.00438, 5.10338, 5.20358, 5.30334, 5.40240, 5.50162,
+        5.60171, 5.70205, 5.80135, 5.90124, 6.00052,
+    ],
+    15: [
+        0.72128, 0.77050, 0.82206, 0.87593, 0.93211, 0.99058, 1.05129, 1.11432,
+        1.17928, 1.24682, 1.31632, 1.38759, 1.46112, 1.53646, 1.61351, 1.69245,
+        1.77317, 1.85505, 1.93888, 2.02411, 2.11075, 2.19892, 2.28789, 2.37772,
+        2.46875, 2.56044, 2.65326, 2.74621, 2.84042, 2.93509, 3.03047, 3.12601,
+        3.22255, 3.31951, 3.41659, 3.51379, 3.61108, 3.70863, 3.80705, 3.90610,
+        4.00536, 4.10427, 4.20254, 4.30190, 4.40088, 4.50119, 4.60042, 4.69977,
+        4.79919, 4.89814, 4.99770, 5.09763, 5.19704, 5.29675, 5.39599, 5.49561,
+        5.59459, 5.69421, 5.79399, 5.89458, 5.99487,
+    ],
+    16: [
+        0.72129, 0.77044, 0.82195, 0.87581, 0.93187, 0.99027, 1.05086, 1.11392,
+        1.17900, 1.24630, 1.31580, 1.38719, 1.46062, 1.53611, 1.61345, 1.69238,
+        1.77296, 1.85556, 1.93899, 2.02402, 2.11037, 2.19831, 2.28696, 2.37721,
+        2.46801, 2.55977, 2.65270, 2.74616, 2.84031, 2.93547, 3.03089, 3.12662,
+        3.22268, 3.32003, 3.41672, 3.51433, 3.61154, 3.71021, 3.80874, 3.90726,
+        4.00623, 4.10532, 4.20423, 4.30312, 4.40257, 4.50233, 4.60153, 4.70051,
+        4.79962, 4.90000, 5.00014, 5.10043, 5.20019, 5.29997, 5.39983, 5.49850,
+        5.59904, 5.69830, 5.79844, 5.89820, 5.99696,
+    ],
+}
+
+# b -> the mean (raw estimate - n) / m at every table point
+BIASES = {
+    4: [
+        0.67300, 0.63983, 0.57640, 0.54613, 0.48856, 0.43510, 0.40985, 0.36238,
+        0.33998, 0.29812, 0.25991, 0.24231, 0.20959, 0.19444, 0.16677, 0.14216,
+        0.13108, 0.11057, 0.10159, 0.08502, 0.07038, 0.06381, 0.05223, 0.04699,
+        0.03803, 0.03054, 0.02691, 0.02148, 0.01900, 0.01485, 0.01161, 0.00990,
+        0.00767, 0.00686, 0.00509, 0.00370, 0.00339, 0.00244, 0.00156, 0.00137,
+        0.00062, -0.00004, 0.00029, -0.00001, 0.00038, 0.00004, -0.00036, 0.00040,
+        0.00035, 0.00082, 0.00056, 0.00118, 0.00053, 0.00048, -0.00032, -0.00029,
+        -0.00044, -0.00031, -0.00085, -0.00050, -0.00031,
+    ],
+    5: [
+        0.69700, 0.64847, 0.60205, 0.55779, 0.51559, 0.46257, 0.42529, 0.39018,
+        0.35708, 0.32595, 0.28757, 0.26081, 0.23613, 0.21326, 0.19216, 0.16670,
+        0.14983, 0.13375, 0.11910, 0.10598, 0.09054, 0.07990, 0.07067, 0.06196,
+        0.05434, 0.04552, 0.04001, 0.03480, 0.03043, 0.02647, 0.02127, 0.01819,
+        0.01612, 0.01384, 0.01188, 0.00977, 0.00821, 0.00690, 0.00570, 0.00410,
+        0.00315, 0.00249, 0.00156, 0.00034, 0.00123, 0.00165, 0.00145, 0.00117,
+        0.00129, 0.00096, 0.00089, 0.00053, 0.00043, 0.00026, 0.00017, 0.00007,
+        0.00006, 0.00061, 0.00087, 0.00094, 0.00083,
+    ],
+    6: [
+        0.70900, 0.66092, 0.61490, 0.56386, 0.52244, 0.47654, 0.43965, 0.40465,
+        0.36624, 0.33525, 0.30194, 0.27516, 0.25030, 0.22322, 0.20193, 0.17931,
+        0.16146, 0.14521, 0.12808, 0.11422, 0.10014, 0.08871, 0.07883, 0.06839,
+        0.06027, 0.05222, 0.04556, 0.03986, 0.03433, 0.02991, 0.02567, 0.02264,
+        0.01978, 0.01622, 0.01381, 0.01067, 0.00906, 0.00739, 0.00593, 0.00406,
+        0.00319, 0.00284, 0.00183, 0.00073, 0.00023, 0.00015, -0.00014, -0.00048,
+        -0.00080, -0.00033, -0.00095, -0.00220, -0.00284, -0.00199, -0.00162, -0.00100,
+        -0.00082, -0.00105, 0.00019, -0.00029, -0.00016,
+    ],
+    7: [
+        0.71527, 0.66741, 0.61790, 0.57076, 0.52603, 0.48376, 0.44685, 0.40912,
+        0.37381, 0.34050, 0.30942, 0.28273, 0.25593, 0.23102, 0.20766, 0.18625,
+        0.16807, 0.15016, 0.13384, 0.11923, 0.10560, 0.09456, 0.08326, 0.07378,
+        0.06419, 0.05666, 0.04957, 0.04273, 0.03708, 0.03192, 0.02809, 0.02362,
+        0.01978, 0.01610, 0.01391, 0.01197, 0.00982, 0.00818, 0.00672, 0.00566,
+        0.00500, 0.00365, 0.00302, 0.00147, 0.00074, -0.00006, -0.00056, -0.00079,
+        -0.00181, -0.00164, -0.00165, -0.00177, -0.00249, -0.00340, -0.00321, -0.00218,
+        -0.00242, -0.00297, -0.00277, -0.00192, -0.00170,
+    ],
+    8: [
+        0.71827, 0.66856, 0.61923, 0.57399, 0.52948, 0.48714, 0.44882, 0.41115,
+        0.37712, 0.34377, 0.31287, 0.28499, 0.25791, 0.23378, 0.21075, 0.18968,
+        0.17071, 0.15252, 0.13657, 0.12150, 0.10801, 0.09623, 0.08482, 0.07542,
+        0.06606, 0.05789, 0.05107, 0.04476, 0.03959, 0.03440, 0.03006, 0.02600,
+        0.02281, 0.02026, 0.01668, 0.01428, 0.01212, 0.00989, 0.00818, 0.00685,
+        0.00570, 0.00531, 0.00448, 0.00407, 0.00392, 0.00436, 0.00361, 0.00266,
+        0.00252, 0.00261, 0.00343, 0.00268, 0.00232, 0.00159, 0.00154, 0.00250,
+        0.00269, 0.00251, 0.00226, 0.00240, 0.00277,
+    ],
+    9: [
+        0.71978, 0.66916, 0.62076, 0.57470, 0.53101, 0.48880, 0.44957, 0.41269,
+        0.37811, 0.34579, 0.31470, 0.28626, 0.26001, 0.23564, 0.21311, 0.19172,
+        0.17242, 0.15474, 0.13824, 0.12341, 0.10981, 0.09746, 0.08658, 0.07645,
+        0.06770, 0.05903, 0.05251, 0.04625, 0.04116, 0.03622, 0.03166, 0.02740,
+        0.02357, 0.02097, 0.01772, 0.01510, 0.01335, 0.01168, 0.01092, 0.01030,
+        0.00881, 0.00770, 0.00669, 0.00651, 0.00632, 0.00579, 0.00496, 0.00474,
+        0.00514, 0.00434, 0.00334, 0.00339, 0.00352, 0.00439, 0.00497, 0.00549,
+        0.00528, 0.00470, 0.00452, 0.00425, 0.00431,
+    ],
+    10: [
+        0.72054, 0.66994, 0.62167, 0.57523, 0.53152, 0.48963, 0.45048, 0.41371,
+        0.37851, 0.34589, 0.31507, 0.28678, 0.26044, 0.23557, 0.21255, 0.19153,
+        0.17246, 0.15469, 0.13804, 0.12372, 0.11013, 0.09764, 0.08679, 0.07656,
+        0.06767, 0.05953, 0.05225, 0.04594, 0.03964, 0.03472, 0.02990, 0.02602,
+        0.02290, 0.01984, 0.01694, 0.01456, 0.01192, 0.01066, 0.00881, 0.00741,
+        0.00632, 0.00521, 0.00468, 0.00458, 0.00448, 0.00293, 0.00314, 0.00294,
+        0.00187, 0.00177, 0.00156, 0.00196, 0.00177, 0.00115, 0.00029, 0.00018,
+        0.00009, -0.00058, -0.00123, -0.00136, -0.00136,
+    ],
+    11: [
+        0.72092, 0.67034, 0.62178, 0.57562, 0.53165, 0.49014, 0.45112, 0.41417,
+        0.37923, 0.34652, 0.31576, 0.28729, 0.26056, 0.23591, 0.21307, 0.19206,
+        0.17276, 0.15503, 0.13854, 0.12314, 0.10950, 0.09695, 0.08593, 0.07599,
+        0.06688, 0.05867, 0.05147, 0.04455, 0.03931, 0.03443, 0.02987, 0.02585,
+        0.02278, 0.01994, 0.01665, 0.01397, 0.01239, 0.01036, 0.00868, 0.00834,
+        0.00713, 0.00616, 0.00570, 0.00488, 0.00388, 0.00322, 0.00233, 0.00214,
+        0.00242, 0.00164, 0.00212, 0.00186, 0.00245, 0.00117, 0.00066, -0.00010,
+        0.00003, -0.00033, 0.00008, -0.00008, 0.00003,
+    ],
+    12: [
+        0.72111, 0.67039, 0.62185, 0.57578, 0.53193, 0.49039, 0.45117, 0.41418,
+        0.37933, 0.34643, 0.31590, 0.28759, 0.26091, 0.23634, 0.21311, 0.19187,
+        0.17239, 0.15468, 0.13850, 0.12400, 0.11049, 0.09806, 0.08720, 0.07754,
+        0.06881, 0.06015, 0.05294, 0.04598, 0.03953, 0.03451, 0.02998, 0.02658,
+        0.02348, 0.02006, 0.01783, 0.01509, 0.01315, 0.01152, 0.01033, 0.00883,
+        0.00744, 0.00667, 0.00523, 0.00399, 0.00295, 0.00249, 0.00222, 0.00184,
+        0.00121, 0.00031, -0.00067, -0.00169, -0.00208, -0.00206, -0.00235, -0.00220,
+        -0.00164, -0.00147, -0.00193, -0.00191, -0.00347,
+    ],
+    13: [
+        0.72121, 0.67045, 0.62200, 0.57586, 0.53201, 0.49040, 0.45107, 0.41400,
+        0.37910, 0.34652, 0.31581, 0.28742, 0.26083, 0.23604, 0.21322, 0.19219,
+        0.17253, 0.15517, 0.13889, 0.12402, 0.11008, 0.09737, 0.08659, 0.07680,
+        0.06767, 0.05911, 0.05162, 0.04479, 0.03914, 0.03431, 0.02920, 0.02502,
+        0.02113, 0.01720, 0.01437, 0.01226, 0.01036, 0.00835, 0.00631, 0.00470,
+        0.00316, 0.00263, 0.00176, 0.00047, -0.00009, -0.00019, -0.00090, -0.00103,
+        -0.00146, -0.00141, -0.00144, -0.00191, -0.00130, -0.00083, -0.00111, -0.00052,
+        -0.00018, -0.00158, -0.00217, -0.00182, -0.00217,
+    ],
+    14: [
+        0.72125, 0.67050, 0.62212, 0.57603, 0.53213, 0.49059, 0.45123, 0.41419,
+        0.37931, 0.34669, 0.31625, 0.28783, 0.26135, 0.23680, 0.21414, 0.19325,
+        0.17414, 0.15667, 0.14045, 0.12512, 0.11157, 0.09920, 0.08838, 0.07820,
+        0.06899, 0.06121, 0.05353, 0.04718, 0.04159, 0.03608, 0.03096, 0.02766,
+        0.02382, 0.02080, 0.01800, 0.01504, 0.01240, 0.01110, 0.00972, 0.00878,
+        0.00745, 0.00622, 0.00590, 0.00570, 0.00541, 0.00535, 0.00478, 0.00442,
+        0.00437, 0.00432, 0.00438, 0.00341, 0.00363, 0.00335, 0.00244, 0.00162,
+        0.00173, 0.00210, 0.00137, 0.00128, 0.00052,
+    ],
+    15: [
+        0.72128, 0.67053, 0.62208, 0.57594, 0.53211, 0.49058, 0.45131, 0.41434,
+        0.37929, 0.34683, 0.31632, 0.28761, 0.26114, 0.23647, 0.21351, 0.19245,
+        0.17320, 0.15507, 0.13889, 0.12411, 0.11075, 0.09894, 0.08790, 0.07773,
+        0.06875, 0.06044, 0.05328, 0.04623, 0.04043, 0.03509, 0.03047, 0.02603,
+        0.02257, 0.01953, 0.01660, 0.01379, 0.01111, 0.00865, 0.00706, 0.00611,
+        0.00536, 0.00429, 0.00256, 0.00191, 0.00089, 0.00119, 0.00044, -0.00021,
+        -0.00080, -0.00186, -0.00230, -0.00235, -0.00294, -0.00323, -0.00401, -0.00439,
+        -0.00539, -0.00577, -0.00600, -0.00541, -0.00513,
+    ],
+    16: [
+        0.72129, 0.67045, 0.62196, 0.57582, 0.53188, 0.49027, 0.45087, 0.41392,
+        0.37901, 0.34630, 0.31580, 0.28720, 0.26062, 0.23612, 0.21346, 0.19238,
+        0.17297, 0.15557, 0.13900, 0.12402, 0.11037, 0.09832, 0.08696, 0.07722,
+        0.06801, 0.05977, 0.05271, 0.04616, 0.04033, 0.03547, 0.03089, 0.02663,
+        0.02268, 0.02004, 0.01672, 0.01433, 0.01155, 0.01022, 0.00875, 0.00726,
+        0.00623, 0.00533, 0.00423, 0.00313, 0.00257, 0.00233, 0.00153, 0.00052,
+        -0.00036, 0.00001, 0.00014, 0.00044, 0.00019, -0.00001, -0.00017, -0.00150,
+        -0.00095, -0.00170, -0.00154, -0.00180, -0.00304,
+    ],
+}
+
+
+def estimate_bias(E, b):
+    # the expected bias of a raw estimate E with m = 2^b registers, linearly interpolated between the table points
+    raw = RAW_ESTIMATES[b]
+    bias = BIASES[b]
+    m = 1 << b
+    x = E / float(m)
+    if x <= raw[0]:
+        return bias[0] * m
+    if x >= raw[-1]:
+        return bias[-1] * m
+    # the raw estimates grow with n: binary search the segment of x
+    lo, hi = 0, len(raw) - 1
+    while hi - lo > 1:
+        mid = (lo + hi) // 2
+        if raw[mid] <= x:
+            lo = mid
+        else:
+            hi = mid
+    f = (x - raw[lo]) / (raw[hi] - raw[lo])
+    return (bias[lo] + f * (bias[hi] - bias[lo])) * m
+
+
+def corrected_estimate(E, m, V):
+    # the HyperLogLog++ estimate, given the raw estimate E and the number of zero registers V:
+    # the bias corrected raw estimate up to 5m, linear counting while it is below the threshold of b
+    b = m.bit_length() - 1
+    if E <= BIAS_RANGE * m:
+        E -= estimate_bias(E, b)
+    if V > 0:
+        H = m * math.log(m / float(V))
+        if H <= LINEAR_COUNTING_THRESHOLDS[b]:
+            return H
+    return E
+
+
+def simulate_raw_estimates(b, runs, rng):
+    # the mean raw estimate at every table point, over runs simulated sketches (all updated at once).
+    # a uniform 64 bit hash puts every value in a uniform register, with a geometric rank capped at 65 - b
+    from hll import calculate_alpha_m
+    m = 1 << b
+    alpha_m = calculate_alpha_m(b)
+    registers = np.zeros(runs * m, dtype=np.int64)
+    offsets = (np.arange(runs, dtype=np.int64) * m)[:, None]
+    means = []
+    n = 0
+    for k in range(TABLE_MAX * TABLE_STEPS + 1):
+        target = k * m // TABLE_STEPS
+        if target > n:
+            count = target - n
+            idx = offsets + rng.integers(0, m, size=(runs, count))
+            ranks = np.minimum(rng.geometric(0.5, size=(runs, count)), 65 - b)
+            np.maximum.at(registers, idx.ravel(), ranks.ravel())
+            n = target
+        Z_inv = np.ldexp(1.0, -registers.reshape(runs, m)).sum(axis=1)
+        means.append(float(np.mean(alpha_m * m * m / Z_inv)))
+    return means
+
+
+def build_tables(seed=SEED, samples=1 << 22):
+    # (RAW_ESTIMATES, BIASES) for b = 4..16. every b averages about samples / m simulated sketches
+    if np is None:
+        raise ImportError("numpy is required to build the bias tables")
+    rng = np.random.default_rng(seed)
+    raw_estimates = {}
+    biases = {}
+    for b in range(4, 17):
+        m = 1 << b
+        means = simulate_raw_estimates(b, max(64, samples // m), rng)
+        raw_estimates[b] = [E / m for E in means]
+        biases[b] = [(E - k * m // TABLE_STEPS) / m for k, E in enumerate(means)]
+    return raw_estimates, biases
+
+
+def format_table(name, table):
+    lines = ["%s = {" % name]
+    for b in sorted(table):
+        values = ["%.5f" % x for x in table[b]]
+        lines.append("    %d: [" % b)
+        for k in range(0, len(values), 8):
+            lines.append("        " + ", ".join(values[k:k + 8]) + ",")
+        lines.append("    ],")
+    lines.append("}")
+    return "\n".join(lines)
+
+
+if __name__ == '__main__':
+    raw_estimates, biases = build_tables()
+    print(format_table("RAW_ESTIMATES", raw_estimates))
+    print("")
+    print(format_table("BIASES", biases))
@@ -0,0 +1,156 @@
+"""
+Hash strategies for the HyperLogLog / Sliding HyperLogLog structures.
+Every strategy maps a value into a 64 bit word x = h(v), which is then split by the sketch into
+the register index i (first b bits) and w (the rest of the word).
+
+Built in strategies:
+'sha1' - the 64 upper bits of sha1. the default, compatible with sketches built by older versions.
+'fast' - non cryptographic: ints (and floats) go through the splitmix64 mixer, applied directly on their bits,
+         str and bytes go through blake2b with a 64 bit digest.
+
+Sketches built with different strategies cannot be merged, since the same value lands in different registers.
+"""
+
+import struct
+from hashlib import sha1, blake2b
+# numpy is optional: it is only used to vectorize the batch (hash_many) path.
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+MASK_64 = (1 << 64) - 1
+# ints in this range are mixed directly (as their 64 bit two's complement), bigger ones are hashed as bytes
+INT_MIN = -(1 << 63)
+INT_MAX = 1 << 64
+
+# types that are hashed by their str() form
+TEXT_TYPES = (int, float, str)
+
+
+def val_to_bytes(val):
+    # converts a value to the bytes that are hashed by the byte hashes.
+    # sha1 takes *bytes* input. converting int,float to str first, then str->bytes.
+    # float str() gives us up to first 15 decimals after point.
+    if np is not None and isinstance(val, np.generic):
+        # numpy scalars are hashed by their python value, like the values of numpy arrays in the batch paths
+        val = val.item()
+    if isinstance(val, (int, float)):
+        val = str(val)
+    if isinstance(val, str):
+        val = val.encode('utf-8')
+    return val
+
+
+def sha1_64(val):
+    # the 64 upper bits of the sha1 digest, big endian. this is the original hash of hll.py / shll.py
+    return int.from_bytes(sha1(val_to_bytes(val)).digest()[:8], 'big')
+
+
+def sha1_64_many(values):
+    if np is not None and isinstance(values, np.ndarray):
+        # numpy scalars are hashed by their python value, exactly like in sha1_64
+        values = values.tolist()
+    # the common types are converted inline (saves a function call per value)
+    digests = b''.join([sha1(str(val).encode('utf-8') if type(val) in TEXT_TYPES else val_to_bytes(val)).digest()[:8]
+                        for val in values])
+    if np is not None:
+        return np.frombuffer(digests, dtype='>u8').astype(np.uint64)
+    return [int.from_bytes(digests[k:k + 8], 'big') for k in range(0, len(digests), 8)]
+
+
+def splitmix64(x):
+    # the splitmix64 finalizer: a fast 64 bit mixer with good avalanche. x is a 64 bit unsigned int
+    z = (x + 0x9E3779B97F4A7C15) & MASK_64
+    z = ((z ^ (z >> 30)) * 0xBF58476D1CE4E5B9) & MASK_64
+    z = ((z ^ (z >> 27)) * 0x94D049BB133111EB) & MASK_64
+    return z ^ (z >> 31)
+
+
+def splitmix64_array(x):
+    # vectorized splitmix64 over a numpy uint64 array. numpy uint64 arithmetic wraps around mod 2^64.
+    with np.errstate(over='ignore'):
+        z = x + np.uint64(0x9E3779B97F4A7C15)
+        z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return z ^ (z >> np.uint64(31))
+
+
+def blake2b_64(data):
+    # blake2b with a 64 bit digest - the fastest 64 bit byte hash in the standard library
+    return int.from_bytes(blake2b(data, digest_size=8).digest(), 'big')
+
+
+def fast_64(val):
+    # ints are mixed directly (no str() round trip). note: a negative int and its 2^64 complement collide.
+    if isinstance(val, int) and INT_MIN <= val < INT_MAX:
+        return splitmix64(val & MASK_64)
+    # floats are mixed by their IEEE 754 bits
+    if isinstance(val, float):
+        return splitmix64(struct.unpack('<Q', struct.pack('<d', val))[0])
+    if np is not None and isinstance(val, np.generic):
+        # numpy scalars are hashed by their python value, like the values of numpy arrays in fast_64_many
+        return fast_64(val.item())
+    return blake2b_64(val_to_bytes(val))
+
+
+def fast_64_many(values):
+    if np is not None and isinstance(values, np.ndarray):
+        # whole numpy arrays of ints / floats are mixed with array ops
+        if values.dtype.kind in 'iu' and values.dtype.itemsize <= 8:
+            return splitmix64_array(values.astype(np.int64).view(np.uint64) if values.dtype.kind == 'i'
+                                    else values.astype(np.uint64))
+        if values.dtype == np.float64:
+            return splitmix64_array(values.view(np.uint64))
+        values = values.tolist()
+    # str is the common non int type, hashed inline (saves the function calls of fast_64 per value)
+    x = [blake2b_64(val.encode('utf-8')) if type(val) is str else fast_64(val) for val in values]
+    if np is not None:
+        return np.array(x, dtype=np.uint64)
+    return x
+
+
+class HashFunction(object):
+    """ A hash strategy.
+    name - the id of the strategy, recorded on the sketch (Merge compares it)
+    hash(val) - the 64 bit hash of a single value, as an int
+    hash_many(values) - the hashes of a batch of values: a numpy uint64 array if numpy is installed, a list otherwise
+    """
+
+    def __init__(self, name, hash, hash_many=None):
+        self.name = name
+        self.hash = hash
+        if hash_many is None:
+            hash_many = self.default_hash_many
+        self.hash_many = hash_many
+
+    def default_hash_many(self, values):
+        if np is not None and isinstance(values, np.ndarray):
+            values = values.tolist()
+        x = [self.hash(val) for val in values]
+        if np is not None:
+            return np.array(x, dtype=np.uint64)
+        return x
+
+    def __repr__(self):
+        return "HashFunction(%r)" % self.name
+
+
+HASHES = {}
+
+
+def register_hash(name, hash, hash_many=None):
+    # registers a custom hash strategy. hash(val) must return a (well mixed) 64 bit unsigned int.
+    HASHES[name] = HashFunction(name, hash, hash_many)
+    return HASHES[name]
+
+
+def get_hash(name):
+    if name not in HASHES:
+        raise ValueError("Unknown hash function %r, should be one of: %s" % (name, ", ".join(sorted(HASHES))))
+    return HASHES[name]
+
+
+register_hash('sha1', sha1_64, sha1_64_many)
+register_hash('fast', fast_64, fast_64_many)
@@ -1,7 +1,13 @@
 
 import math
-#can import sha256 instead of sha1 too, but it's a bit slower!
-from hashlib import sha1
+import sys
+from array import array
+from itertools import chain
+from bias import corrected_estimate
+from hashes import get_hash
+from metrics import timed
+from parallel import DEFAULT_CHUNK_SIZE, build_parallel
+from serialization import Header, HEADER, HLL_SUMS, KIND_HLL, NATIVE, read_file, write_file, map_file
 
 
 def calculate_alpha_m(b):
@@ -18,6 +24,10 @@ def calculate_alpha_m(b):
     # for values b >=7, this equation is defined in the article.
     # 1 << b is the bit 1 that is shifted b bits to the left. so 1 << b = 2^b = m
     return 0.7213 / (1.0 + 1.079 / (1 << b))
+
+
+# alpha_m of every b in range [4,16], computed once at import: the constructors only look it up
+ALPHA = dict((b, calculate_alpha_m(b)) for b in range(4, 17))
     
     
 def calculate_p_w(w, max_len):
@@ -36,6 +46,50 @@ def calculate_p_w(w, max_len):
     return p_w
 
 
+# 2^-k in fixed point: POW2_NEG[k] = 2^-k * 2^SCALE_BITS, for every possible register value k (0...64).
+# sums of these are exact ints, so the harmonic sum can be updated incrementally without any rounding drift.
+SCALE_BITS = 65
+POW2_NEG = [1 << (SCALE_BITS - k) for k in range(SCALE_BITS + 1)]
+
+
+def estimate_from_sum(alpha_m, m, Z_sum, V, bias_correction=False):
+    # the estimate E, given the fixed point harmonic sum of the registers Z_sum = sum(POW2_NEG[M[i]])
+    # and V = the number of registers equal to 0.
+    # Z_inv = the INVERSE of the indicator Z (Z definition can be shown in paper)
+    # Z = 1 / Z_inv, which is what we do when computing E (E = alpha_m * m * m * Z)
+    Z_inv = math.ldexp(Z_sum, -SCALE_BITS)
+    E = alpha_m * float(m ** 2) / Z_inv
+
+    if bias_correction:
+        # HyperLogLog++: empirical bias correction up to 5m, linear counting below the threshold of b (see bias.py)
+        return round(corrected_estimate(E, m, V))
+
+    if (E <= 2.5*m):
+        # small range correlation
+        if V > 0:
+            E = m * math.log(m / float(V))
+
+    # Did not add large range correction from paper. Redundant because of the use of 64-bit hash functions.
+    return round(E)
+
+
+def sparse_sum(m, ranks):
+    # (Z_sum, V) of m registers, given the values of the non zero ones only
+    Z_sum = 0
+    k = 0
+    for R in ranks:
+        Z_sum += POW2_NEG[R]
+        k += 1
+    return Z_sum + (m - k) * POW2_NEG[0], m - k
+
+
+# sparse representation: every non zero register i is the int i << RANK_BITS | M[i] (R <= 61 fits 6 bits),
+# kept in a sorted uint32 array. new entries are buffered and merged into the array in bulk.
+RANK_BITS = 6
+RANK_MASK = (1 << RANK_BITS) - 1
+SPARSE_TYPECODE = 'I'
+
+
 
 
 class HyperLogLog:
@@ -44,10 +98,18 @@ class HyperLogLog:
     m = 2^b - the number of registers
     b -  (log 2 of m above)
     alpha_m - the const used for corrction of hash bias (read article)
-    M - an array of m registers, used as in the article
+    M - an array of m registers, used as in the article (None in sparse mode)
+    Z_sum - the harmonic sum of the registers in fixed point (sum of POW2_NEG[M[i]]), maintained by Add and Merge
+    V - the number of registers equal to 0, maintained by Add and Merge
+    hash_name - the id of the hash strategy used (see hashes.py)
+    sparse - sparse mode: the sorted encoded non zero registers (see RANK_BITS), None in dense mode
+    buffer - sparse mode: the encoded registers added since the last merge into sparse
+    start_sparse - the sketch was built in sparse mode (clear() goes back to it)
+    bias_correction - the estimate uses the empirical bias correction of HyperLogLog++ (see bias.py)
+    metrics - the runtime metrics of the sketch (a SketchMetrics, see metrics.py), None when off
     """
     
-    def __init__(self, param):
+    def __init__(self, param, hash_name='sha1', sparse=False, bias_correction=False, metrics=None):
         """
         The constructor of the class.
         We enable the end-user to use the constructor in one of two ways:
@@ -56,6 +118,12 @@ class HyperLogLog:
         2. Sending the allowed Std. error as a fraction (0 < r < 1)
         param then is of type float!
         Std. error is defined as in the article: (E' - E) / E where E is actual cardinality, E' is our estimate
+        hash_name selects the hash strategy (see hashes.py): 'sha1' (default) or 'fast'.
+        sparse=True starts in sparse mode: only the non zero registers are stored, until there are more
+        than m / 4 of them, then the sketch converts itself to the dense register array.
+        bias_correction=True estimates with the empirical bias correction of HyperLogLog++ (see bias.py),
+        more accurate than the plain small range correction up to 5m distinct values.
+        metrics turns on the runtime metrics (a SketchMetrics, see metrics.py).
         """
         
         if type(param) == int:
@@ -80,9 +148,28 @@ class HyperLogLog:
         self.b = b
         # m = 2 ** b (2^b)
         self.m = 1 << b 
-        self.alpha_m = calculate_alpha_m(b)
-        # M(1)... M(m) = 0 // m registers initialized            
-        self.M = [ 0 for i in range(self.m) ]
+        self.alpha_m = ALPHA[b]
+        # all the registers are 0: 2^0 each
+        self.Z_sum = self.m * POW2_NEG[0]
+        self.V = self.m
+        if sparse:
+            # no register array until the sketch is dense
+            self.M = None
+            self.sparse = array(SPARSE_TYPECODE)
+            self.buffer = []
+        else:
+            # M(1)... M(m) = 0 // m registers initialized            
+            self.M = [0] * self.m
+            self.sparse = None
+            self.buffer = None
+        # more than sparse_limit non zero registers: dense mode
+        self.sparse_limit = self.m >> 2
+        self.start_sparse = sparse
+        self.bias_correction = bias_correction
+        self.metrics = metrics
+        # the hash strategy. raises ValueError for an unknown name
+        self.hash_func = get_hash(hash_name)
+        self.hash_name = hash_name
 
 
 
@@ -94,62 +181,318 @@ class HyperLogLog:
         # w = <xb+1 xb+2 ... >
         # M[i] = max(M[i], p(w))
         
-        # sha1 takes *bytes* input. converting int,float to str first, so we need to convert str->bytes.
-        if isinstance(val,int):
-            # convert int to str. can also use an alternate way! (convert into bytes directly)
-            # val = val.to_bytes(*size* = 32/64/.. , 'big') 
-            val = str(val)
-        if isinstance(val,float):
-            #converts float to str. gives us up to first 15 decimals after point.
-            # self question: can we convert to bytes as an alternate? even if yes, no need because we are hashing the int/float anyway.
-            val = str(val)
-        if isinstance(val, str):
-            val = val.encode('utf-8')
-
-
-        # hashing the input word - here we used sha1 - can use sha256 too!
-        #x = struct.unpack('!Q', sha1(val).digest()[:8])[0] - needs to import struct
-        # we use this line now - we can use 'little' instead of big endian. (in practice we take the 64 upper bits of the hash!)
-        # note: hex(x) gives us x in hex. hex length = 4 bit so we can make sure that hex(x) is of length 16
-        x = int.from_bytes(sha1(val).digest()[:8],'big')
+        if self.metrics is not None:
+            self.metrics.adds += 1
+
+        # hashing the input word with the hash strategy of this sketch (sha1 by default, see hashes.py)
+        # x is a 64 bit word
+        x = self.hash_func.hash(val)
         # obtaining i: by bitwise and - stripping the first b bits only! (m-1 = 2^b-1 = 11..1 for b bits!)
         i = x & (self.m - 1)
         # w - is the rest of the word. shifting the word b bits to the right.
         w = x >> self.b
         # updating the corresponding register, paying attention that p(w) is b bits shorter.
-        self.M[i] = max(self.M[i], calculate_p_w(w, 64 - self.b))
+        p_w = calculate_p_w(w, 64 - self.b)
+        if self.sparse is not None:
+            # sparse mode: buffered, merged into the sorted entries in bulk
+            self.buffer.append(i << RANK_BITS | p_w)
+            if len(self.buffer) >= max(16, self.sparse_limit >> 2):
+                self.flush_sparse()
+            return
+        old = self.M[i]
+        if p_w > old:
+            self.M[i] = p_w
+            # the register changed: update the harmonic sum and the zero count (O(1) queries)
+            self.Z_sum += POW2_NEG[p_w] - POW2_NEG[old]
+            if old == 0:
+                self.V -= 1
         
     
-    def Merge(self, hll_2):
-        # Merges this hll object with another hll_2 object.(Optional)
-        # this hll is updated only, while hll_2 is not.
+    def flush_sparse(self):
+        # merges the buffer into the sorted sparse entries, keeping the highest R of every register.
+        # converts the sketch to dense mode once there are more than sparse_limit non zero registers
+        if not self.buffer:
+            return
+        entries = array(SPARSE_TYPECODE)
+        last = -1
+        # sorted by register, then by R: the last entry of every register has its highest R
+        for e in sorted(chain(self.sparse, self.buffer)):
+            if e >> RANK_BITS == last:
+                entries[-1] = e
+            else:
+                entries.append(e)
+                last = e >> RANK_BITS
+        self.sparse = entries
+        self.buffer = []
+        if len(entries) > self.sparse_limit:
+            self.to_dense()
+
+
+    def to_dense(self):
+        # converts a sparse sketch to the dense register array (nothing to do if it is dense already)
+        if self.sparse is None:
+            return
+        M = [0] * self.m
+        for e in chain(self.sparse, self.buffer):
+            i = e >> RANK_BITS
+            R = e & RANK_MASK
+            if R > M[i]:
+                M[i] = R
+        self.M = M
+        self.Z_sum = sum(POW2_NEG[x] for x in M)
+        self.V = M.count(0)
+        self.sparse = None
+        self.buffer = None
+
+
+    def registers(self):
+        # the dense register array (built from the entries in sparse mode, the sketch itself is unchanged)
+        if self.sparse is None:
+            return self.M
+        M = [0] * self.m
+        for e in chain(self.sparse, self.buffer):
+            i = e >> RANK_BITS
+            M[i] = max(M[i], e & RANK_MASK)
+        return M
+
+
+    def clear(self):
+        # empties the sketch in place, keeping its parameters. a sketch built in sparse mode goes back to sparse mode
+        self.Z_sum = self.m * POW2_NEG[0]
+        self.V = self.m
+        if self.start_sparse:
+            self.M = None
+            self.sparse = array(SPARSE_TYPECODE)
+            self.buffer = []
+        else:
+            self.M = [0] * self.m
+            self.sparse = None
+            self.buffer = None
+
+
+    def empty_like(self):
+        # a new empty sketch with the parameters of this one (in the mode it was built in, see clear), without going
+        # through the constructor
+        # (no parameter checks, the hash strategy is shared). metrics are off in the new sketch
+        hll = self.__class__.__new__(self.__class__)
+        hll.__dict__.update(self.__dict__)
+        hll.metrics = None
+        hll.clear()
+        return hll
+
+
+    def clone(self):
+        # an independent copy of the sketch (metrics are off in the copy)
+        hll = self.__class__.__new__(self.__class__)
+        hll.__dict__.update(self.__dict__)
+        hll.metrics = None
+        if self.sparse is not None:
+            hll.sparse = array(SPARSE_TYPECODE, self.sparse)
+            hll.buffer = list(self.buffer)
+        else:
+            hll.M = list(self.M)
+        return hll
+
+
+    @classmethod
+    def from_registers(cls, M, hash_name='sha1', bias_correction=False):
+        # a dense sketch with the given register vector (m = len(M) registers), e.g. a window of a sliding sketch
+        hll = cls(len(M).bit_length() - 1, hash_name, bias_correction=bias_correction)
+        if len(M) != hll.m:
+            raise ValueError("The number of registers should be a power of 2 in range [2^4,2^16]")
+        hll.M = list(M)
+        hll.Z_sum = sum(POW2_NEG[x] for x in hll.M)
+        hll.V = hll.M.count(0)
+        return hll
 
-	# in practice we might need to merge n counters. to write another funciton is redundant.
-	# maxing (1,2,...,n) reg vals is of same time complexity as maxing (1,2) into (1) then (1,3) , ... , (1,n)
-	# because in each case we have n comparisons
 
+    def window_hll(self, shll):
+        # the HyperLogLog a Sliding HyperLogLog is merged as: the registers of its last max. window
+        # (at its newest timestamp). an empty sliding sketch is an empty HyperLogLog
+        if shll.t_last is None:
+            return HyperLogLog(shll.b, shll.hash_name, sparse=True)
+        return shll.to_hll(shll.t_last)
 
+
+    def check_mergeable(self, hll_2):
+        # raises if hll_2 can't be merged into this hll
         if type(hll_2) != HyperLogLog:
             raise TypeError("Cannot merge hll_2 since it is not a HyperLogLog Object")
         if self.m != hll_2.m:
             raise ValueError("Two HyperLogLog Objects should have the same number of registers")
-        self.M = [max(self.M[i],hll_2.M[i]) for i in range(self.m) ]
+        if self.hash_name != hll_2.hash_name:
+            raise ValueError("Two HyperLogLog Objects should use the same hash function")
+
+
+    @timed('merge')
+    def Merge(self, hll_2):
+        # Merges this hll object with another hll_2 object.(Optional)
+        # this hll is updated only, while hll_2 is not.
+        # hll_2 may also be a SlidingHyperLogLog with the same parameters: its last max. window is merged
+        # (for another window, merge shll.to_hll(t, w)).
+
+	# in practice we might need to merge n counters.
+	# maxing (1,2,...,n) reg vals is of same time complexity as maxing (1,2) into (1) then (1,3) , ... , (1,n)
+	# because in each case we have n comparisons. merge_many does it in a single pass, without the python loop per counter
+
+
+        # (imported here: shll imports this module)
+        from shll import SlidingHyperLogLog
+        if isinstance(hll_2, SlidingHyperLogLog):
+            hll_2 = self.window_hll(hll_2)
+        self.check_mergeable(hll_2)
+        if hll_2.sparse is not None:
+            if self.sparse is not None:
+                # both sparse: the entries of hll_2 are merged like buffered adds
+                self.buffer.extend(hll_2.sparse)
+                self.buffer.extend(hll_2.buffer)
+                self.flush_sparse()
+                return
+            # only the non zero registers of hll_2 can grow registers of this hll
+            M = self.M
+            for e in chain(hll_2.sparse, hll_2.buffer):
+                i = e >> RANK_BITS
+                R = e & RANK_MASK
+                if R > M[i]:
+                    self.Z_sum += POW2_NEG[R] - POW2_NEG[M[i]]
+                    if M[i] == 0:
+                        self.V -= 1
+                    M[i] = R
+            return
+        self.to_dense()
+        M = self.M
+        M_2 = hll_2.M
+        for i in range(self.m):
+            if M_2[i] > M[i]:
+                # only the registers that grow change the harmonic sum and the zero count
+                self.Z_sum += POW2_NEG[M_2[i]] - POW2_NEG[M[i]]
+                if M[i] == 0:
+                    self.V -= 1
+                M[i] = M_2[i]
+
+
+
+    @timed('merge')
+    def merge_many(self, sketches):
+        # Merges any number of hll objects into this one (only this hll is updated).
+        # the element-wise max of all the register arrays is taken in one step (map runs it in C),
+        # then the harmonic sum and the zero count are recomputed once.
+        sketches = list(sketches)
+        for hll_2 in sketches:
+            self.check_mergeable(hll_2)
+        if not sketches:
+            return
+        if self.sparse is not None and all(hll_2.sparse is not None for hll_2 in sketches):
+            # all sparse: a single bulk merge of all the entries
+            for hll_2 in sketches:
+                self.buffer.extend(hll_2.sparse)
+                self.buffer.extend(hll_2.buffer)
+            self.flush_sparse()
+            return
+        self.to_dense()
+        self.M = list(map(max, self.M, *[hll_2.registers() for hll_2 in sketches]))
+        self.Z_sum = sum(POW2_NEG[x] for x in self.M)
+        self.V = self.M.count(0)
 
     
+    @timed('estimate')
     def EstimateCardinality(self):
-        # Z_inv = calculate the INVERSE of the indicator Z (Z definition can be shown in paper)
-        # Z = 1 / Z_inv, which is what we do when computing E (E = alpha_m * m * m * Z)
-        Z_inv = sum(math.pow(2.0, -x) for x in self.M)
-        E = self.alpha_m * float(self.m ** 2) / Z_inv
-        
-        if (E <= 2.5*self.m):
-            # small range correlation
-            # count number or registers equal to 0
-            V = self.M.count(0)
-            if V > 0:
-                E = self.m * math.log(self.m / float(V))
-        
-        # Did not add large range correction from paper. Redundant because of the use of 64-bit hash functions. 
-        return round(E)
-        
-        
\ No newline at end of file
+        # O(1): the harmonic sum and the number of zero registers are maintained by Add and Merge.
+        # in sparse mode they are computed from the non zero registers only
+        if self.sparse is not None:
+            self.flush_sparse()
+        if self.sparse is not None:
+            Z_sum, V = sparse_sum(self.m, (e & RANK_MASK for e in self.sparse))
+            return estimate_from_sum(self.alpha_m, self.m, Z_sum, V, self.bias_correction)
+        return estimate_from_sum(self.alpha_m, self.m, self.Z_sum, self.V, self.bias_correction)
+
+
+    def register_stats(self):
+        # the state of the registers, for the metrics (see metrics.py)
+        if self.sparse is not None:
+            self.flush_sparse()
+        if self.sparse is not None:
+            return {'m': self.m, 'zero_registers': self.m - len(self.sparse), 'sparse': True,
+                    'stored_entries': len(self.sparse)}
+        return {'m': self.m, 'zero_registers': self.V, 'sparse': False, 'stored_entries': self.m}
+
+
+    def memory_usage(self):
+        # deep size of the sketch in bytes: the object itself and its registers
+        # (unlike sys.getsizeof(hll), which ignores the register list entirely.
+        # the register values themselves are small ints, shared by the interpreter)
+        if self.sparse is not None:
+            return (sys.getsizeof(self) + sys.getsizeof(self.__dict__) + sys.getsizeof(self.sparse)
+                    + sys.getsizeof(self.buffer) + sum(sys.getsizeof(e) for e in self.buffer))
+        return sys.getsizeof(self) + sys.getsizeof(self.__dict__) + sys.getsizeof(self.M)
+
+
+    def to_bytes(self):
+        # serializes the sketch (see serialization.py for the format)
+        if self.sparse is not None:
+            self.flush_sparse()
+        if self.sparse is not None:
+            entries = array(SPARSE_TYPECODE, self.sparse)
+            if not NATIVE:
+                entries.byteswap()
+            header = Header(KIND_HLL, self.b, hash_name=self.hash_name, storage='sparse', count=len(entries),
+                            bias_correction=self.bias_correction).pack()
+            return header + entries.tobytes()
+        header = Header(KIND_HLL, self.b, hash_name=self.hash_name, bias_correction=self.bias_correction).pack()
+        return header + HLL_SUMS.pack(self.Z_sum.to_bytes(16, 'little'), self.V) + bytes(self.M)
+
+
+    @classmethod
+    def from_bytes(cls, data, copy=True):
+        # builds a sketch from the output of to_bytes.
+        # copy=False uses the registers in place (M is a memoryview of data): Add / Merge then need a writable data.
+        header = Header.unpack(data, KIND_HLL)
+        hll = cls(header.b, header.hash_name, header.storage == 'sparse', header.bias_correction)
+        if hll.sparse is not None:
+            end = HEADER.size + 4 * header.count
+            if len(data) < end:
+                raise ValueError("Buffer is too short for %d sparse entries" % header.count)
+            entries = memoryview(data)[HEADER.size:end]
+            if copy or not NATIVE:
+                hll.sparse = array(SPARSE_TYPECODE, entries.tobytes())
+                if not NATIVE:
+                    hll.sparse.byteswap()
+            else:
+                hll.sparse = entries.cast(SPARSE_TYPECODE)
+            return hll
+        start = HEADER.size + HLL_SUMS.size
+        if len(data) < start + hll.m:
+            raise ValueError("Buffer is too short for %d registers" % hll.m)
+        Z_sum, hll.V = HLL_SUMS.unpack_from(data, HEADER.size)
+        hll.Z_sum = int.from_bytes(Z_sum, 'little')
+        if copy:
+            hll.M = list(data[start:start + hll.m])
+        else:
+            hll.M = memoryview(data)[start:start + hll.m]
+        return hll
+
+
+    def save(self, path):
+        write_file(path, self.to_bytes())
+
+
+    @classmethod
+    def load(cls, path, mmap=False):
+        # loads a sketch saved by save().
+        # mmap=True maps the file instead of reading it: the registers are used in place and the harmonic sum
+        # is read from the header, so EstimateCardinality never touches the registers. the mapping is copy on write,
+        # updates stay in memory and the file is never modified.
+        if mmap:
+            return cls.from_bytes(map_file(path), copy=False)
+        return cls.from_bytes(read_file(path))
+
+
+    @classmethod
+    def from_iterable_parallel(cls, iterable, param, hash_name='sha1', processes=None, chunk_size=DEFAULT_CHUNK_SIZE,
+                               sparse=False, bias_correction=False):
+        # the sketch of all the values in iterable, built by a pool of processes (default: one per core).
+        # every worker builds a partial sketch of chunk_size consecutive values, the partials are merged
+        # with a tree reduction (see parallel.py). same registers as adding the values one by one.
+        return build_parallel(cls, (param, hash_name, sparse, bias_correction), {}, iterable, False, processes,
+                              chunk_size)
+
@@ -0,0 +1,341 @@
+"""
+Storage engines for the LFPM lists of the Sliding HyperLogLog.
+
+The default storage of SlidingHyperLogLog.LFPM is a python list of m entries, each one is None or a list of
+(t, R) tuples. Every register then costs hundreds of bytes of object headers.
+
+CompactLFPM keeps all the LFPM lists in flat typed arrays instead:
+ts - the timestamps of all the entries (float64, or int64 for integer time)
+rs - the R = p(w) values of all the entries (uint8)
+every register i owns a slot ts[off[i] : off[i] + cap[i]], of which the first length[i] entries are used.
+Pruning and inserting (insert) is done inside the slot, without allocating. When a slot is full, it is moved
+to the end of the pools with room for the new entry, and the old slot becomes garbage. The garbage is reclaimed
+by compact(), which runs automatically once it takes more than GARBAGE_RATIO of the pools.
+
+CompactLFPM behaves like the list storage for reading and writing whole registers:
+LFPM[i] is None or a list of (t, R) pairs, and LFPM[i] = None / list of pairs replaces register i.
+"""
+
+import sys
+from array import array
+from itertools import accumulate
+
+# numpy is optional: it is only used by the batch update (extend_many) and to speed up compact.
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+# array typecodes of the timestamps per time type
+TIME_TYPECODES = {float: 'd', int: 'q'}
+# the initial capacity of a slot, and the largest one (slot capacities are stored as uint8)
+MIN_CAPACITY = 2
+MAX_CAPACITY = 255
+# the pools are compacted when the garbage (old slots) takes more than this fraction of them
+GARBAGE_RATIO = 0.25
+
+
+def list_lfpm_memory_usage(LFPM):
+    # deep size (bytes) of the list storage: the outer list, the inner lists, the tuples and their items
+    size = sys.getsizeof(LFPM)
+    for lst in LFPM:
+        if lst is None:
+            continue
+        size += sys.getsizeof(lst)
+        for pair in lst:
+            size += sys.getsizeof(pair) + sys.getsizeof(pair[0]) + sys.getsizeof(pair[1])
+    return size
+
+
+class CompactLFPM(object):
+    """ Array backed storage of m LFPM lists.
+    m - the number of registers
+    time_type - float (timestamps stored as float64) or int (int64)
+    """
+
+    def __init__(self, m, time_type=float):
+        if time_type not in TIME_TYPECODES:
+            raise TypeError("time_type should be float or int")
+        self.m = m
+        self.time_type = time_type
+        self.ts = array(TIME_TYPECODES[time_type])
+        self.rs = array('B')
+        self.off = array('I', bytes(4 * m))
+        self.length = array('B', bytes(m))
+        self.cap = array('B', bytes(m))
+        # number of pool entries that belong to no register (old slots)
+        self.garbage = 0
+
+    @classmethod
+    def from_buffers(cls, m, time_type, lengths, ts, rs):
+        # a storage over packed buffers (see packed): lengths[i] entries of every register, register after register.
+        # the buffers are used in place (e.g. memoryviews of a mapped file); they are copied into arrays only
+        # when a register outgrows its slot.
+        lfpm = cls(m, time_type)
+        lfpm.ts = ts
+        lfpm.rs = rs
+        lfpm.length = lengths
+        lfpm.cap = array('B', lengths)
+        lfpm.off = array('I', accumulate(lengths, initial=0))
+        lfpm.off.pop()
+        return lfpm
+
+    def copy(self):
+        # an independent copy of the storage, as arrays (even if this one uses buffers in place)
+        lfpm = CompactLFPM(0, self.time_type)
+        lfpm.m = self.m
+        lfpm.ts.frombytes(self.ts.tobytes())
+        lfpm.rs.frombytes(self.rs.tobytes())
+        lfpm.off = array('I', self.off)
+        lfpm.length = array('B', self.length)
+        lfpm.cap = array('B', self.cap)
+        lfpm.garbage = self.garbage
+        return lfpm
+
+    def packed(self):
+        # the storage without slack and garbage: (lengths, ts, rs) as bytes, register after register
+        ts = array(TIME_TYPECODES[self.time_type])
+        rs = array('B')
+        for i in range(self.m):
+            n = self.length[i]
+            if n:
+                o = self.off[i]
+                ts.extend(self.ts[o:o + n])
+                rs.extend(self.rs[o:o + n])
+        return bytes(self.length), ts.tobytes(), rs.tobytes()
+
+    def __len__(self):
+        return self.m
+
+    def __getitem__(self, i):
+        n = self.length[i]
+        if n == 0:
+            return None
+        o = self.off[i]
+        return list(zip(self.ts[o:o + n], self.rs[o:o + n]))
+
+    def register_value(self, i, t_min):
+        # the highest R of register i among the entries with ti >= t_min (0 if there are none),
+        # read directly from the arrays. R's are strictly decreasing, so the first such entry is the highest.
+        ts = self.ts
+        o = self.off[i]
+        for k in range(o, o + self.length[i]):
+            if ts[k] >= t_min:
+                return self.rs[k]
+        return 0
+
+    def register_entry(self, i, t_min):
+        # the entry (ti, R) that gives register_value(i, t_min), or None
+        ts = self.ts
+        o = self.off[i]
+        for k in range(o, o + self.length[i]):
+            if ts[k] >= t_min:
+                return ts[k], self.rs[k]
+        return None
+
+    def __iter__(self):
+        for i in range(self.m):
+            yield self[i]
+
+    def __setitem__(self, i, lst):
+        # replaces register i with lst (None or an iterable of (t, R) pairs)
+        lst = [] if lst is None else list(lst)
+        n = len(lst)
+        if n > self.cap[i]:
+            self.relocate(i, n)
+        o = self.off[i]
+        for k, (t, R) in enumerate(lst):
+            self.ts[o + k] = t
+            self.rs[o + k] = R
+        self.length[i] = n
+
+    def insert(self, i, t, p_w, W):
+        # the LFPM update of SlidingHyperLogLog.Add, in place:
+        # drops the entries of register i older than t - W or with R <= p_w, then appends (t, p_w).
+        ts = self.ts
+        rs = self.rs
+        t_old = t - W
+        o = self.off[i]
+        j = o
+        for k in range(o, o + self.length[i]):
+            if ts[k] >= t_old and rs[k] > p_w:
+                ts[j] = ts[k]
+                rs[j] = rs[k]
+                j += 1
+        self.append(i, j - o, t, p_w)
+
+    def insert_monotonic(self, i, t, p_w, W):
+        # same update as insert, for a t not older than any entry (SlidingHyperLogLog monotonic mode).
+        # the entries to drop are then a prefix (older than t - W) and a suffix (R <= p_w) of the slot:
+        # both scans stop at the first entry that is kept, and the kept entries are moved with one slice copy.
+        ts = self.ts
+        rs = self.rs
+        o = self.off[i]
+        end = o + self.length[i]
+        while end > o and rs[end - 1] <= p_w:
+            end -= 1
+        t_old = t - W
+        start = o
+        while start < end and ts[start] < t_old:
+            start += 1
+        n = end - start
+        if start > o:
+            ts[o:o + n] = ts[start:end]
+            rs[o:o + n] = rs[start:end]
+        self.append(i, n, t, p_w)
+
+    def append(self, i, n, t, p_w):
+        # sets the length of register i to n (entries already in place), then appends (t, p_w)
+        if n == self.cap[i]:
+            self.length[i] = n
+            self.relocate(i, n + 1)
+        # relocate may have compacted the pools into new arrays
+        o = self.off[i]
+        self.ts[o + n] = t
+        self.rs[o + n] = p_w
+        self.length[i] = n + 1
+
+    def extend_many(self, registers, t_olds, p_maxs, bounds, ts_new, rs_new):
+        # the update of a whole batch of entries of many registers (see store.SketchStore.add_columns), with numpy
+        # array operations (all the arguments are numpy arrays): every register registers[g] (distinct) drops its
+        # entries older than t_olds[g] or with R <= p_maxs[g] (the newest time - W and the highest R of its part of
+        # the batch), then gets the entries ts_new / rs_new[bounds[g]:bounds[g + 1]] (the entries of the batch
+        # that survive it, in order). the updated registers all get new slots at the end of the pools.
+        self.detach()
+        groups = len(registers)
+        off = np.frombuffer(self.off, dtype=np.uint32)
+        length = np.frombuffer(self.length, dtype=np.uint8)
+        cap = np.frombuffer(self.cap, dtype=np.uint8)
+        dtype = np.int64 if self.time_type is int else np.float64
+
+        # the current entries of the registers, register after register, and the ones that survive the batch
+        old_length = length[registers].astype(np.int64)
+        group_old = np.repeat(np.arange(groups), old_length)
+        positions = np.repeat(off[registers].astype(np.int64) - (np.cumsum(old_length) - old_length), old_length)
+        positions += np.arange(len(positions))
+        ts_old = np.frombuffer(self.ts, dtype=dtype)[positions]
+        rs_old = np.frombuffer(self.rs, dtype=np.uint8)[positions]
+        kept = (ts_old >= t_olds[group_old]) & (rs_old > p_maxs[group_old])
+        # the kept entries of every register, then its new ones (a stable sort by register keeps both in order)
+        group_new = np.repeat(np.arange(groups), np.diff(bounds))
+        group_all = np.concatenate([group_old[kept], group_new])
+        order = np.argsort(group_all, kind='stable')
+        ts_all = np.concatenate([ts_old[kept], np.asarray(ts_new, dtype=dtype)])[order]
+        rs_all = np.concatenate([rs_old[kept], np.asarray(rs_new, dtype=np.uint8)])[order]
+        totals = np.bincount(group_all, minlength=groups)
+        if groups and totals.max() > MAX_CAPACITY:
+            i = int(registers[np.argmax(totals)])
+            raise ValueError("LFPM list of register %d is longer than %d entries" % (i, MAX_CAPACITY))
+
+        self.garbage += int(cap[registers].sum())
+        off[registers] = len(self.rs) + np.cumsum(totals) - totals
+        cap[registers] = totals
+        length[registers] = totals
+        # the views must be released before the pools can grow
+        del off, length, cap
+        self.ts.frombytes(ts_all.tobytes())
+        self.rs.frombytes(rs_all.tobytes())
+        # reclaim the old slots once they take more than GARBAGE_RATIO of the pools
+        if self.garbage > len(self.rs) * GARBAGE_RATIO:
+            self.compact()
+
+    def expire(self, i, t_old):
+        # drops the entries of register i older than t_old, in place. returns the number of dropped entries
+        ts = self.ts
+        rs = self.rs
+        o = self.off[i]
+        n = self.length[i]
+        j = o
+        for k in range(o, o + n):
+            if ts[k] >= t_old:
+                ts[j] = ts[k]
+                rs[j] = rs[k]
+                j += 1
+        self.length[i] = j - o
+        return n - (j - o)
+
+    def add_registers(self, count):
+        # appends count empty registers (m grows by count). returns the index of the first one
+        start = self.m
+        self.off.frombytes(bytes(4 * count))
+        self.length.frombytes(bytes(count))
+        self.cap.frombytes(bytes(count))
+        self.m += count
+        return start
+
+    def clear(self, start, count):
+        # empties the registers start ... start + count - 1. their slots become garbage
+        for i in range(start, start + count):
+            self.garbage += self.cap[i]
+            self.length[i] = 0
+            self.cap[i] = 0
+
+    def detach(self):
+        # buffers used in place (from_buffers) can't grow: copies them into arrays, before the pools grow
+        if not isinstance(self.ts, array):
+            ts = array(TIME_TYPECODES[self.time_type])
+            ts.frombytes(self.ts.tobytes())
+            self.ts = ts
+            self.rs = array('B', self.rs.tobytes())
+        if not isinstance(self.length, array):
+            self.length = array('B', self.length)
+
+    def relocate(self, i, needed):
+        # moves the slot of register i to the end of the pools, with a capacity of at least needed entries
+        if needed > MAX_CAPACITY:
+            raise ValueError("LFPM list of register %d is longer than %d entries" % (i, MAX_CAPACITY))
+        self.detach()
+        # reclaim the old slots once they take more than GARBAGE_RATIO of the pools
+        if self.garbage + self.cap[i] > len(self.rs) * GARBAGE_RATIO:
+            self.compact()
+        cap = min(max(needed, MIN_CAPACITY), MAX_CAPACITY)
+        o = self.off[i]
+        n = self.length[i]
+        start = len(self.ts)
+        self.ts.extend(self.ts[o:o + n])
+        self.ts.frombytes(bytes(self.ts.itemsize * (cap - n)))
+        self.rs.extend(self.rs[o:o + n])
+        self.rs.frombytes(bytes(cap - n))
+        self.garbage += self.cap[i]
+        self.off[i] = start
+        self.cap[i] = cap
+
+    def compact(self):
+        # rebuilds the pools without the garbage (old slots). every slot is trimmed to its length.
+        if np is not None and isinstance(self.length, array):
+            # same, with array operations: the entries of all the registers are gathered at once
+            lengths = np.frombuffer(self.length, dtype=np.uint8).astype(np.int64)
+            off = np.frombuffer(self.off, dtype=np.uint32)
+            starts = np.cumsum(lengths) - lengths
+            positions = np.repeat(off.astype(np.int64) - starts, lengths) + np.arange(int(lengths.sum()))
+            dtype = np.int64 if self.time_type is int else np.float64
+            ts = array(TIME_TYPECODES[self.time_type], np.frombuffer(self.ts, dtype=dtype)[positions].tobytes())
+            rs = array('B', np.frombuffer(self.rs, dtype=np.uint8)[positions].tobytes())
+            off[:] = starts
+            del off
+            self.cap = array('B', self.length)
+            self.ts = ts
+            self.rs = rs
+            self.garbage = 0
+            return
+        ts = array(TIME_TYPECODES[self.time_type])
+        rs = array('B')
+        for i in range(self.m):
+            n = self.length[i]
+            if n == 0:
+                self.cap[i] = 0
+                continue
+            o = self.off[i]
+            self.off[i] = len(rs)
+            self.cap[i] = n
+            ts.extend(self.ts[o:o + n])
+            rs.extend(self.rs[o:o + n])
+        self.ts = ts
+        self.rs = rs
+        self.garbage = 0
+
+    def memory_usage(self):
+        # bytes used by the storage (the arrays include their buffers)
+        return (sys.getsizeof(self) + sys.getsizeof(self.__dict__) + sys.getsizeof(self.ts) + sys.getsizeof(self.rs)
+                + sys.getsizeof(self.off) + sys.getsizeof(self.length) + sys.getsizeof(self.cap))
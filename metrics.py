@@ -0,0 +1,85 @@
+"""
+Runtime metrics of the HyperLogLog / Sliding HyperLogLog sketches.
+
+Metrics are off by default: sketch.metrics is None, and the hot paths only check for it. To turn them on,
+set a SketchMetrics (sketch.metrics = SketchMetrics(callback), or the metrics argument of the constructors).
+It then counts the adds, the LFPM entries pruned by them, the merges and the estimate calls with their timing.
+snapshot(sketch) adds the state of the registers (sketch.register_stats(): zero registers, LFPM lengths, ...).
+
+The callback, if any, is called as callback(event, value, metrics):
+    'merge' / 'estimate' - value is the duration of the call in seconds
+    'snapshot'           - value is the dict returned by snapshot
+"""
+
+import functools
+import time
+
+
+class SketchMetrics(object):
+    """ Counters of a sketch.
+    adds - number of values added (Add / AddMany)
+    pruned - number of LFPM entries dropped by the adds (Sliding HyperLogLog only)
+    merges, merge_time - number of Merge / merge_many calls and their total duration (seconds)
+    estimates, estimate_time, estimate_time_max - number of estimate calls, their total and max. duration
+    callback - called on every merge / estimate / snapshot (see above), or None
+    """
+
+    def __init__(self, callback=None):
+        self.callback = callback
+        self.reset()
+
+    def reset(self):
+        self.adds = 0
+        self.pruned = 0
+        self.merges = 0
+        self.merge_time = 0.0
+        self.estimates = 0
+        self.estimate_time = 0.0
+        self.estimate_time_max = 0.0
+
+    def record(self, event, elapsed):
+        # one timed call of a sketch method (see timed)
+        if event == 'merge':
+            self.merges += 1
+            self.merge_time += elapsed
+        else:
+            self.estimates += 1
+            self.estimate_time += elapsed
+            if elapsed > self.estimate_time_max:
+                self.estimate_time_max = elapsed
+        if self.callback is not None:
+            self.callback(event, elapsed, self)
+
+    def snapshot(self, sketch):
+        # the counters and the state of the registers of sketch, as a dict (also sent to the callback)
+        result = {
+            'adds': self.adds,
+            'pruned': self.pruned,
+            'merges': self.merges,
+            'merge_time': self.merge_time,
+            'estimates': self.estimates,
+            'estimate_time': self.estimate_time,
+            'estimate_time_mean': self.estimate_time / self.estimates if self.estimates else 0.0,
+            'estimate_time_max': self.estimate_time_max,
+        }
+        result.update(sketch.register_stats())
+        if self.callback is not None:
+            self.callback('snapshot', result, self)
+        return result
+
+
+def timed(event):
+    # decorator of the sketch methods measured by the metrics ('merge' / 'estimate' calls).
+    # while sketch.metrics is None, the method is called directly.
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            metrics = self.metrics
+            if metrics is None:
+                return method(self, *args, **kwargs)
+            start = time.perf_counter()
+            result = method(self, *args, **kwargs)
+            metrics.record(event, time.perf_counter() - start)
+            return result
+        return wrapper
+    return decorator
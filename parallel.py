@@ -0,0 +1,62 @@
+"""
+Parallel ingestion: shard a stream across a process pool and merge the partial sketches.
+
+The input is cut into chunks of consecutive items, every worker process builds a partial sketch of a chunk
+and ships it back serialized (to_bytes), and the partials are merged with a tree reduction that also runs in
+the pool: every round merges disjoint pairs, so there are log2(#chunks) rounds.
+Used by HyperLogLog.from_iterable_parallel and SlidingHyperLogLog.from_stream_parallel.
+"""
+
+import multiprocessing
+from itertools import islice
+
+
+DEFAULT_CHUNK_SIZE = 100000
+
+
+def chunks(items, chunk_size):
+    # cuts an iterable into lists of chunk_size consecutive items
+    items = iter(items)
+    while True:
+        chunk = list(islice(items, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def build_partial(job):
+    # worker: builds the sketch of one chunk. timed chunks are (value, t) pairs, fed with AddMany
+    cls, args, kwargs, chunk, timed = job
+    sketch = cls(*args, **kwargs)
+    if timed:
+        values, timestamps = zip(*chunk)
+        sketch.AddMany(values, timestamps)
+    else:
+        for val in chunk:
+            sketch.Add(val)
+    return sketch.to_bytes()
+
+
+def merge_partials(job):
+    # worker: merges two serialized partial sketches
+    cls, data_1, data_2 = job
+    sketch = cls.from_bytes(data_1)
+    sketch.Merge(cls.from_bytes(data_2))
+    return sketch.to_bytes()
+
+
+def build_parallel(cls, args, kwargs, items, timed, processes=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    # the sketch cls(*args, **kwargs) of all the items, built by a pool of processes (default: one per core)
+    if chunk_size <= 0:
+        raise ValueError("chunk_size should be positive")
+    with multiprocessing.Pool(processes) as pool:
+        jobs = ((cls, args, kwargs, chunk, timed) for chunk in chunks(items, chunk_size))
+        partials = list(pool.imap_unordered(build_partial, jobs))
+        if not partials:
+            return cls(*args, **kwargs)
+        # tree reduction: merge disjoint pairs until a single sketch is left
+        while len(partials) > 1:
+            pairs = [(cls, partials[k], partials[k + 1]) for k in range(0, len(partials) - 1, 2)]
+            odd = [partials[-1]] if len(partials) % 2 else []
+            partials = pool.map(merge_partials, pairs) + odd
+    return cls.from_bytes(partials[0])
@@ -0,0 +1,67 @@
+"""
+A pool of empty sketches, for workloads that create and drop many short lived sketches (e.g. one per flow).
+
+SketchPool(prototype) hands out empty sketches with the parameters of the prototype (a HyperLogLog or a
+SlidingHyperLogLog): acquire() reuses a released sketch if there is one, else builds one with
+prototype.empty_like() (no parameter checks, a single register buffer allocation). release(sketch) empties the
+sketch (clear) and keeps it for the next acquire, up to max_size idle sketches.
+
+    pool = SketchPool(SlidingHyperLogLog(12, 3600))
+    shll = pool.acquire()
+    ...
+    pool.release(shll)
+"""
+
+
+DEFAULT_MAX_SIZE = 64
+
+
+# the attributes two sketches must share to be interchangeable in a pool, besides their class
+# (the ones a class doesn't have are ignored)
+POOL_PARAMS = ('b', 'hash_name', 'bias_correction', 'start_sparse', 'W', 'storage', 'time_type', 'monotonic',
+               'tolerance', 'on_late', 'expire_slice')
+
+
+def sketch_params(sketch):
+    # the parameters and modes two sketches must share to be interchangeable in a pool
+    return (sketch.__class__,) + tuple(getattr(sketch, name, None) for name in POOL_PARAMS)
+
+
+class SketchPool(object):
+    """ A pool of empty sketches with the parameters of a prototype.
+    prototype - the sketch whose parameters and modes (class, b, hash, W, storage, sparse, monotonic, ...) all the
+                sketches of the pool share
+    max_size - the max. number of idle sketches kept, the sketches released beyond it are dropped
+    idle - the released sketches, empty, ready for acquire
+    created, reused - number of sketches acquire built / took from idle
+    """
+
+    def __init__(self, prototype, max_size=DEFAULT_MAX_SIZE):
+        if max_size < 0:
+            raise ValueError("max_size should not be negative")
+        self.prototype = prototype
+        self.params = sketch_params(prototype)
+        self.max_size = max_size
+        self.idle = []
+        self.created = 0
+        self.reused = 0
+
+    def __len__(self):
+        return len(self.idle)
+
+    def acquire(self):
+        # an empty sketch with the parameters of the prototype
+        if self.idle:
+            self.reused += 1
+            return self.idle.pop()
+        self.created += 1
+        return self.prototype.empty_like()
+
+    def release(self, sketch):
+        # gives back a sketch (acquired or not) for reuse. it is emptied: the caller must not use it anymore
+        if sketch_params(sketch) != self.params:
+            raise ValueError("The sketch doesn't have the parameters of the pool")
+        if len(self.idle) < self.max_size:
+            sketch.clear()
+            sketch.metrics = None
+            self.idle.append(sketch)
@@ -0,0 +1,142 @@
+"""
+Binary format of the HyperLogLog / Sliding HyperLogLog sketches (see to_bytes / from_bytes / save / load).
+
+All the numbers are little endian. Every section starts 8 bytes aligned, so the payload can be used in place
+(memoryview.cast) from a memory mapped file.
+
+header (48 bytes):
+    magic       4s   b'SHLL'
+    version     B    FORMAT_VERSION
+    kind        B    KIND_HLL / KIND_SHLL / KIND_SHLL_DELTA
+    b           B    log2 of the number of registers m
+    time type   B    TIME_NONE (HyperLogLog) / TIME_FLOAT (float64 timestamps) / TIME_INT (int64 timestamps)
+    storage     B    STORAGE_LIST / STORAGE_COMPACT: the LFPM storage of the saved sketch,
+                     0 / STORAGE_SPARSE for a dense / sparse HyperLogLog
+    flags       B    FLAG_BIAS_CORRECTION: the sketch uses the empirical bias correction (see bias.py)
+    (padding)   6x
+    W           Q    the max. window size (0 for HyperLogLog)
+    hash name   16s  the id of the hash strategy, ascii, zero padded
+    count       Q    the number of (t, R) pairs in the LFPM payload / of entries in the sparse payload
+
+HyperLogLog payload:
+    Z_sum       16 bytes  the fixed point harmonic sum of the registers (see hll.POW2_NEG)
+    V           Q         the number of registers equal to 0
+    M           m bytes   the registers
+sparse HyperLogLog payload:
+    entries     count * 4    the sorted encoded (i << RANK_BITS | R) non zero registers (uint32, see hll.py)
+Sliding HyperLogLog payload:
+    has t_last  ?7x          whether the sketch has seen any timestamp
+    t_last      8 bytes      its newest timestamp (float64 / int64, 0 if none)
+    lengths     m bytes      the length of every LFPM list
+    ts          count * 8    the timestamps of all the lists, register after register (float64 / int64)
+    rs          count bytes  the R values, in the same order
+Sliding HyperLogLog delta payload (some registers only, see service.py):
+    registers   Q            k, the number of registers in the delta
+    has t_last, t_last       as in the Sliding HyperLogLog payload
+    indices     k * 4        the registers (uint32)
+    lengths     k bytes      the length of their LFPM lists (padded to 8 bytes)
+    ts, rs                   as in the Sliding HyperLogLog payload, for these registers only
+"""
+
+import mmap
+import struct
+import sys
+
+
+MAGIC = b'SHLL'
+FORMAT_VERSION = 2
+HEADER = struct.Struct('<4sBBBBBB6xQ16sQ')
+HLL_SUMS = struct.Struct('<16sQ')
+SHLL_HEAD = struct.Struct('<?7x')
+DELTA_HEAD = struct.Struct('<Q?7x')
+
+KIND_HLL = 1
+KIND_SHLL = 2
+KIND_SHLL_DELTA = 3
+
+TIME_NONE = 0
+TIME_FLOAT = 1
+TIME_INT = 2
+TIME_TYPES = {float: TIME_FLOAT, int: TIME_INT}
+TIME_CODES = {TIME_FLOAT: float, TIME_INT: int}
+
+STORAGE_LIST = 0
+STORAGE_COMPACT = 1
+STORAGE_SPARSE = 2
+STORAGES = {'list': STORAGE_LIST, 'compact': STORAGE_COMPACT, 'sparse': STORAGE_SPARSE}
+STORAGE_CODES = {STORAGE_LIST: 'list', STORAGE_COMPACT: 'compact'}
+
+FLAG_BIAS_CORRECTION = 1
+
+# the payload can be used in place only if the machine is little endian, like the format
+NATIVE = sys.byteorder == 'little'
+
+
+class Header(object):
+    """ The decoded header of a serialized sketch. """
+
+    def __init__(self, kind, b, W=0, hash_name='sha1', time_type=None, storage=None, count=0, bias_correction=False):
+        self.kind = kind
+        self.b = b
+        self.W = W
+        self.hash_name = hash_name
+        self.time_type = time_type
+        self.storage = storage
+        self.count = count
+        self.bias_correction = bias_correction
+
+    def pack(self):
+        name = self.hash_name.encode('ascii')
+        if len(name) > 16:
+            raise ValueError("hash name %r is too long to be serialized (16 chars max.)" % self.hash_name)
+        time_code = TIME_NONE if self.time_type is None else TIME_TYPES[self.time_type]
+        storage_code = 0 if self.storage is None else STORAGES[self.storage]
+        flags = FLAG_BIAS_CORRECTION if self.bias_correction else 0
+        return HEADER.pack(MAGIC, FORMAT_VERSION, self.kind, self.b, time_code, storage_code, flags,
+                           self.W, name, self.count)
+
+    @classmethod
+    def unpack(cls, data, kind):
+        # decodes and validates the header at the start of data (bytes-like), for a sketch of the given kind
+        if len(data) < HEADER.size:
+            raise ValueError("Buffer is too short for a sketch header")
+        magic, version, data_kind, b, time_code, storage_code, flags, W, name, count = HEADER.unpack_from(data, 0)
+        if magic != MAGIC:
+            raise ValueError("Not a serialized sketch (bad magic %r)" % magic)
+        if version != FORMAT_VERSION:
+            raise ValueError("Unsupported format version %d" % version)
+        if data_kind != kind:
+            raise ValueError("Serialized sketch is of kind %d, expected %d" % (data_kind, kind))
+        # the constructors clamp b into range: a corrupted b would be read with a payload of another size
+        if not 4 <= b <= 16:
+            raise ValueError("b=%d is not in range [4,16]" % b)
+        time_type = TIME_CODES.get(time_code)
+        if kind == KIND_SHLL:
+            storage = STORAGE_CODES.get(storage_code)
+        else:
+            storage = 'sparse' if storage_code == STORAGE_SPARSE else None
+        return cls(kind, b, W, name.rstrip(b'\0').decode('ascii'), time_type, storage, count,
+                   bool(flags & FLAG_BIAS_CORRECTION))
+
+
+def pad8(n):
+    # n rounded up to a multiple of 8 (section alignment)
+    return (n + 7) & ~7
+
+
+def read_file(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def write_file(path, data):
+    with open(path, 'wb') as f:
+        f.write(data)
+
+
+def map_file(path):
+    # maps the file copy on write: the sketch can be updated in memory, the file itself never changes.
+    # pages are only copied by the OS when they are written to.
+    with open(path, 'rb') as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+    return memoryview(mapped)
@@ -0,0 +1,427 @@
+"""
+Aggregation service for Sliding HyperLogLogs spread over several ingest nodes.
+
+Every node keeps its own SlidingHyperLogLog and pushes it to an aggregator with a NodePusher. A push carries
+only the registers changed since the previous push (the sketch tracks them in sketch.changed), as a delta:
+the full LFPM lists of those registers, in the compact binary layout of to_bytes (see serialization.py).
+The aggregator merges every delta into its own sketch with Merge semantics (merge_registers): merging the
+same entries again changes nothing, so a delta that is pushed twice (e.g. retried) is harmless. Clients
+query the aggregate with estimate / estimate_batch.
+
+Wire protocol (TCP): a stream of frames, each one a FRAME header (body length, message type) and a body:
+    MSG_PUSH       a delta                         -> MSG_OK
+    MSG_QUERY      JSON list of [t, w] queries     -> MSG_ESTIMATES, JSON list of estimates
+    (any)          on a bad request               -> MSG_ERROR, the error message (utf-8)
+Every request frame gets exactly one reply, in order. Clients pipeline: a push is cut into frames of at most
+DELTA_REGISTERS registers, all sent in a single write, and the replies are read afterwards. Connections are
+persistent and pooled by the client (AggregatorClient).
+
+Everything runs on localhost too (aggregator and nodes in separate processes):
+    python service.py --nodes 4 --n 200000
+"""
+
+import argparse
+import json
+import math
+import multiprocessing
+import random
+import socket
+import socketserver
+import struct
+import threading
+from array import array
+
+from lfpm import TIME_TYPECODES
+from serialization import DELTA_HEAD, Header, HEADER, KIND_SHLL_DELTA, NATIVE, pad8
+from shll import SlidingHyperLogLog
+
+
+FRAME = struct.Struct('<IB')
+MSG_OK = 0
+MSG_PUSH = 1
+MSG_QUERY = 2
+MSG_ESTIMATES = 3
+MSG_ERROR = 4
+# frames bigger than this are refused (a corrupted or foreign stream)
+MAX_FRAME = 1 << 28
+# the max. number of registers per delta frame
+DELTA_REGISTERS = 4096
+DEFAULT_POOL_SIZE = 4
+DEFAULT_TIMEOUT = 30.0
+
+
+def encode_delta(sketch, registers):
+    # the delta of the given registers of sketch (see serialization.py)
+    typecode = TIME_TYPECODES[sketch.time_type]
+    lists = [sketch.LFPM[i] or () for i in registers]
+    indices = array('I', registers)
+    ts = array(typecode, [t for lst in lists for t, R in lst])
+    t_last = array(typecode, [sketch.t_last if sketch.t_last is not None else 0])
+    if not NATIVE:
+        for a in (indices, ts, t_last):
+            a.byteswap()
+    lengths = bytes(len(lst) for lst in lists)
+    rs = bytes(R for lst in lists for t, R in lst)
+    header = Header(KIND_SHLL_DELTA, sketch.b, sketch.W, sketch.hash_name, sketch.time_type, None, len(rs),
+                    sketch.bias_correction).pack()
+    indices = indices.tobytes()
+    return b''.join((header, DELTA_HEAD.pack(len(registers), sketch.t_last is not None), t_last.tobytes(),
+                     indices, lengths, bytes(pad8(len(indices) + len(lengths)) - len(indices) - len(lengths)),
+                     ts.tobytes(), rs))
+
+
+def decode_delta(data):
+    # (header, t_last, lists) of a delta: lists maps every register of the delta to its LFPM list.
+    # the contents are validated (register range, R range and order, NaN timestamps), so a corrupted delta raises
+    # ValueError before anything is merged. every list is sorted by t
+    try:
+        header = Header.unpack(data, KIND_SHLL_DELTA)
+        k, has_t_last = DELTA_HEAD.unpack_from(data, HEADER.size)
+    except struct.error as e:
+        raise ValueError("Corrupted delta: %s" % e)
+    if header.time_type is None:
+        raise ValueError("Delta without a time type")
+    n = header.count
+    typecode = TIME_TYPECODES[header.time_type]
+    t_last_start = HEADER.size + DELTA_HEAD.size
+    indices_start = t_last_start + 8
+    lengths_start = indices_start + 4 * k
+    ts_start = indices_start + pad8(5 * k)
+    rs_start = ts_start + 8 * n
+    if len(data) < rs_start + n:
+        raise ValueError("Buffer is too short for a delta of %d registers and %d LFPM entries" % (k, n))
+    view = memoryview(data)
+    t_last = array(typecode, view[t_last_start:indices_start].tobytes())
+    indices = array('I', view[indices_start:lengths_start].tobytes())
+    ts = array(typecode, view[ts_start:rs_start].tobytes())
+    if not NATIVE:
+        for a in (indices, ts, t_last):
+            a.byteswap()
+    lengths = view[lengths_start:lengths_start + k]
+    rs = view[rs_start:rs_start + n]
+    if sum(lengths) != n:
+        raise ValueError("The LFPM lengths of the delta don't add up to %d entries" % n)
+    m = 1 << header.b
+    # R = p(w) of the 64 - b bits left of the hash, in range 1 ... 65 - b
+    max_rank = 65 - header.b
+    lists = {}
+    o = 0
+    for i, length in zip(indices, lengths):
+        if i >= m:
+            raise ValueError("register %d is out of range [0,%d)" % (i, m))
+        lst = list(zip(ts[o:o + length], rs[o:o + length]))
+        o += length
+        prev_t = None
+        prev_R = max_rank + 1
+        ordered = True
+        for t, R in lst:
+            if not 1 <= R < prev_R:
+                raise ValueError("LFPM list of register %d: R's should be strictly decreasing, in range [1,%d]"
+                                 % (i, max_rank))
+            if math.isnan(t):
+                raise ValueError("LFPM list of register %d: NaN timestamp" % i)
+            if prev_t is not None and t < prev_t:
+                ordered = False
+            prev_t = t
+            prev_R = R
+        # the lists of a sketch fed late items (not monotonic) are not sorted by t: the late entries are at the
+        # end. the merge needs them sorted (the dominated entries are dropped by the merge)
+        if not ordered:
+            lst.sort()
+        lists[i] = lst
+    return header, t_last[0] if has_t_last else None, lists
+
+
+def delta_frames(sketch, registers):
+    # the MSG_PUSH frames of the given registers of sketch, DELTA_REGISTERS registers per frame
+    registers = sorted(registers)
+    return [pack_frame(MSG_PUSH, encode_delta(sketch, registers[k:k + DELTA_REGISTERS]))
+            for k in range(0, len(registers), DELTA_REGISTERS)]
+
+
+def pack_frame(kind, body):
+    return FRAME.pack(len(body), kind) + body
+
+
+def recv_exact(sock, n):
+    # reads exactly n bytes. returns None on a clean end of stream before the first byte
+    buf = bytearray(n)
+    view = memoryview(buf)
+    got = 0
+    while got < n:
+        k = sock.recv_into(view[got:])
+        if k == 0:
+            if got == 0:
+                return None
+            raise ConnectionError("Connection closed in the middle of a frame")
+        got += k
+    return buf
+
+
+def read_frame(sock):
+    # the next (kind, body) frame of sock, None at the end of the stream
+    head = recv_exact(sock, FRAME.size)
+    if head is None:
+        return None
+    length, kind = FRAME.unpack(head)
+    if length > MAX_FRAME:
+        raise ValueError("Frame of %d bytes is too big" % length)
+    body = recv_exact(sock, length) if length else bytearray()
+    if body is None:
+        raise ConnectionError("Connection closed in the middle of a frame")
+    return kind, body
+
+
+class AggregatorHandler(socketserver.BaseRequestHandler):
+    # one connection: replies to every frame, in order, until the client closes it
+
+    def handle(self):
+        sock = self.request
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        try:
+            while True:
+                frame = read_frame(sock)
+                if frame is None:
+                    return
+                try:
+                    kind, body = self.server.handle_message(*frame)
+                except (ValueError, TypeError, KeyError, IndexError, struct.error) as e:
+                    kind, body = MSG_ERROR, str(e).encode('utf-8')
+                sock.sendall(pack_frame(kind, body))
+        except (OSError, ValueError):
+            # broken connection / stream: drop it
+            return
+
+
+class AggregatorServer(socketserver.ThreadingTCPServer):
+    """ The aggregator: merges the deltas pushed by the nodes and answers the queries.
+    sketch - the aggregate SlidingHyperLogLog (its parameters are those of the nodes)
+    lock - serializes the merges and the queries on sketch
+    pushes, registers_merged - number of deltas / registers merged
+    """
+
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, sketch, address=('127.0.0.1', 0)):
+        socketserver.ThreadingTCPServer.__init__(self, address, AggregatorHandler)
+        self.sketch = sketch
+        self.lock = threading.Lock()
+        self.pushes = 0
+        self.registers_merged = 0
+
+    def start(self):
+        # serves in a background (daemon) thread. returns the thread
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return thread
+
+    def handle_message(self, kind, body):
+        # the (kind, body) reply to a request frame
+        if kind == MSG_PUSH:
+            header, t_last, lists = decode_delta(body)
+            self.check_delta(header)
+            with self.lock:
+                self.sketch.merge_registers(lists, t_last)
+                self.pushes += 1
+                self.registers_merged += len(lists)
+            return MSG_OK, b''
+        if kind == MSG_QUERY:
+            queries = [(t, w) for t, w in json.loads(body.decode('utf-8'))]
+            with self.lock:
+                estimates = self.sketch.EstimateCardinality_batch(queries)
+            return MSG_ESTIMATES, json.dumps(estimates).encode('utf-8')
+        raise ValueError("Unknown message type %d" % kind)
+
+    def check_delta(self, header):
+        # raises if the delta can't be merged into sketch (see SlidingHyperLogLog.check_mergeable)
+        sketch = self.sketch
+        if header.b != sketch.b:
+            raise ValueError("Two Sliding HyperLogLog Objects should have the same number of registers")
+        if header.hash_name != sketch.hash_name:
+            raise ValueError("Two Sliding HyperLogLog Objects should use the same hash function")
+        if header.time_type != sketch.time_type:
+            raise ValueError("Two Sliding HyperLogLog Objects should use the same time type")
+        if header.W != sketch.W:
+            raise ValueError("Two Sliding HyperLogLog Objects should have the same window size")
+
+
+class AggregatorClient(object):
+    """ Client of an AggregatorServer, over a pool of persistent connections (thread safe).
+    address - (host, port) of the aggregator
+    pool_size - max. number of idle connections kept open (more are opened when needed, and closed after use)
+    timeout - socket timeout in seconds
+    """
+
+    def __init__(self, address, pool_size=DEFAULT_POOL_SIZE, timeout=DEFAULT_TIMEOUT):
+        if pool_size <= 0:
+            raise ValueError("pool_size should be positive")
+        self.address = tuple(address)
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.idle = []
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        # an idle connection, or a new one
+        with self.lock:
+            if self.idle:
+                return self.idle.pop()
+        sock = socket.create_connection(self.address, self.timeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return sock
+
+    def release(self, sock):
+        with self.lock:
+            if len(self.idle) < self.pool_size:
+                self.idle.append(sock)
+                return
+        sock.close()
+
+    def close(self):
+        with self.lock:
+            idle, self.idle = self.idle, []
+        for sock in idle:
+            sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def request(self, frames):
+        # sends the request frames in a single write, and returns the body of every reply, in order.
+        # raises ValueError for an error reply
+        sock = self.acquire()
+        try:
+            sock.sendall(b''.join(frames))
+            replies = []
+            for k in range(len(frames)):
+                frame = read_frame(sock)
+                if frame is None:
+                    raise ConnectionError("The aggregator closed the connection")
+                replies.append(frame)
+        except BaseException:
+            # the stream is in an unknown state: the connection is not reused
+            sock.close()
+            raise
+        self.release(sock)
+        for kind, body in replies:
+            if kind == MSG_ERROR:
+                raise ValueError("aggregator: %s" % body.decode('utf-8'))
+        return [body for kind, body in replies]
+
+    def push(self, sketch, registers=None):
+        # pushes the given registers of sketch (default: all the non empty ones). returns the number of frames
+        if registers is None:
+            registers = [i for i in range(sketch.m) if sketch.lfpm_length(i)]
+        frames = delta_frames(sketch, registers)
+        if frames:
+            self.request(frames)
+        return len(frames)
+
+    def estimate(self, t, w=0):
+        # EstimateCardinality(t, w) of the aggregate
+        return self.estimate_batch([(t, w)])[0]
+
+    def estimate_batch(self, queries):
+        # EstimateCardinality_batch(queries) of the aggregate
+        body = json.dumps([[t, w] for t, w in queries]).encode('utf-8')
+        return json.loads(self.request([pack_frame(MSG_QUERY, body)])[0].decode('utf-8'))
+
+
+class NodePusher(object):
+    """ Pushes the changes of the sketch of a node to an aggregator.
+    sketch - the SlidingHyperLogLog of the node: its changed registers are tracked from now on (sketch.changed)
+    client - the AggregatorClient
+    pushes, registers_pushed - number of pushes / registers pushed
+    """
+
+    def __init__(self, sketch, client):
+        self.sketch = sketch
+        self.client = client
+        if sketch.changed is None:
+            # the first push sends everything the sketch has so far
+            sketch.changed = set(i for i in range(sketch.m) if sketch.lfpm_length(i))
+        self.pushes = 0
+        self.registers_pushed = 0
+
+    def push(self):
+        # pushes the registers changed since the last push. returns their number.
+        # if the push fails, they are pushed again by the next one
+        changed = self.sketch.changed
+        if not changed:
+            return 0
+        self.sketch.changed = set()
+        try:
+            self.client.push(self.sketch, changed)
+        except BaseException:
+            self.sketch.changed.update(changed)
+            raise
+        self.pushes += 1
+        self.registers_pushed += len(changed)
+        return len(changed)
+
+
+def run_aggregator(b, W, address, ready):
+    # process target: serves an aggregator of SlidingHyperLogLog(b, W) until killed. its address is put in ready
+    server = AggregatorServer(SlidingHyperLogLog(b, W), address)
+    ready.put(server.server_address)
+    server.serve_forever()
+
+
+def run_node(b, W, address, values, timestamps, pushes):
+    # process target: a node that adds its stream and pushes its sketch pushes times along the way
+    sketch = SlidingHyperLogLog(b, W)
+    with AggregatorClient(address) as client:
+        pusher = NodePusher(sketch, client)
+        step = max(1, len(values) // pushes)
+        for k in range(0, len(values), step):
+            sketch.AddMany(values[k:k + step], timestamps[k:k + step])
+            pusher.push()
+
+
+def main():
+    # localhost demo: an aggregator process and node processes sharing a stream. the aggregate estimates must
+    # be those of a single sketch of the whole stream
+    parser = argparse.ArgumentParser(description="sliding hll aggregation service, localhost demo")
+    parser.add_argument('--nodes', type=int, default=4)
+    parser.add_argument('--n', type=int, default=200000, help="stream size")
+    parser.add_argument('--b', type=int, default=12)
+    parser.add_argument('--W', type=int, default=10000)
+    parser.add_argument('--pushes', type=int, default=10, help="pushes per node")
+    args = parser.parse_args()
+
+    rnd = random.Random(0)
+    values = [rnd.randint(0, args.n) for k in range(args.n)]
+    timestamps = [k // 10 for k in range(args.n)]
+    ready = multiprocessing.Queue()
+    aggregator = multiprocessing.Process(target=run_aggregator, args=(args.b, args.W, ('127.0.0.1', 0), ready),
+                                         daemon=True)
+    aggregator.start()
+    address = ready.get()
+    nodes = [multiprocessing.Process(target=run_node, args=(args.b, args.W, address, values[k::args.nodes],
+                                                            timestamps[k::args.nodes], args.pushes))
+             for k in range(args.nodes)]
+    for node in nodes:
+        node.start()
+    for node in nodes:
+        node.join()
+
+    reference = SlidingHyperLogLog(args.b, args.W)
+    reference.AddMany(values, timestamps)
+    t = timestamps[-1]
+    windows = [args.W, args.W // 10, args.W // 100 or 1]
+    with AggregatorClient(address) as client:
+        estimates = client.estimate_batch([(t, w) for w in windows])
+    expected = reference.EstimateCardinality_batch([(t, w) for w in windows])
+    for w, estimate, exact in zip(windows, estimates, expected):
+        print("w=%-8d aggregator: %-10d single sketch: %d" % (w, estimate, exact))
+    aggregator.terminate()
+    if estimates != expected:
+        raise SystemExit("the aggregate differs from the single sketch")
+
+
+if __name__ == '__main__':
+    main()
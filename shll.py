@@ -1,26 +1,31 @@
 
 import math
 import heapq
-#can import sha256 instead of sha1 too, but it's a bit slower!
-from hashlib import sha1
-
-
-def calculate_alpha_m(b):
-    # the constant alpha_m in the article. m = 2^b, here we send b itself.
-    # we calculate it strictly without multiplying with anything else.
-    if (b > 16 or b < 4):
-        raise ValueError("b=%d is not in range [4,16]" % b)
-    if b == 4:
-        return 0.673
-    if b == 5:
-        return 0.697
-    if b == 6:
-        return 0.709
-    # for values b >=7, this equation is defined in the article.
-    # 1 << b is the bit 1 that is shifted b bits to the left. so 1 << b = 2^b = m
-    return 0.7213 / (1.0 + 1.079 / (1 << b))
-    
-    
+import sys
+from array import array
+from bisect import bisect_right
+from collections import OrderedDict
+from itertools import accumulate
+from operator import itemgetter
+from hashes import get_hash
+from metrics import timed
+from lfpm import CompactLFPM, TIME_TYPECODES, list_lfpm_memory_usage
+from hll import ALPHA, HyperLogLog, POW2_NEG, estimate_from_sum
+from parallel import DEFAULT_CHUNK_SIZE, build_parallel
+from serialization import Header, HEADER, KIND_SHLL, NATIVE, SHLL_HEAD, pad8, read_file, write_file, map_file
+# numpy is optional: it is only used to vectorize the batch (AddMany) path.
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# the number of windows (w values) whose register vectors are cached between EstimateCardinality calls.
+# the least recently queried window is dropped first
+CACHED_WINDOWS = 8
+# the t of an LFPM entry (t, R)
+entry_t = itemgetter(0)
+
+
 def calculate_p_w(w, max_len):
     """
     Defined in the article:
@@ -35,7 +40,150 @@ def calculate_p_w(w, max_len):
     if p_w <= 0:
         raise ValueError("w overflow")
     return p_w
+
+
+def calculate_b(param):
+    # b = log_2(m), from the constructor param: b itself (int), or the allowed Std. error (float, 0 < r < 1)
+    if type(param) == int:
+    # here param is m, of type int.
+    # here we choose not to send value error, rather to auto-correct inappropriate b values later
+        b = param
+    
+    else:
+        # we assume that param is std. error, of type float
+        if not (0 < param < 1):
+            raise ValueError("Std. error must be between 0 and 1.")
+        # std. error = 1.04 / sqrt(m)
+        b = int(math.ceil(math.log((1.04 / param) ** 2, 2)))
     
+    # make adjustments for value of b, should not exceed range 4...16 (for both cases)
+    if (b > 16):
+        b = 16
+    if (b < 4):
+        b = 4
+    return b
+
+
+def hash_values(values, b, hash_name):
+    # hashes a whole batch of values at once, for a sketch with 2^b registers and the given hash strategy.
+    # returns two sequences: the register index i and p(w) of every value (same order as values).
+    # a module level function (not a method) so it can run in any executor, including a process pool.
+    x = get_hash(hash_name).hash_many(values)
+    if np is not None:
+        # vectorized: x is one uint64 array for the whole batch, i and p(w) are computed with array ops
+        x = np.asarray(x, dtype=np.uint64)
+        idx = (x & np.uint64((1 << b) - 1)).astype(np.int64)
+        w = x >> np.uint64(b)
+        p_w = (64 - b) - bit_length_array(w) + 1
+        return idx, p_w
+    mask = (1 << b) - 1
+    max_len = 64 - b
+    idx = [xk & mask for xk in x]
+    p_w = [max_len - (xk >> b).bit_length() + 1 for xk in x]
+    return idx, p_w
+
+
+def bit_length_array(w):
+    # vectorized int.bit_length() for a numpy uint64 array (exact, no float rounding).
+    # binary search on the highest set bit: 6 steps of shift & compare for 64-bit words.
+    n = np.zeros(w.shape, dtype=np.int64)
+    v = w.copy()
+    for s in (32, 16, 8, 4, 2, 1):
+        mask = v >= (np.uint64(1) << np.uint64(s))
+        n[mask] += s
+        v[mask] >>= np.uint64(s)
+    return n + (v > 0)
+
+
+def merge_sorted_lfpm(lst_1, lst_2, W):
+    # the merged LFPM list of two LFPM lists, as built by Merge, in a single linear two pointer pass:
+    # both lists are sorted by t, so they are walked back from their newest entries until the entries are older
+    # than the newest t - W.
+    k_1 = len(lst_1) - 1
+    k_2 = len(lst_2) - 1
+    t_old = max(lst_1[-1][0], lst_2[-1][0]) - W
+    Rmax = 0
+    tmp = []
+    while k_1 >= 0 or k_2 >= 0:
+        if k_2 < 0 or (k_1 >= 0 and lst_1[k_1][0] >= lst_2[k_2][0]):
+            t, R = lst_1[k_1]
+            k_1 -= 1
+        else:
+            t, R = lst_2[k_2]
+            k_2 -= 1
+        if t < t_old:
+            break
+        # walking back in time, R's must be STRICTLY increasing (see Merge)
+        if R > Rmax:
+            # an entry kept just before with the same t (and a lower R) is dominated by this one
+            if tmp and tmp[-1][0] == t:
+                tmp.pop()
+            Rmax = R
+            tmp.append((t, R))
+    tmp.reverse()
+    return tmp
+
+
+class RegisterCache(object):
+    """ The register vector of one window, cached between EstimateCardinality calls.
+    t_min - the oldest timestamp in the window (t - w) the registers were computed for
+    M - the register vector: M[i] = the highest R in LFPM[i] with ti >= t_min
+    Z_sum, V - the fixed point harmonic sum of M and its number of zeros (see hll.estimate_from_sum)
+    dirty - the registers changed by Add / Merge since M was computed
+    expires - expires[i] = the time ti of the entry M[i] comes from (None if M[i] = 0)
+    expiry - heap of the (expires[i], i) points: once t_min passes ti, register i must be recomputed.
+             it may also hold stale points (ti != expires[i]), which are skipped
+    """
+
+    def __init__(self, t_min, entries):
+        # entries[i] = the entry (ti, R) of LFPM[i] that gives M[i] (see SlidingHyperLogLog.register_entry), or None
+        self.t_min = t_min
+        self.M = [0 if e is None else e[1] for e in entries]
+        self.Z_sum = sum(POW2_NEG[x] for x in self.M)
+        self.V = self.M.count(0)
+        self.dirty = set()
+        self.expires = [None if e is None else e[0] for e in entries]
+        self.rebuild_expiry()
+
+    def rebuild_expiry(self):
+        self.expiry = [(ti, i) for i, ti in enumerate(self.expires) if ti is not None]
+        heapq.heapify(self.expiry)
+
+    def update(self, i, R):
+        # sets register i to R, keeping Z_sum and V in sync
+        old = self.M[i]
+        if R != old:
+            self.Z_sum += POW2_NEG[R] - POW2_NEG[old]
+            self.V += (R == 0) - (old == 0)
+            self.M[i] = R
+
+    def advance(self, t_min, register_entry):
+        # moves the window to t_min (>= self.t_min) and recomputes only the registers that may have changed:
+        # the dirty ones, and those whose entry is older than the new t_min (a register whose entry is still
+        # in the window keeps it: the entries of an LFPM list get older as R increases)
+        expiry = self.expiry
+        expires = self.expires
+        dirty = self.dirty
+        while expiry and expiry[0][0] < t_min:
+            ti, i = heapq.heappop(expiry)
+            if expires[i] == ti:
+                expires[i] = None
+                dirty.add(i)
+        self.t_min = t_min
+        for i in dirty:
+            e = register_entry(i, t_min)
+            if e is None:
+                self.update(i, 0)
+                expires[i] = None
+            else:
+                self.update(i, e[1])
+                if e[0] != expires[i]:
+                    expires[i] = e[0]
+                    heapq.heappush(expiry, (e[0], i))
+        dirty.clear()
+        # the stale points pile up when the same registers keep changing
+        if len(expiry) > 2 * len(expires):
+            self.rebuild_expiry()
 
 
 class SlidingHyperLogLog(object):
@@ -46,10 +194,21 @@ class SlidingHyperLogLog(object):
     alpha_m - the const used for corrction of hash bias (read article)
     W - maximum time window size
     LFPM - list of future possible maxima: a list of pairs (ti,p(wi))
+    hash_name - the id of the hash strategy used (see hashes.py)
+    storage - the LFPM storage engine: 'list' or 'compact' (see lfpm.py)
+    cache - the register vectors of the recently queried windows, per w (see RegisterCache), least recent first
+    cache_size - the max. number of windows in cache (default CACHED_WINDOWS)
+    t_last - the newest timestamp seen by Add / Merge (None while empty)
+    bias_correction - the estimates use the empirical bias correction of HyperLogLog++ (see bias.py)
+    monotonic - monotonic mode: integer timestamps, non decreasing up to tolerance (see the constructor)
+    late - monotonic mode: the number of items dropped for being older than t_last - tolerance
+    metrics - the runtime metrics of the sketch (a SketchMetrics, see metrics.py), None when off
+    changed - the registers changed since it was last reset (a set, see service.py), None when not tracked
     """
 
 
-    def __init__(self, param, W):
+    def __init__(self, param, W, hash_name='sha1', storage='list', time_type=float, expire_slice=0,
+                 bias_correction=False, monotonic=False, tolerance=0, on_late='reject', metrics=None):
         """
         The constructor of the class.
         We enable the end-user to use the constructor in one of two ways:
@@ -58,6 +217,19 @@ class SlidingHyperLogLog(object):
         2. Sending the allowed Std. error as a fraction (0 < r < 1)
         param then is of type float!
         Std. error is defined as in the article: (E' - E) / E where E is actual cardinality, E' is our estimate
+        hash_name selects the hash strategy (see hashes.py): 'sha1' (default) or 'fast'.
+        storage selects the LFPM storage engine (see lfpm.py): 'list' (default) - python lists of (t,R) tuples,
+        or 'compact' - flat typed arrays, with timestamps stored as time_type (float or int).
+        expire_slice > 0 turns on amortized expiry: every Add also drops the expired entries of the next
+        expire_slice registers (round robin), so registers that stop receiving hits are cleaned too.
+        bias_correction=True estimates with the empirical bias correction of HyperLogLog++ (see bias.py),
+        more accurate than the plain small range correction up to 5m distinct values in the window.
+        monotonic=True is the fast path for non decreasing integer ticks (needs time_type=int; with storage='compact'
+        the ticks are stored as int64): Add prunes an LFPM list from both ends and stops at the first kept entry,
+        and Merge is a linear two pointer pass. Items older than the newest timestamp seen by at most tolerance
+        are still inserted in order; older ones raise ValueError (on_late='reject') or are dropped and
+        counted in late (on_late='count'). The mode is a setting of the object: to_bytes doesn't save it.
+        metrics turns on the runtime metrics (a SketchMetrics, see metrics.py).
         """
 
         if not type(W) == int:
@@ -66,31 +238,47 @@ class SlidingHyperLogLog(object):
             raise TypeError("Max. window size should be positive")
         self.W = W
         
-        if type(param) == int:
-        # here param is m, of type int.
-        # here we choose not to send value error, rather to auto-correct inappropriate b values later
-            b = param
-        
-        else:
-            # we assume that param is std. error, of type float
-            if not (0 < param < 1):
-                raise ValueError("Std. error must be between 0 and 1.")
-            # std. error = 1.04 / sqrt(m)
-            b = int(math.ceil(math.log((1.04 / param) ** 2, 2)))
-        
-        # make adjustments for value of b, should not exceed range 4...16 (for both cases)
-        if (b > 16):
-            b = 16
-        if (b < 4):
-            b = 4
-
         #common code for both cases: set b, m, alpha_m, LFPM
+        b = calculate_b(param)
         self.b = b
         # m = 2 ** b (2^b)
         self.m = 1 << b 
-        self.alpha_m = calculate_alpha_m(b)
+        self.alpha_m = ALPHA[b]
         # init. an empty list. LFPM is a list of pairs
-        self.LFPM = [None for i in range(self.m)]
+        if storage == 'list':
+            self.LFPM = [None] * self.m
+        elif storage == 'compact':
+            self.LFPM = CompactLFPM(self.m, time_type)
+        else:
+            raise ValueError("storage should be 'list' or 'compact'")
+        self.storage = storage
+        self.time_type = time_type
+        # w -> RegisterCache, invalidated per register by Add / Merge and moved forward in time by the queries
+        self.cache = OrderedDict()
+        self.cache_size = CACHED_WINDOWS
+        self.t_last = None
+        # amortized expiry: number of registers swept per Add, and the next register to sweep
+        if expire_slice < 0:
+            raise ValueError("expire_slice should not be negative")
+        self.expire_slice = min(expire_slice, self.m)
+        self.expire_cursor = 0
+        self.bias_correction = bias_correction
+        # monotonic mode
+        if monotonic and time_type != int:
+            raise ValueError("monotonic mode needs integer timestamps (time_type=int)")
+        if tolerance < 0:
+            raise ValueError("tolerance should not be negative")
+        if on_late not in ('reject', 'count'):
+            raise ValueError("on_late should be 'reject' or 'count'")
+        self.monotonic = monotonic
+        self.tolerance = tolerance
+        self.on_late = on_late
+        self.late = 0
+        self.metrics = metrics
+        self.changed = None
+        # the hash strategy. raises ValueError for an unknown name
+        self.hash_func = get_hash(hash_name)
+        self.hash_name = hash_name
 
 
     def Add(self, val, t):
@@ -102,24 +290,9 @@ class SlidingHyperLogLog(object):
         # w = <xb+1 xb+2 ... >
         # <t, p(w)>  (tk, p(wk))
         
-        # sha1 takes *bytes* input. converting int,float to str first, so we need to convert str->bytes.
-        if isinstance(val,int):
-            # convert int to str. can also use an alternate way! (convert into bytes directly)
-            # val = val.to_bytes(*size* = 32/64/.. , 'big') 
-            val = str(val)
-        if isinstance(val,float):
-            #converts float to str. gives us up to first 15 decimals after point.
-            # self question: can we convert to bytes as an alternate? even if yes, no need because we are hashing the int/float anyway.
-            val = str(val)
-        if isinstance(val, str):
-            val = val.encode('utf-8')
-
-
-        # hashing the input word - here we used sha1 - can use sha256 too!
-        #x = struct.unpack('!Q', sha1(val).digest()[:8])[0] - needs to import struct
-        # we use this line now - we can use 'little' instead of big endian. (in practice we take the 64 upper bits of the hash!)
-        # note: hex(x) gives us x in hex. hex length = 4 bit so we can make sure that hex(x) is of length 16
-        x = int.from_bytes(sha1(val).digest()[:8],'big')
+        # hashing the input word with the hash strategy of this sketch (sha1 by default, see hashes.py)
+        # x is a 64 bit word
+        x = self.hash_func.hash(val)
         # obtaining i: by bitwise and - stripping the first b bits only! (m-1 = 2^b-1 = 11..1 for b bits!)
         i = x & (self.m - 1)
         # w - is the rest of the word. shifting the word b bits to the right.
@@ -127,6 +300,35 @@ class SlidingHyperLogLog(object):
         # calculating p(w)=Rk, paying attention that p(w) is b bits shorter than 64 because we truncated
         p_w = calculate_p_w(w, 64 - self.b)
 
+        metrics = self.metrics
+        if metrics is not None:
+            # the entries pruned from register i: its length before the update + 1 - its length after it
+            metrics.adds += 1
+            metrics.pruned += self.lfpm_length(i) + 1
+
+        if self.monotonic:
+            self.add_monotonic(i, p_w, t)
+            if metrics is not None:
+                metrics.pruned -= self.lfpm_length(i)
+            return
+
+        # register i changes: it must be recomputed by the cached windows
+        for entry in self.cache.values():
+            entry.dirty.add(i)
+        if self.changed is not None:
+            self.changed.add(i)
+
+        if self.t_last is None or t > self.t_last:
+            self.t_last = t
+        if self.expire_slice:
+            self.expire_step(t, self.expire_slice)
+
+        if self.storage == 'compact':
+            # same update as below, done in place in the arrays
+            self.LFPM.insert(i, t, p_w, self.W)
+            if metrics is not None:
+                metrics.pruned -= self.lfpm_length(i)
+            return
 
         tmp = [] # the updated LFPM list
         
@@ -146,158 +348,744 @@ class SlidingHyperLogLog(object):
         tmp.append((t,p_w))
         self.LFPM[i] = list(tmp)
         # note we user list() to create a copy of the list. so won't get deleted after we exit the method
+        if metrics is not None:
+            metrics.pruned -= len(tmp)
+
+
+    def clear(self):
+        # empties the sketch in place (no entries, no cached windows, no timestamp seen), keeping its parameters
+        if self.storage == 'compact':
+            self.LFPM = CompactLFPM(self.m, self.time_type)
+        else:
+            self.LFPM = [None] * self.m
+        self.cache = OrderedDict()
+        self.t_last = None
+        self.expire_cursor = 0
+        self.late = 0
+
+
+    def empty_like(self):
+        # a new empty sketch with the parameters and the modes of this one, without going through the constructor
+        # (no parameter checks, the hash strategy is shared). metrics are off in the new sketch
+        shll = self.__class__.__new__(self.__class__)
+        shll.__dict__.update(self.__dict__)
+        shll.metrics = None
+        shll.changed = None
+        shll.clear()
+        return shll
+
+
+    def clone(self):
+        # an independent copy of the sketch, without its cached windows (metrics are off in the copy)
+        shll = self.__class__.__new__(self.__class__)
+        shll.__dict__.update(self.__dict__)
+        shll.metrics = None
+        shll.changed = None
+        shll.cache = OrderedDict()
+        if self.storage == 'compact':
+            shll.LFPM = self.LFPM.copy()
+        else:
+            # the lists themselves are copied: the monotonic mode updates them in place
+            shll.LFPM = [None if lst is None else list(lst) for lst in self.LFPM]
+        return shll
+
+
+    def lfpm_length(self, i):
+        # the number of entries in LFPM[i]
+        if self.storage == 'compact':
+            return self.LFPM.length[i]
+        lst = self.LFPM[i]
+        return 0 if lst is None else len(lst)
+
+
+    def late_error(self, t):
+        return ValueError("timestamp %r is older than the newest one (%r) by more than the tolerance (%r)"
+                          % (t, self.t_last, self.tolerance))
+
+
+    def add_monotonic(self, i, p_w, t):
+        # the update of Add in monotonic mode
+        if self.t_last is not None and t < self.t_last:
+            if self.t_last - t > self.tolerance:
+                if self.on_late == 'reject':
+                    raise self.late_error(t)
+                self.late += 1
+                return
+            # late, within the tolerance (rare): register i is rebuilt in time order
+            self.mark_dirty((i,))
+            self.insert_late(i, t, p_w)
+            return
+
+        # register i changes (inlined, as in Add)
+        for entry in self.cache.values():
+            entry.dirty.add(i)
+        if self.changed is not None:
+            self.changed.add(i)
+        self.t_last = t
+        if self.expire_slice:
+            self.expire_step(t, self.expire_slice)
+
+        if self.storage == 'compact':
+            self.LFPM.insert_monotonic(i, t, p_w, self.W)
+            return
+        lst = self.LFPM[i]
+        if lst is None:
+            self.LFPM[i] = [(t, p_w)]
+            return
+        # t is the newest time: the entries with R <= p_w are a suffix of the list (R's are strictly decreasing),
+        # and the expired ones a prefix. both scans stop at the first entry that is kept
+        end = len(lst)
+        while end and lst[end - 1][1] <= p_w:
+            end -= 1
+        t_old = t - self.W
+        start = 0
+        while start < end and lst[start][0] < t_old:
+            start += 1
+        del lst[end:]
+        del lst[:start]
+        lst.append((t, p_w))
+
+
+    def insert_late(self, i, t, p_w):
+        # inserts (t, p_w) into LFPM[i] at its place in time, for a t older than some of its entries
+        lst = self.LFPM[i] or []
+        if any(ti >= t and R >= p_w for ti, R in lst):
+            # a newer (or as old) entry with an R as high: (t, p_w) is never the max. of a window
+            return
+        t_old = t - self.W
+        # the older entries with R <= p_w are dropped, the newer ones all have R < p_w
+        older = [(ti, R) for ti, R in lst if ti <= t and ti >= t_old and R > p_w]
+        newer = [(ti, R) for ti, R in lst if ti > t]
+        self.LFPM[i] = older + [(t, p_w)] + newer
+
+
+    def filter_late(self, timestamps):
+        # monotonic mode: the positions of the items of a batch to apply, and whether they are in time order.
+        # items older than the newest timestamp so far by more than the tolerance raise ValueError
+        # (on_late='reject': nothing of the batch is applied) or are skipped and counted (on_late='count')
+        newest = self.t_last
+        keep = []
+        in_order = True
+        late = 0
+        for k, t in enumerate(timestamps):
+            if newest is not None and t < newest:
+                if newest - t > self.tolerance:
+                    if self.on_late == 'reject':
+                        raise self.late_error(t)
+                    late += 1
+                    continue
+                in_order = False
+            else:
+                newest = t
+            keep.append(k)
+        self.late += late
+        return keep, in_order
+
+
+    def hash_many(self, values):
+        # hashes a whole batch of values at once (see hash_values)
+        return hash_values(values, self.b, self.hash_name)
+
+
+    def apply_many(self, idx, p_w, timestamps):
+        # applies already hashed updates (i, p(w), t) to the LFPM lists, in order.
+        # updates are first grouped per register, then each register's LFPM is rebuilt once for the whole group.
+        # the order of updates inside a register is preserved, so the final state is identical
+        # to calling Add for every item in a loop (registers don't affect each other).
+        metrics = self.metrics
+        if self.monotonic:
+            keep, in_order = self.filter_late(timestamps)
+            if not in_order:
+                # late items within the tolerance: applied one by one, like Add
+                for k in keep:
+                    i = int(idx[k])
+                    if metrics is not None:
+                        metrics.adds += 1
+                        metrics.pruned += self.lfpm_length(i) + 1
+                    self.add_monotonic(i, int(p_w[k]), timestamps[k])
+                    if metrics is not None:
+                        metrics.pruned -= self.lfpm_length(i)
+                return
+            if len(keep) < len(timestamps):
+                if np is not None and isinstance(idx, np.ndarray):
+                    idx = idx[keep]
+                    p_w = p_w[keep]
+                else:
+                    idx = [idx[k] for k in keep]
+                    p_w = [p_w[k] for k in keep]
+                timestamps = [timestamps[k] for k in keep]
+        if np is not None and isinstance(idx, np.ndarray):
+            # stable sort keeps the arrival order inside every register
+            order = np.argsort(idx, kind='stable')
+            idx_sorted = idx[order]
+            # boundaries of every register's group in the sorted order
+            starts = np.flatnonzero(np.r_[True, idx_sorted[1:] != idx_sorted[:-1]])
+            ends = np.r_[starts[1:], len(idx_sorted)]
+            order = order.tolist()
+            p_w = p_w.tolist()
+            groups = ((int(idx_sorted[s]), order[s:e]) for s, e in zip(starts.tolist(), ends.tolist()))
+        else:
+            grouped = {}
+            for k, i in enumerate(idx):
+                if i in grouped:
+                    grouped[i].append(k)
+                else:
+                    grouped[i] = [k]
+            groups = grouped.items()
+
+        W = self.W
+        LFPM = self.LFPM
+        touched = []
+        for i, positions in groups:
+            # Add only ever *filters* the existing entries by (t,p(w)) of the new packet, and then appends it.
+            # therefore an entry survives the whole group iff it passes the filter of every packet that came after it:
+            # ti >= max(t later) - W and R > max(p(w) later). we compute it in one backward pass on the group.
+            kept = []
+            t_max = None
+            p_max = 0
+            for k in reversed(positions):
+                t = timestamps[k]
+                p = p_w[k]
+                if t_max is None or (t >= t_max - W and p > p_max):
+                    kept.append((t, p))
+                if t_max is None or t > t_max:
+                    t_max = t
+                if p > p_max:
+                    p_max = p
+            kept.reverse()
+            if metrics is not None:
+                metrics.pruned += self.lfpm_length(i) + len(positions)
+            if LFPM[i] is not None:
+                kept = [(ti, R) for ti, R in LFPM[i] if ti >= t_max - W and R > p_max] + kept
+            LFPM[i] = kept
+            if metrics is not None:
+                metrics.pruned -= len(kept)
+            touched.append(i)
+        self.mark_dirty(touched)
+        if metrics is not None:
+            metrics.adds += len(timestamps)
+
+        if len(timestamps):
+            t_max = max(timestamps)
+            if self.t_last is None or t_max > self.t_last:
+                self.t_last = t_max
+            if self.expire_slice:
+                # the sweeps of all the Adds of the batch, at once
+                self.expire_step(self.t_last, self.expire_slice * len(timestamps))
+
+
+    def AddMany(self, values, timestamps):
+        # batched version of Add: values[k] arrived at time timestamps[k].
+        # accepts python sequences or numpy arrays. produces the same state as calling Add in a loop.
+        if len(values) != len(timestamps):
+            raise ValueError("values and timestamps should have the same length")
+        if len(values) == 0:
+            return
+        # numpy timestamps are converted to python objects so they are stored exactly like in Add.
+        # (numpy values are left to the hash strategy, which may hash them vectorized)
+        if np is not None and isinstance(timestamps, np.ndarray):
+            timestamps = timestamps.tolist()
+        idx, p_w = self.hash_many(values)
+        self.apply_many(idx, p_w, timestamps)
 
     
-    def Merge(self, shll_2):
-        # Merges this shll object with another shll_2 object.(Optional)
-        # this shll is updated only, while shll_2 is not.
+    def check_mergeable(self, shll_2):
+        # raises if shll_2 can't be merged into this shll
         if type(shll_2) != SlidingHyperLogLog:
             raise TypeError("Cannot merge shll_2 since it is not a Sliding HyperLogLog Object")
         if self.m != shll_2.m:
             raise ValueError("Two Sliding HyperLogLog Objects should have the same number of registers")
-            
+        if self.hash_name != shll_2.hash_name:
+            raise ValueError("Two Sliding HyperLogLog Objects should use the same hash function")
+
+
+    def update_t_last(self, sketches):
+        # the newest timestamp after merging the given sketches
+        for shll_2 in sketches:
+            if shll_2.t_last is not None and (self.t_last is None or shll_2.t_last > self.t_last):
+                self.t_last = shll_2.t_last
+
+
+    def expire_registers(self, registers, now):
+        # drops the entries older than now - W from the given registers. returns the number of dropped entries
+        t_old = now - self.W
+        dropped = 0
+        touched = []
+        for i in registers:
+            if self.storage == 'compact':
+                n = self.LFPM.expire(i, t_old)
+            else:
+                lst = self.LFPM[i]
+                if lst is None:
+                    continue
+                kept = [(ti, R) for ti, R in lst if ti >= t_old]
+                n = len(lst) - len(kept)
+                if n:
+                    self.LFPM[i] = kept if kept else None
+            if n:
+                dropped += n
+                touched.append(i)
+        self.mark_dirty(touched)
+        return dropped
+
+
+    def expire_step(self, now, count):
+        # amortized expiry: sweeps the next count registers (round robin)
+        count = min(count, self.m)
+        start = self.expire_cursor
+        end = start + count
+        if end <= self.m:
+            registers = range(start, end)
+        else:
+            registers = list(range(start, self.m)) + list(range(end - self.m))
+        self.expire_cursor = end % self.m
+        return self.expire_registers(registers, now)
+
+
+    def expire(self, now):
+        # sweeps all the registers and drops the entries older than now - W.
+        # (Add only drops the old entries of the register it updates)
+        # returns the number of dropped entries
+        return self.expire_registers(range(self.m), now)
+
+
+    def compact(self):
+        # expires all the registers relative to the newest timestamp seen, and reclaims the free space
+        # of the compact storage. returns the number of dropped entries
+        dropped = 0
+        if self.t_last is not None:
+            dropped = self.expire(self.t_last)
+        if self.storage == 'compact':
+            self.LFPM.compact()
+        return dropped
+
+
+    @timed('merge')
+    def Merge(self, shll_2, t=None):
+        # Merges this shll object with another shll_2 object.(Optional)
+        # this shll is updated only, while shll_2 is not.
+        # shll_2 may also be a HyperLogLog with the same parameters: all its values count as seen at time t
+        # (default: the newest timestamp of this shll, see from_hll).
+        if isinstance(shll_2, HyperLogLog):
+            if t is None:
+                t = self.t_last
+            if t is None:
+                raise ValueError("t is needed to merge a HyperLogLog into an empty Sliding HyperLogLog")
+            shll_2 = SlidingHyperLogLog.from_hll(shll_2, self.W, t, self.time_type)
+        self.check_mergeable(shll_2)
+        self.update_t_last([shll_2])
+
+        touched = []
         for i in range(self.m):
             # nothing to merge (shll 2 is empty)
             if shll_2.LFPM[i] is None:
                 continue
-            # self is empty, shll 2 is not. assign directly
-            if self.LFPM[i] is None:
-                self.LFPM[i] = list(shll_2.LFPM[i])
+            touched.append(i)
+            self.merge_register(i, shll_2.LFPM[i])
+        self.mark_dirty(touched)
+
+
+    @timed('merge')
+    def merge_registers(self, lists, t_last=None):
+        # Merge of another sketch given by some of its registers only: lists maps i -> the LFPM list of register i
+        # (e.g. the registers a node changed since its last push, see service.py), t_last is its newest timestamp
+        if t_last is not None and (self.t_last is None or t_last > self.t_last):
+            self.t_last = t_last
+        touched = []
+        for i, lst in lists.items():
+            if not 0 <= i < self.m:
+                raise ValueError("register %d is out of range [0,%d)" % (i, self.m))
+            if lst:
+                touched.append(i)
+                self.merge_register(i, lst)
+        self.mark_dirty(touched)
+
+
+    def merge_register(self, i, lst_2):
+        # merges the LFPM list lst_2 (not empty) into register i (see Merge)
+        # self is empty, shll 2 is not. assign directly
+        if self.LFPM[i] is None:
+            self.LFPM[i] = list(lst_2)
+            return
+        if self.monotonic:
+            # both lists are sorted by t: a linear two pointer pass
+            self.LFPM[i] = merge_sorted_lfpm(self.LFPM[i], lst_2, self.W)
+            return
+        # here we have to merge both of them.
+        Rmax = None
+        tmax = None
+        tmp = [] # new list to be built
+        merged = list(heapq.merge( *( [self.LFPM[i]] + [lst_2] ), key=entry_t))
+        # in order for merge to work, we send *iterables thus the *
+        # the reason for coating of each list [lfpm[i]] instead of lfpm[i]:
+        # because if we use operator + without outer [], it appends the lists then sends to the function. [tmp1 elements, tmp2 elements]
+        # usage of [tmp] + [tmp2] appends in the following way: [ [tmp inner elements] , [tmp2 elements]  ]
+        
+        for t,R in reversed(merged):
+            if tmax is None:
+                tmax = t
+            if (t < tmax - self.W):
+                break
+            if Rmax is None or R > Rmax:
+                # the lists are sorted by t only (the R's of a same t are decreasing): an entry kept just
+                # before with the same t (and a lower R) is dominated by this one
+                if tmp and tmp[-1][0] == t:
+                    tmp.pop()
+                Rmax = R
+                tmp.append((t,R))
+            
+            # note unlike add/card functions where it was enough to break at first 'success' (suitable R value)
+            # here we have to iterate all the list. For example: shll_1 R's: (in order) 6,5,4, shll_2 R's: 5,4,3 
+            # after merging 6,5,5,4,4,3 (if we assume suitable overlapping t's) note that since we merge by t's we can have also 5,6,4,3,5,4 etc.
+            # in any merge, the inner order of the sublist merged (t's order) is preserved! (e.g. shll_2 cannot be mapped for example 5,..,3,..,4)
+            #because we iterate on reversed, we must continue to the end of the list to insert all appropriate R's 
+            #because older R's must be STRICTLY increasing (see alternative Add function - similar note)
+                
+        tmp.reverse()
+        self.LFPM[i] = list(tmp) if tmp else None
+
+
+    @timed('merge')
+    def merge_many(self, sketches):
+        # Merges any number of shll objects into this one (only this shll is updated).
+        # same result as calling Merge for each one, but every register is merged in a single k-way pass:
+        # no intermediate lists, and the pass stops as soon as the entries are older than the newest one - W.
+        sketches = list(sketches)
+        for shll_2 in sketches:
+            self.check_mergeable(shll_2)
+        if not sketches:
+            return
+        self.update_t_last(sketches)
+
+        W = self.W
+        touched = []
+        for i in range(self.m):
+            lists = [shll_2.LFPM[i] for shll_2 in sketches]
+            lists = [lst for lst in lists if lst is not None]
+            # nothing to merge (all the others are empty)
+            if not lists:
+                continue
+            touched.append(i)
+            if self.LFPM[i] is not None:
+                lists.append(self.LFPM[i])
+            # a single list is already a valid LFPM. assign directly (like Merge does)
+            if len(lists) == 1:
+                self.LFPM[i] = list(lists[0])
                 continue
-            # here we have to merge both of them.
-            Rmax = None
+            # every list is sorted by t: merge them newest first, lazily. a reversed list is not sorted by R
+            # within a same t, so the merge compares t only
             tmax = None
-            tmp = [] # new list to be built
-            merged = list(heapq.merge( *( [self.LFPM[i]] + [shll_2.LFPM[i]] ) ))
-            # in order for merge to work, we send *iterables thus the *
-            # the reason for coating of each list [lfpm[i]] instead of lfpm[i]:
-            # because if we use operator + without outer [], it appends the lists then sends to the function. [tmp1 elements, tmp2 elements]
-            # usage of [tmp] + [tmp2] appends in the following way: [ [tmp inner elements] , [tmp2 elements]  ]
-            
-            for t,R in reversed(merged):
+            Rmax = 0
+            tmp = []
+            for t, R in heapq.merge(*[reversed(lst) for lst in lists], key=entry_t, reverse=True):
                 if tmax is None:
                     tmax = t
-                if (t < tmax - self.W):
+                if t < tmax - W:
                     break
-                if Rmax is None or R > Rmax:
+                # walking back in time, R's must be STRICTLY increasing (see Merge)
+                if R > Rmax:
+                    # an entry kept just before with the same t (and a lower R) is dominated by this one
+                    if tmp and tmp[-1][0] == t:
+                        tmp.pop()
                     Rmax = R
-                    tmp.append((t,R))
-                
-                # note unlike add/card functions where it was enough to break at first 'success' (suitable R value)
-                # here we have to iterate all the list. For example: shll_1 R's: (in order) 6,5,4, shll_2 R's: 5,4,3 
-                # after merging 6,5,5,4,4,3 (if we assume suitable overlapping t's) note that since we merge by t's we can have also 5,6,4,3,5,4 etc.
-                # in any merge, the inner order of the sublist merged (t's order) is preserved! (e.g. shll_2 cannot be mapped for example 5,..,3,..,4)
-                #because we iterate on reversed, we must continue to the end of the list to insert all appropriate R's 
-                #because older R's must be STRICTLY increasing (see alternative Add function - similar note)
-                    
+                    tmp.append((t, R))
             tmp.reverse()
-            self.LFPM[i] = list(tmp) if tmp else None
+            self.LFPM[i] = tmp
+        self.mark_dirty(touched)
         
      
     
+    def register_stats(self):
+        # the state of the registers, for the metrics (see metrics.py):
+        # lfpm_lengths[k] = the number of registers with k entries, the total number of (t, R) pairs,
+        # and the zero registers of the last max. window (at t_last)
+        lengths = [self.lfpm_length(i) for i in range(self.m)]
+        histogram = [0] * (max(lengths) + 1)
+        for n in lengths:
+            histogram[n] += 1
+        if self.t_last is None:
+            zero = self.m
+        else:
+            t_min = self.t_last - self.W
+            zero = sum(1 for i in range(self.m) if lengths[i] == 0 or self.register_value(i, t_min) == 0)
+        return {'m': self.m, 'zero_registers': zero, 'empty_registers': histogram[0], 'total_pairs': sum(lengths),
+                'lfpm_lengths': histogram}
+
+
+    def memory_usage(self):
+        # deep size of the sketch in bytes: the object itself and its LFPM storage
+        # (unlike sys.getsizeof(shll), which ignores everything the object points to)
+        if self.storage == 'compact':
+            lfpm_size = self.LFPM.memory_usage()
+        else:
+            lfpm_size = list_lfpm_memory_usage(self.LFPM)
+        return sys.getsizeof(self) + sys.getsizeof(self.__dict__) + lfpm_size
+
+
+    def mark_dirty(self, registers):
+        # the given registers changed: the cached windows must recompute them on their next query
+        for entry in self.cache.values():
+            entry.dirty.update(registers)
+        if self.changed is not None:
+            self.changed.update(registers)
+
+
     def calculate_cardinality_buckets(self, M):
         # helper function
-        # Z_inv = calculate the INVERSE of the indicator Z (Z definition can be shown in paper)
-        # Z = 1 / Z_inv, which is what we do when computing E (E = alpha_m * m * m * Z)
-        Z_inv = sum(math.pow(2.0, -x) for x in M)
-        E = self.alpha_m * float(self.m ** 2) / Z_inv
-        
-        if (E <= 2.5*self.m):
-            # small range correlation
-            # count number or registers equal to 0
-            V = M.count(0)
-            if V > 0:
-                E = self.m * math.log(self.m / float(V))
-        
-        # Did not add large range correction from paper. Redundant because of the use of 64-bit hash functions. 
-        return round(E)
-  
+        # Z_sum = the harmonic sum of the registers (in fixed point, see hll.POW2_NEG), V = number of registers equal to 0
+        # (the multi-window queries don't build register vectors: EstimateCardinality_batch sums the non zero
+        # registers only, like hll.sparse_sum, and adds the zeros as V * 2^0)
+        return estimate_from_sum(self.alpha_m, self.m, sum(POW2_NEG[x] for x in M), M.count(0), self.bias_correction)
+
+
+    def register_value(self, i, t_min):
+        # the highest R in LFPM[i] among the packets with ti >= t_min (0 if there are none)
+        if self.storage == 'compact':
+            return self.LFPM.register_value(i, t_min)
+        lst = self.LFPM[i]
+        if lst is None:
+            return 0
+        for ti, R in lst:
+            if ti >= t_min:
+                # R's in the list are strictly decreasing. therefore, the FIRST R
+                # that satisfies the time window equation (ti >= t-w), is the representitive R we need
+                return R
+        return 0
+
+
+    def register_entry(self, i, t_min):
+        # the entry (ti, R) that gives register_value(i, t_min), or None
+        if self.storage == 'compact':
+            return self.LFPM.register_entry(i, t_min)
+        lst = self.LFPM[i]
+        if lst is None:
+            return None
+        for e in lst:
+            if e[0] >= t_min:
+                return e
+        return None
+
         
+    @timed('estimate')
     def EstimateCardinality(self, t, w = 0):
         # t is current timestamp, w is the window (last w units of time)
         # assume t is valid input.
         # if wrong w arg. is sent
         if not 0 < w <= self.W:
             w = self.W
-        
-        # M is a register-like array of length m
-        M = [0 for i in range(self.m)]
-        
-        # for each lfpm, calculate highest R among the appropriate packets.
-        for i in range(self.m):
-            if self.LFPM[i] is None:
-                continue
-            Rmax = 0
-            for ti, R in self.LFPM[i]:
-                if (ti >= t-w) and R > Rmax:
-                    Rmax = R
-                    # note: after setting Rmax=R, we can type break into this line, and preserve correctness.
-                    # explained: R's in the list are strictly decreasing. therefore, the FIRST R 
-                    # that satisfies the time window equation (ti >= t-w), is the representitive R we need
-                    # because subsequent R's are strictly smaller!
-            M[i] = Rmax
-        
-        E = self.calculate_cardinality_buckets(M)
-        return E
+        t_min = t - w
+
+        entry = self.cache.get(w)
+        if entry is None or t_min < entry.t_min:
+            # M is a register-like array of length m
+            # for each lfpm, calculate highest R among the appropriate packets.
+            entry = RegisterCache(t_min, [self.register_entry(i, t_min) for i in range(self.m)])
+            self.cache[w] = entry
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        else:
+            # same window as the last query, or later: only the registers touched since then and those
+            # whose entry left the window are recomputed
+            entry.advance(t_min, self.register_entry)
+            self.cache.move_to_end(w)
+
+        return estimate_from_sum(self.alpha_m, self.m, entry.Z_sum, entry.V, self.bias_correction)
 
 
     def EstimateCardinality_list(self, t, w_list):
         # t is current timestamp, w_list contains w's (last w units of time)
-        # note: function sorts w_list ascending and returns output accordingly!
+        # note: function returns the estimates of the w's sorted ascending, without duplicates! (w_list itself is not modified)
         # assume t is valid input.
         if len(w_list) == 0:
             raise ValueError("w_list should not be empty")
-        
-        # if wrong w arg. is sent
-        for i in range(len(w_list)):
-            if not 0 < w_list[i] <= self.W:
-                w_list[i] = self.W
-        #remove duplicates and sort ascending
-        w_list = sorted(set(w_list))
-        
-        n = len(w_list) #for comfort
-        
-        w_buckets = [None for i in range(n)]
-        for i in range(len(w_buckets)):
-            # M is a register-like array of length m
-            w_buckets[i] = [0 for j in range(self.m)]
- 
-  
-        # for each lfpm, calculate highest R among the appropriate packets. in a manner for all w's sent. explained further in notes
+        # if wrong w arg. is sent, it counts as W. remove duplicates and sort ascending
+        w_list = sorted(set(w if 0 < w <= self.W else self.W for w in w_list))
+        return self.EstimateCardinality_batch([(t, w) for w in w_list])
+
+
+    @timed('estimate')
+    def EstimateCardinality_batch(self, queries):
+        # the estimates of any number of (t, w) queries, in the order of queries (w as in EstimateCardinality).
+        # a window only depends on its oldest timestamp t_min = t - w. with the distinct t_min's sorted ascending,
+        # the entry (ti, R) of an LFPM list is the register value of the t_min's in (t_prev, ti] (t_prev = the time
+        # of the previous entry): a contiguous range of them. so a single sweep over every LFPM list adds each entry
+        # to a range of queries, in difference arrays of the harmonic sums and of the non zero counts.
+        # the prefix sums of these then give the exact sums of every query at once (no m-length vector per query).
+        t_mins = []
+        for t, w in queries:
+            if not 0 < w <= self.W:
+                w = self.W
+            t_mins.append(t - w)
+        sorted_t_mins = sorted(set(t_mins))
+        n = len(sorted_t_mins)
+        # difference arrays: Z_diff[k] - Z_diff[k-1] = the change of the sum of POW2_NEG[R] of the non zero registers
+        Z_diff = [0] * (n + 1)
+        N_diff = [0] * (n + 1)
         for k in range(self.m):
-            if self.LFPM[k] is None:
+            lst = self.LFPM[k]
+            if lst is None:
                 continue
-            
-            Rmax = 0
-            i = 0
-            
-            for ti, R in reversed(self.LFPM[k]):
-                while i <= n-1:
-                    if ti >= t-w_list[i]:
-                        break # seeking the correct w_i for the w_list that we are in right now. ti (got from the lfpm) is a bad name, don't get confused.                   
-                    w_buckets[i][k] = Rmax # filling the array so there won't be middle cells that stay 0 when passing
-                    i = i+1
-                    # Rmax above can be different tha zero. e.g w_list 1000,100,10, lfpm entries 500,5 so 10-100 has a gap.
-                    # w_buckets[i] is a bucket list (M), for time w_i.
-                    # we insert in position k because we are now in k-th lfpm.
-                
-                if i == n:
-                    break # out of boundries
-                
-                if R > Rmax:
-                    #side note: if we get here, condition will always be true (since reversed R's are strictly ascending)
-                    Rmax = R
-                    w_buckets[i][k] = Rmax
-                
-            while (i <= n-1):
-                #refill remaining w's if list is over, but didn't reach all w's
-                w_buckets[i][k] = Rmax
-                i = i+1
-            # the comp. case, finishing all lfpm but entries are very new compared to w's, we have zeros count
+            lo = 0
+            for ti, R in lst:
+                # the t_min's with t_min <= ti, that the previous (older) entries didn't cover
+                hi = bisect_right(sorted_t_mins, ti, lo)
+                if hi > lo:
+                    Z_diff[lo] += POW2_NEG[R]
+                    Z_diff[hi] -= POW2_NEG[R]
+                    N_diff[lo] += 1
+                    N_diff[hi] -= 1
+                    lo = hi
+                    if lo == n:
+                        break
+
+        estimates = {}
+        for t_min, Z_sum, nonzero in zip(sorted_t_mins, accumulate(Z_diff), accumulate(N_diff)):
+            # the zero registers contribute 2^0 each
+            V = self.m - nonzero
+            estimates[t_min] = estimate_from_sum(self.alpha_m, self.m, Z_sum + V * POW2_NEG[0], V, self.bias_correction)
+        return [estimates[t_min] for t_min in t_mins]
+
+
+    def to_hll(self, t, w=0):
+        # the HyperLogLog of the window (t - w, t) (w as in EstimateCardinality): its M is the register vector
+        # of the window, so it can be merged with other HyperLogLogs of the same parameters
+        return self.to_hll_batch([(t, w)])[0]
+
+
+    def to_hll_batch(self, queries):
+        # the HyperLogLogs of any number of (t, w) windows, in the order of queries, in a single sweep over
+        # every LFPM list: as in EstimateCardinality_batch, the entry (ti, R) is the register value of a
+        # contiguous range of the sorted distinct t_min's.
+        t_mins = []
+        for t, w in queries:
+            if not 0 < w <= self.W:
+                w = self.W
+            t_mins.append(t - w)
+        sorted_t_mins = sorted(set(t_mins))
+        n = len(sorted_t_mins)
+        vectors = [[0] * self.m for k in range(n)]
+        for k in range(self.m):
+            lst = self.LFPM[k]
+            if lst is None:
+                continue
+            lo = 0
+            for ti, R in lst:
+                hi = bisect_right(sorted_t_mins, ti, lo)
+                for u in range(lo, hi):
+                    vectors[u][k] = R
+                lo = hi
+                if lo == n:
+                    break
+        positions = dict((t_min, u) for u, t_min in enumerate(sorted_t_mins))
+        return [HyperLogLog.from_registers(vectors[positions[t_min]], self.hash_name, self.bias_correction)
+                for t_min in t_mins]
+
+
+    @classmethod
+    def from_hll(cls, hll, W, t, time_type=float):
+        # a Sliding HyperLogLog with the registers of a HyperLogLog, all seen at time t:
+        # LFPM[i] = [(t, M[i])] for every non zero register
+        shll = cls(hll.b, W, hll.hash_name, time_type=time_type, bias_correction=hll.bias_correction)
+        for i, R in enumerate(hll.registers()):
+            if R:
+                shll.LFPM[i] = [(t, R)]
+        shll.t_last = t
+        return shll
+
+
+    def to_bytes(self):
+        # serializes the sketch (see serialization.py for the format)
+        typecode = TIME_TYPECODES[self.time_type]
+        if self.storage == 'compact':
+            lengths, ts, rs = self.LFPM.packed()
+        else:
+            lengths = bytes(0 if lst is None else len(lst) for lst in self.LFPM)
+            ts = array(typecode, [t for lst in self.LFPM if lst is not None for t, R in lst]).tobytes()
+            rs = bytes(R for lst in self.LFPM if lst is not None for t, R in lst)
+        t_last = array(typecode, [self.t_last if self.t_last is not None else 0])
+        if not NATIVE:
+            ts = array(typecode, ts)
+            ts.byteswap()
+            ts = ts.tobytes()
+            t_last.byteswap()
+        header = Header(KIND_SHLL, self.b, self.W, self.hash_name, self.time_type, self.storage, len(rs),
+                        self.bias_correction).pack()
+        # every section starts 8 bytes aligned
+        lengths += bytes(pad8(len(lengths)) - len(lengths))
+        return header + SHLL_HEAD.pack(self.t_last is not None) + t_last.tobytes() + lengths + ts + rs
+
+
+    @classmethod
+    def from_bytes(cls, data, copy=True):
+        # builds a sketch from the output of to_bytes, with the storage it was saved with.
+        # copy=False uses the payload in place (compact storage over memoryviews of data, no python objects per entry):
+        # Add / Merge then need a writable data.
+        header = Header.unpack(data, KIND_SHLL)
+        if header.time_type is None:
+            raise ValueError("Serialized Sliding HyperLogLog without a time type")
+        storage = header.storage if copy else 'compact'
+        shll = cls(header.b, header.W, header.hash_name, storage, header.time_type,
+                   bias_correction=header.bias_correction)
+        m = shll.m
+        n = header.count
+        typecode = TIME_TYPECODES[header.time_type]
+        t_last_start = HEADER.size + SHLL_HEAD.size
+        lengths_start = t_last_start + 8
+        ts_start = lengths_start + pad8(m)
+        rs_start = ts_start + 8 * n
+        if len(data) < rs_start + n:
+            raise ValueError("Buffer is too short for %d LFPM entries" % n)
+        view = memoryview(data)
+        has_t_last, = SHLL_HEAD.unpack_from(data, HEADER.size)
+        t_last = array(typecode, view[t_last_start:lengths_start].tobytes())
+        lengths = view[lengths_start:lengths_start + m]
+        ts = view[ts_start:rs_start]
+        rs = view[rs_start:rs_start + n]
+        if sum(lengths) != n:
+            raise ValueError("The LFPM lengths don't add up to %d entries" % n)
+        if copy or not NATIVE:
+            lengths = bytearray(lengths)
+            ts = array(typecode, ts.tobytes())
+            if not NATIVE:
+                ts.byteswap()
+            rs = array('B', rs.tobytes())
+        else:
+            ts = ts.cast(typecode)
+        if not NATIVE:
+            t_last.byteswap()
+        shll.t_last = t_last[0] if has_t_last else None
+        if storage == 'compact':
+            shll.LFPM = CompactLFPM.from_buffers(m, header.time_type, lengths, ts, rs)
+        else:
+            k = 0
+            for i in range(m):
+                if lengths[i]:
+                    shll.LFPM[i] = list(zip(ts[k:k + lengths[i]], rs[k:k + lengths[i]]))
+                    k += lengths[i]
+        return shll
+
+
+    def save(self, path):
+        write_file(path, self.to_bytes())
+
+
+    @classmethod
+    def load(cls, path, mmap=False):
+        # loads a sketch saved by save().
+        # mmap=True maps the file instead of reading it: the LFPM arrays are used in place (compact storage),
+        # so EstimateCardinality reads them directly from the mapping. the mapping is copy on write,
+        # updates stay in memory and the file is never modified.
+        if mmap:
+            return cls.from_bytes(map_file(path), copy=False)
+        return cls.from_bytes(read_file(path))
 
-        w_results = [0 for i in range(n)]
-        for i in range(n):
-            w_results[i] = self.calculate_cardinality_buckets(w_buckets[i])
-        return w_results
 
+    @classmethod
+    def from_stream_parallel(cls, stream, param, W, hash_name='sha1', storage='list', time_type=float,
+                             processes=None, chunk_size=DEFAULT_CHUNK_SIZE, bias_correction=False):
+        # the sketch of a stream of (value, t) pairs, built by a pool of processes (default: one per core).
+        # every worker builds a partial sketch of chunk_size consecutive pairs, the partials are merged
+        # with a tree reduction (see parallel.py). the estimates are the same as adding the pairs one by one.
+        return build_parallel(cls, (param, W, hash_name, storage, time_type), {'bias_correction': bias_correction},
+                              stream, True, processes, chunk_size)
 
@@ -0,0 +1,314 @@
+"""
+A keyed store of Sliding HyperLogLogs: one sliding sketch per key (e.g. distinct sources per destination),
+behind a dictionary-like API.
+
+All the keys share the parameters (b, W, hash strategy), and their registers live in a single pooled
+CompactLFPM (see lfpm.py): key k owns the registers slot * m ... slot * m + m - 1 of the pool. Slots of
+evicted keys are reused by new keys. Idle keys are evicted by LRU (max_keys) and / or TTL (ttl, in units of t).
+
+add_columns ingests a columnar batch (key, value and timestamp columns, as NumPy or Arrow arrays): the rows are
+grouped per key and per register, hashed and filtered with array operations, so python only loops over the
+distinct keys and the touched registers.
+"""
+
+import heapq
+import sys
+from collections import OrderedDict
+
+from hashes import get_hash
+from hll import ALPHA, POW2_NEG, estimate_from_sum
+from lfpm import CompactLFPM
+from shll import calculate_b, calculate_p_w, hash_values
+# numpy is optional: without it, add_columns adds the rows one by one.
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+def column(data):
+    # a column of a batch as a numpy array (or a python sequence without numpy).
+    # Arrow arrays / chunked arrays (and pandas series) are converted with their to_numpy / to_pylist
+    if np is None:
+        return data.to_pylist() if hasattr(data, 'to_pylist') else data
+    if hasattr(data, 'to_numpy'):
+        try:
+            return data.to_numpy(zero_copy_only=False)
+        except TypeError:
+            return data.to_numpy()
+    return np.asarray(data)
+
+
+def batch_updates(reg, p_w, ts, W):
+    # the batch semantics of SlidingHyperLogLog.apply_many, with array operations: an item of a batch survives
+    # iff it passes the filter of every later item of its register (ti >= t - W and R > p(w) for all of them).
+    # returns (as numpy arrays) the touched registers, the newest t and the highest p(w) of each one, and the
+    # surviving (t, R) entries of each one, in arrival order: those of the g-th register are
+    # ts_kept / rs_kept[bounds[g]:bounds[g + 1]]
+    order = np.argsort(reg, kind='stable')
+    r = reg[order]
+    p = p_w[order]
+    t = ts[order]
+    n = len(r)
+    starts = np.flatnonzero(np.r_[True, r[1:] != r[:-1]])
+    ends = np.r_[starts[1:], n]
+    groups = len(starts)
+    # walking the items backwards, the running max. of p(w) and of t (as ranks, which are ints) per register:
+    # every register gets an offset above all the values of the registers walked before it, so a single
+    # maximum.accumulate over the whole array is a running max. that restarts at every register
+    t_values, t_rank = np.unique(t, return_inverse=True)
+    t_rank = t_rank.reshape(-1).astype(np.int64)
+    group_rev = np.repeat(np.arange(groups, dtype=np.int64), (ends - starts)[::-1])
+    p_rev = p[::-1].astype(np.int64)
+    p_run = np.maximum.accumulate(p_rev + group_rev * 64) - group_rev * 64
+    t_run = np.maximum.accumulate(t_rank[::-1] + group_rev * (n + 1)) - group_rev * (n + 1)
+    # the max. of the items AFTER each item: the running max. one step before (none for the last item)
+    first = np.r_[True, group_rev[1:] != group_rev[:-1]]
+    p_later = np.r_[0, p_run[:-1]]
+    t_later = t_values[np.r_[0, t_run[:-1]]]
+    t_rev = t[::-1]
+    survive = (first | ((p_rev > p_later) & (t_rev >= t_later - W)))[::-1]
+    kept = np.flatnonzero(survive)
+    bounds = np.searchsorted(kept, np.r_[starts, n])
+    return r[starts], np.maximum.reduceat(t, starts), np.maximum.reduceat(p, starts), bounds, t[kept], p[kept]
+
+
+class SketchStore(object):
+    """ Implementation of a keyed Sliding HyperLogLog store.
+    Properties of the class:
+    b, m, alpha_m, W, hash_name - shared by all the keys, as in SlidingHyperLogLog
+    LFPM - the pooled compact storage of the registers of all the keys
+    index - key -> [slot, t_last], ordered from the least to the most recently added to
+    max_keys - LRU bound on the number of keys (None: unbounded)
+    ttl - keys not added to for more than ttl units of time are evicted (None: never)
+    bias_correction - the estimates use the empirical bias correction of HyperLogLog++ (see bias.py)
+    """
+
+    def __init__(self, param, W, hash_name='sha1', time_type=float, max_keys=None, ttl=None, bias_correction=False):
+        # param and W are as in SlidingHyperLogLog: b itself (int) or the allowed Std. error (float)
+        if not type(W) == int:
+            raise TypeError("Max. window size should be an integer")
+        if W <= 0 :
+            raise TypeError("Max. window size should be positive")
+        if max_keys is not None and max_keys <= 0:
+            raise ValueError("max_keys should be positive")
+        self.W = W
+        self.b = calculate_b(param)
+        self.m = 1 << self.b
+        self.alpha_m = ALPHA[self.b]
+        self.hash_func = get_hash(hash_name)
+        self.hash_name = hash_name
+        self.time_type = time_type
+        self.max_keys = max_keys
+        self.ttl = ttl
+        self.bias_correction = bias_correction
+        # the pool starts without registers, every new slot adds m of them
+        self.LFPM = CompactLFPM(0, time_type)
+        self.index = OrderedDict()
+        self.free_slots = []
+        self.evicted = 0
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, key):
+        return key in self.index
+
+    def __iter__(self):
+        return iter(self.index)
+
+    def keys(self):
+        return self.index.keys()
+
+    def add(self, key, val, t):
+        # adds val, seen at time t, to the sketch of key
+        self.expire_keys(t)
+        entry = self.index.get(key)
+        if entry is None:
+            entry = self.new_key(key)
+        else:
+            self.index.move_to_end(key)
+        if entry[1] is None or t > entry[1]:
+            entry[1] = t
+        # same register update as SlidingHyperLogLog.Add
+        x = self.hash_func.hash(val)
+        i = x & (self.m - 1)
+        p_w = calculate_p_w(x >> self.b, 64 - self.b)
+        self.LFPM.insert(entry[0] * self.m + i, t, p_w, self.W)
+
+    def add_columns(self, keys, values, timestamps):
+        # adds a columnar batch: values[k], seen at time timestamps[k], to the sketch of keys[k].
+        # the columns are NumPy arrays, Arrow arrays / chunked arrays or sequences of the same length.
+        # the sketches end up as if add was called for every row in order; the LRU order is by the last row of
+        # each key. TTL expiry is as with add: a key idle for more than ttl before one of its rows (the newest t
+        # seen so far, batch rows included, is more than ttl after its newest add) restarts empty at that row.
+        keys = column(keys)
+        values = column(values)
+        timestamps = column(timestamps)
+        if not len(keys) == len(values) == len(timestamps):
+            raise ValueError("keys, values and timestamps should have the same length")
+        if len(keys) == 0:
+            return
+        if np is None:
+            for key, val, t in zip(keys, values, timestamps):
+                self.add(key, val, t)
+            return
+
+        ts = np.asarray(timestamps, dtype=np.int64 if self.time_type is int else np.float64)
+        self.expire_keys(ts.min().item())
+        unique_keys, inverse = np.unique(keys, return_inverse=True)
+        inverse = inverse.reshape(-1)
+        keys_list = unique_keys.tolist()
+        if self.ttl is not None:
+            # per-row TTL expiry: only the rows of a key after its last expiry count
+            keep, restarts, reached = self.ttl_cuts(inverse, ts)
+            for g, t in enumerate(reached.tolist()):
+                # the keys of the batch that expire before their first row
+                entry = self.index.get(keys_list[g])
+                if entry is not None and entry[1] < t - self.ttl:
+                    self.evict(keys_list[g])
+            for g in np.flatnonzero(restarts).tolist():
+                if keys_list[g] in self.index:
+                    self.evict(keys_list[g])
+                    self.evicted += restarts[g].item() - 1
+                else:
+                    self.evicted += restarts[g].item()
+            if not keep.all():
+                values = values[keep]
+                ts = ts[keep]
+                inverse = inverse[keep]
+        # the last row and the newest t of every key
+        last = np.zeros(len(unique_keys), dtype=np.int64)
+        np.maximum.at(last, inverse, np.arange(len(ts)))
+        t_key = np.full(len(unique_keys), ts.min())
+        np.maximum.at(t_key, inverse, ts)
+        by_last = np.argsort(last)
+        active = np.ones(len(unique_keys), dtype=bool)
+        if self.max_keys is not None and len(by_last) > self.max_keys:
+            # more keys than max_keys in the batch: the keys with the oldest last rows would be evicted
+            # by the later rows anyway
+            for g in by_last[:len(by_last) - self.max_keys].tolist():
+                if keys_list[g] in self.index:
+                    self.evict(keys_list[g])
+                else:
+                    self.evicted += 1
+                active[g] = False
+            by_last = by_last[len(by_last) - self.max_keys:]
+        # the slot of every key (a loop over the distinct keys only). the keys of the batch that exist already
+        # are refreshed first, so allocating the new ones can only evict keys outside the batch
+        for g in by_last.tolist():
+            if keys_list[g] in self.index:
+                self.index.move_to_end(keys_list[g])
+        slots = np.zeros(len(unique_keys), dtype=np.int64)
+        for g in by_last.tolist():
+            key = keys_list[g]
+            entry = self.index.get(key)
+            if entry is None:
+                entry = self.new_key(key)
+            else:
+                self.index.move_to_end(key)
+            t = t_key[g].item()
+            if entry[1] is None or t > entry[1]:
+                entry[1] = t
+            slots[g] = entry[0]
+
+        if not active.all():
+            mask = active[inverse]
+            values = values[mask]
+            ts = ts[mask]
+            inverse = inverse[mask]
+        idx, p_w = hash_values(values, self.b, self.hash_name)
+        reg = slots[inverse] * self.m + idx
+        registers, t_max, p_max, bounds, ts_kept, rs_kept = batch_updates(reg, p_w, ts, self.W)
+        self.LFPM.extend_many(registers, t_max - self.W, p_max, bounds, ts_kept, rs_kept)
+        self.expire_keys(ts.max().item())
+
+    def ttl_cuts(self, inverse, ts):
+        # the TTL expiries inside a batch (rows of key g: inverse == g, in row order). a key expires before one of
+        # its rows when the newest t of the rows up to it is more than ttl after the newest t of the key's
+        # earlier rows. returns the rows to keep (those after the last expiry of their key), the number of
+        # expiries of every key inside the batch, and the newest t of the rows up to the first row of every key
+        n = len(ts)
+        order = np.argsort(inverse, kind='stable')
+        g = inverse[order]
+        reached = np.maximum.accumulate(ts)[order]
+        # the running max. of t per key, as ranks (see batch_updates)
+        t_values, t_rank = np.unique(ts, return_inverse=True)
+        t_rank = t_rank.reshape(-1).astype(np.int64)
+        offset = g * (n + 1)
+        t_run = np.maximum.accumulate(t_rank[order] + offset) - offset
+        first = np.r_[True, g[1:] != g[:-1]]
+        t_before = t_values[np.r_[0, t_run[:-1]]]
+        cut = ~first & (reached - self.ttl > t_before)
+        # a row is kept iff there is no cut after it in its key
+        cuts = np.cumsum(cut)
+        last = np.r_[np.flatnonzero(first)[1:], n] - 1
+        keep = np.empty(n, dtype=bool)
+        keep[order] = cuts == cuts[last][g]
+        return keep, np.bincount(g[cut], minlength=len(last)), reached[first]
+
+    def new_key(self, key):
+        # allocates a slot of m registers for a new key (evicting the least recently used key if full)
+        if self.max_keys is not None and len(self.index) >= self.max_keys:
+            self.evict(next(iter(self.index)))
+        if self.free_slots:
+            slot = self.free_slots.pop()
+        else:
+            slot = self.LFPM.add_registers(self.m) // self.m
+        entry = [slot, None]
+        self.index[key] = entry
+        return entry
+
+    def evict(self, key):
+        # removes key and frees its registers
+        slot, t_last = self.index.pop(key)
+        self.LFPM.clear(slot * self.m, self.m)
+        self.free_slots.append(slot)
+        self.evicted += 1
+
+    def expire_keys(self, t):
+        # TTL eviction: drops the keys that were not added to since t - ttl.
+        # keys are ordered by their last add, so only the oldest ones are checked
+        if self.ttl is None:
+            return
+        while self.index:
+            key, (slot, t_last) = next(iter(self.index.items()))
+            if t_last >= t - self.ttl:
+                return
+            self.evict(key)
+
+    def register_vector(self, key, t, w=0):
+        # the register vector of the window of key (as in SlidingHyperLogLog.EstimateCardinality)
+        if not 0 < w <= self.W:
+            w = self.W
+        start = self.index[key][0] * self.m
+        return [self.LFPM.register_value(i, t - w) for i in range(start, start + self.m)]
+
+    def estimate(self, key, t, w=0):
+        # the estimated number of distinct values of key in the window (t - w, t). 0 for an unknown key
+        if key not in self.index:
+            return 0
+        M = self.register_vector(key, t, w)
+        return estimate_from_sum(self.alpha_m, self.m, sum(POW2_NEG[x] for x in M), M.count(0), self.bias_correction)
+
+    def top_k(self, t, w=0, k=10):
+        # the k keys with the highest estimates in the window, as (key, estimate) pairs, highest first
+        return heapq.nlargest(k, ((key, self.estimate(key, t, w)) for key in self.index), key=lambda pair: pair[1])
+
+    def memory_usage(self):
+        # deep size of the store in bytes
+        return (sys.getsizeof(self) + sys.getsizeof(self.__dict__) + self.LFPM.memory_usage()
+                + sys.getsizeof(self.index) + sys.getsizeof(self.free_slots)
+                + sum(sys.getsizeof(key) + sys.getsizeof(entry) for key, entry in self.index.items()))
+
+    def memory_report(self):
+        # memory used per key: total bytes, number of keys, bytes per key and the number of (t, R) pairs stored
+        total = self.memory_usage()
+        keys = len(self.index)
+        return {
+            'keys': keys,
+            'total_bytes': total,
+            'bytes_per_key': total / keys if keys else 0.0,
+            'pairs': sum(self.LFPM.length),
+            'evicted': self.evicted,
+        }
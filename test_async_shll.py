@@ -0,0 +1,108 @@
+# tests of the asyncio ingestion stage, fed by a local fake producer (run with pytest)
+
+import asyncio
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from async_shll import AsyncSlidingHLL
+from shll import SlidingHyperLogLog
+
+
+def fake_stream(n, seed=0):
+    # (value, t) pairs with non decreasing timestamps
+    rnd = random.Random(seed)
+    return [(rnd.randint(0, n), k // 10) for k in range(n)]
+
+
+async def producer(items, delay_every=0):
+    # an async source of the items, yielding to the event loop now and then like a network consumer would
+    for k, item in enumerate(items):
+        if delay_every and k % delay_every == 0:
+            await asyncio.sleep(0)
+        yield item
+
+
+class GatedExecutor(ThreadPoolExecutor):
+    # a thread pool whose jobs wait until gate is set: the hashing stage stalls while it is closed
+
+    def __init__(self):
+        ThreadPoolExecutor.__init__(self, 2)
+        self.gate = threading.Event()
+
+    def submit(self, fn, *args, **kwargs):
+        def gated():
+            self.gate.wait()
+            return fn(*args, **kwargs)
+        return ThreadPoolExecutor.submit(self, gated)
+
+
+def test_consume_matches_add_many():
+    items = fake_stream(5000)
+    expected = SlidingHyperLogLog(8, 200)
+    expected.AddMany([val for val, t in items], [t for val, t in items])
+
+    async def run():
+        stage = AsyncSlidingHLL(SlidingHyperLogLog(8, 200), batch_size=37, max_queue=2)
+        await stage.consume(producer(items, delay_every=100))
+        estimate = await stage.estimate(items[-1][1], 100)
+        await stage.close()
+        return stage, estimate
+
+    stage, estimate = asyncio.run(run())
+    assert list(stage.sketch.LFPM) == list(expected.LFPM)
+    assert estimate == expected.EstimateCardinality(items[-1][1], 100)
+    assert stage.items == len(items)
+
+
+def test_backpressure():
+    items = fake_stream(2000)
+    executor = GatedExecutor()
+
+    async def run():
+        stage = AsyncSlidingHLL(SlidingHyperLogLog(8, 200), batch_size=10, max_queue=1, executor=executor)
+        fed = []
+
+        async def feed_all():
+            for val, t in items:
+                await stage.feed(val, t)
+                fed.append(val)
+            await stage.flush()
+
+        task = asyncio.ensure_future(feed_all())
+        await asyncio.sleep(0.2)
+        # hashing is stalled: the producer is held back after a few batches
+        assert not task.done()
+        assert len(fed) <= 6 * stage.batch_size
+        assert stage.batch_queue.qsize() <= 1 and stage.hashed_queue.qsize() <= 1
+        executor.gate.set()
+        await task
+        await stage.close()
+        return stage
+
+    try:
+        stage = asyncio.run(run())
+    finally:
+        executor.gate.set()
+        executor.shutdown()
+    assert stage.items == len(items)
+
+
+def test_flush_raises_batch_errors():
+    async def run():
+        stage = AsyncSlidingHLL(SlidingHyperLogLog(8, 200), batch_size=2)
+        for val, t in [(1, 0), (['unhashable'], 1), (3, 2), (4, 3)]:
+            await stage.feed(val, t)
+        with pytest.raises(TypeError):
+            await stage.flush()
+        # the error is raised once, the stage keeps working
+        await stage.feed(5, 4)
+        await stage.flush()
+        await stage.close()
+        return stage
+
+    stage = asyncio.run(run())
+    # the failed batch is dropped, the others are applied
+    assert stage.items == 3
@@ -1,24 +1,83 @@
-# prompt: write test with random data that fake streaming data with time t increase as timestamp
+# tests of the HyperLogLog: sparse vs dense mode, bias correction (run with pytest)
 
+import math
 import random
-from hll import HyperLogLog
-import sys
-b = 10
-n = 1000000
-# Create a HyperLogLog object
-hll = HyperLogLog(b)
-actual_set = set()
-
-# Generate random data and add it to the hll
-for i in range(n):
-    num = random.randint(0, n)
-    actual_set.add(num)
-    hll.Add(num)
-
-est = hll.EstimateCardinality()
-
-# Print the results
-print("n =", len(actual_set))
-print("size of actual set: ", sys.getsizeof(actual_set), " bytes")
-print("Estimated cardinality:", est)
-print("size of hll: ", sys.getsizeof(hll), " bytes")
+
+import pytest
+
+from bias import LINEAR_COUNTING_THRESHOLDS, corrected_estimate
+from hll import HyperLogLog, POW2_NEG, SCALE_BITS
+
+
+def filled(n, seed, sparse, b=8, bias_correction=False):
+    hll = HyperLogLog(b, sparse=sparse, bias_correction=bias_correction)
+    rnd = random.Random(seed)
+    for k in range(n):
+        hll.Add(rnd.getrandbits(48))
+    return hll
+
+
+def assert_same(hll_1, hll_2):
+    assert list(hll_1.registers()) == list(hll_2.registers())
+    assert hll_1.EstimateCardinality() == hll_2.EstimateCardinality()
+
+
+@pytest.mark.parametrize('n', [0, 1, 10, 40, 64, 65, 200, 5000])
+def test_sparse_add_matches_dense(n):
+    # b=8: more than m/4 = 64 non zero registers converts the sparse sketch to dense
+    sparse = filled(n, n, True)
+    dense = filled(n, n, False)
+    assert_same(sparse, dense)
+    assert (sparse.sparse is not None) == (sparse.register_stats()['zero_registers'] >= 256 - 64)
+
+
+@pytest.mark.parametrize('n_1, n_2', [(10, 20), (30, 50), (10, 3000), (3000, 10), (3000, 3000)])
+def test_sparse_merge_matches_dense(n_1, n_2):
+    dense = filled(n_1, 1, False)
+    dense.Merge(filled(n_2, 2, False))
+    for sparse_1 in (True, False):
+        for sparse_2 in (True, False):
+            hll = filled(n_1, 1, sparse_1)
+            hll.Merge(filled(n_2, 2, sparse_2))
+            assert_same(hll, dense)
+
+
+@pytest.mark.parametrize('sizes', [[5, 10, 20], [30, 40], [10, 3000, 20], [3000, 3000]])
+def test_sparse_merge_many_matches_dense(sizes):
+    dense = filled(7, 0, False)
+    dense.merge_many([filled(n, seed, False) for seed, n in enumerate(sizes, 1)])
+    for sparse in (True, False):
+        hll = filled(7, 0, sparse)
+        hll.merge_many([filled(n, seed, sparse) for seed, n in enumerate(sizes, 1)])
+        assert_same(hll, dense)
+
+
+@pytest.mark.parametrize('n', [0, 30, 5000])
+@pytest.mark.parametrize('copy', [True, False])
+def test_sparse_round_trip(n, copy):
+    hll = filled(n, 3, True)
+    loaded = HyperLogLog.from_bytes(bytearray(hll.to_bytes()), copy=copy)
+    assert (loaded.sparse is None) == (hll.sparse is None)
+    assert_same(loaded, filled(n, 3, False))
+    # the loaded sketch keeps growing like the original
+    for hll_k in (loaded, hll):
+        for val in range(100):
+            hll_k.Add(val)
+    assert_same(loaded, hll)
+
+
+@pytest.mark.parametrize('n', [0, 10, 100, 400, 700, 1300, 5000])
+def test_bias_correction_estimate(n):
+    # the corrected estimate (of a sparse sketch while it is sparse) is computed from the same registers as the
+    # raw one
+    corrected = filled(n, 4, True, bias_correction=True)
+    raw = filled(n, 4, False)
+    assert list(corrected.registers()) == raw.registers()
+    M = raw.registers()
+    m = len(M)
+    E = 0.7213 / (1.0 + 1.079 / m) * m * m / math.ldexp(sum(POW2_NEG[x] for x in M), -SCALE_BITS)
+    assert corrected.EstimateCardinality() == round(corrected_estimate(E, m, M.count(0)))
+    if n <= LINEAR_COUNTING_THRESHOLDS[8] // 2:
+        # linear counting
+        assert corrected.EstimateCardinality() == raw.EstimateCardinality()
+
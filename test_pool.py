@@ -0,0 +1,44 @@
+# tests of the sketch pool (run with pytest)
+
+import pytest
+
+from hll import HyperLogLog
+from pool import SketchPool
+from shll import SlidingHyperLogLog
+
+
+def test_sparse_pool_stays_sparse():
+    pool = SketchPool(HyperLogLog(8, sparse=True))
+    hll = pool.acquire()
+    for val in range(200):
+        hll.Add(val)
+    assert hll.sparse is None
+    pool.release(hll)
+    hll = pool.acquire()
+    assert pool.reused == 1
+    assert hll.sparse is not None and hll.EstimateCardinality() == 0
+
+
+def test_release_checks_modes():
+    pool = SketchPool(SlidingHyperLogLog(8, 100, time_type=int))
+    for sketch in (SlidingHyperLogLog(8, 100, time_type=int, monotonic=True),
+                   SlidingHyperLogLog(8, 100, time_type=int, expire_slice=4),
+                   SlidingHyperLogLog(8, 100, time_type=int, storage='compact'),
+                   SlidingHyperLogLog(9, 100, time_type=int),
+                   HyperLogLog(8)):
+        with pytest.raises(ValueError):
+            pool.release(sketch)
+    pool = SketchPool(HyperLogLog(8))
+    with pytest.raises(ValueError):
+        pool.release(HyperLogLog(8, sparse=True))
+
+
+def test_reused_sketch_is_empty():
+    pool = SketchPool(SlidingHyperLogLog(8, 100), max_size=1)
+    shll = pool.acquire()
+    shll.Add(1, 1.0)
+    pool.release(shll)
+    pool.release(pool.prototype.empty_like())
+    assert len(pool) == 1
+    shll = pool.acquire()
+    assert shll.t_last is None and shll.EstimateCardinality(1.0) == 0
@@ -0,0 +1,55 @@
+# tests of the binary format of the sketches (run with pytest)
+
+import pytest
+
+from hll import HyperLogLog
+from serialization import HEADER, SHLL_HEAD
+from shll import SlidingHyperLogLog
+
+# offset of b in the header (after the magic, version and kind)
+B_OFFSET = 6
+
+
+def sample_shll(storage='list'):
+    shll = SlidingHyperLogLog(6, 100, storage=storage)
+    for t in range(500):
+        shll.Add(t, t / 5.0)
+    return shll
+
+
+@pytest.mark.parametrize('storage', ['list', 'compact'])
+@pytest.mark.parametrize('copy', [True, False])
+def test_shll_round_trip(storage, copy):
+    shll = sample_shll(storage)
+    data = bytearray(shll.to_bytes())
+    loaded = SlidingHyperLogLog.from_bytes(data, copy=copy)
+    assert list(loaded.LFPM) == list(shll.LFPM)
+    assert loaded.t_last == shll.t_last
+    assert loaded.EstimateCardinality(99.8, 50) == shll.EstimateCardinality(99.8, 50)
+
+
+@pytest.mark.parametrize('b', [3, 17, 200])
+@pytest.mark.parametrize('cls, sketch', [(SlidingHyperLogLog, sample_shll()), (HyperLogLog, HyperLogLog(6))])
+def test_bad_b_is_rejected(b, cls, sketch):
+    data = bytearray(sketch.to_bytes())
+    data[B_OFFSET] = b
+    with pytest.raises(ValueError):
+        cls.from_bytes(data)
+
+
+@pytest.mark.parametrize('copy', [True, False])
+def test_bad_lengths_are_rejected(copy):
+    data = bytearray(sample_shll().to_bytes())
+    # one more entry in the first non empty list than the payload holds
+    lengths_start = HEADER.size + SHLL_HEAD.size + 8
+    k = next(k for k in range(lengths_start, lengths_start + 64) if data[k])
+    data[k] += 1
+    with pytest.raises(ValueError):
+        SlidingHyperLogLog.from_bytes(data, copy=copy)
+
+
+@pytest.mark.parametrize('copy', [True, False])
+def test_empty_shll_round_trip(copy):
+    loaded = SlidingHyperLogLog.from_bytes(bytearray(SlidingHyperLogLog(6, 100).to_bytes()), copy=copy)
+    assert loaded.t_last is None
+    assert loaded.EstimateCardinality(5, 50) == 0
@@ -0,0 +1,94 @@
+# tests of the aggregation service, on localhost (run with pytest)
+
+import random
+
+import pytest
+
+from service import (AggregatorClient, AggregatorServer, MSG_PUSH, NodePusher, decode_delta, encode_delta,
+                     pack_frame)
+from shll import SlidingHyperLogLog
+
+
+@pytest.fixture
+def server():
+    server = AggregatorServer(SlidingHyperLogLog(8, 100, time_type=int))
+    server.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_aggregate_matches_single_sketch(server):
+    rnd = random.Random(1)
+    nodes = [SlidingHyperLogLog(8, 100, storage=storage, time_type=int) for storage in ('list', 'compact', 'list')]
+    reference = SlidingHyperLogLog(8, 100, time_type=int)
+    with AggregatorClient(server.server_address, pool_size=2) as client:
+        pushers = [NodePusher(node, client) for node in nodes]
+        t = 0
+        for step in range(30):
+            for k in range(rnd.randint(0, 40)):
+                t += rnd.randint(0, 3)
+                val = rnd.random()
+                rnd.choice(nodes).Add(val, t)
+                reference.Add(val, t)
+            for pusher in pushers:
+                pusher.push()
+            queries = [(t, w) for w in (1, 10, 50, 100)]
+            assert client.estimate_batch(queries) == reference.EstimateCardinality_batch(queries)
+
+
+def test_delta_round_trip():
+    sketch = SlidingHyperLogLog(8, 100)
+    for t in range(300):
+        sketch.Add(t, t / 3.0)
+    header, t_last, lists = decode_delta(encode_delta(sketch, list(range(sketch.m))))
+    assert t_last == sketch.t_last
+    assert all((lists[i] or None) == sketch.LFPM[i] for i in range(sketch.m))
+
+
+def corrupt_delta(rank):
+    sketch = SlidingHyperLogLog(8, 100, time_type=int)
+    sketch.LFPM[3] = [(5, rank)]
+    sketch.t_last = 5
+    return encode_delta(sketch, [3])
+
+
+def test_corrupted_delta_is_rejected(server):
+    with AggregatorClient(server.server_address) as client:
+        client.push(SlidingHyperLogLog(8, 100, time_type=int))
+        for data in (corrupt_delta(65 - 8 + 1), corrupt_delta(0), corrupt_delta(3)[:60]):
+            with pytest.raises(ValueError):
+                decode_delta(data)
+            with pytest.raises(ValueError):
+                client.request([pack_frame(MSG_PUSH, data)])
+        # nothing was merged, and the aggregator still answers
+        assert client.estimate(5, 100) == 0
+        client.request([pack_frame(MSG_PUSH, corrupt_delta(65 - 8))])
+        assert client.estimate(5, 100) == 1
+
+
+def test_out_of_order_adds_are_pushed(server):
+    # a late item is appended at the end of its register (not monotonic): the lists are not sorted by t
+    rnd = random.Random(2)
+    node = SlidingHyperLogLog(8, 100, time_type=int)
+    reference = SlidingHyperLogLog(8, 100, time_type=int)
+    with AggregatorClient(server.server_address) as client:
+        pusher = NodePusher(node, client)
+        for step in range(10):
+            values = [rnd.random() for k in range(50)]
+            ts = [10 * step + 10] * 25 + [10 * step + 9] * 25
+            node.AddMany(values, ts)
+            reference.AddMany(values, ts)
+            pusher.push()
+            assert not node.changed
+            queries = [(10 * step + 10, w) for w in (1, 2, 10, 100)]
+            assert client.estimate_batch(queries) == reference.EstimateCardinality_batch(queries)
+
+
+def test_other_window_is_rejected(server):
+    with AggregatorClient(server.server_address) as client:
+        sketch = SlidingHyperLogLog(8, 50, time_type=int)
+        sketch.Add(1, 5)
+        with pytest.raises(ValueError):
+            client.push(sketch)
+        assert client.estimate(5, 100) == 0
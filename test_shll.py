@@ -0,0 +1,154 @@
+# tests of the Sliding HyperLogLog (run with pytest)
+
+import random
+
+import pytest
+
+from shll import SlidingHyperLogLog
+
+
+@pytest.mark.parametrize('hash_name', ['sha1', 'fast'])
+@pytest.mark.parametrize('dtype', ['int64', 'uint32', 'float64', 'float32', 'str'])
+def test_add_many_matches_add_numpy(hash_name, dtype):
+    # numpy scalars given to Add must hash like the values of the numpy arrays given to AddMany
+    np = pytest.importorskip('numpy')
+    values = (np.arange(2000) - 1000).astype(np.float64) / 7 if dtype.startswith('float') else np.arange(2000)
+    values = values.astype(dtype)
+    timestamps = np.arange(2000) // 10
+    one_by_one = SlidingHyperLogLog(8, 50, hash_name)
+    for val, t in zip(values, timestamps):
+        one_by_one.Add(val, t.item())
+    batch = SlidingHyperLogLog(8, 50, hash_name)
+    batch.AddMany(values, timestamps)
+    assert list(one_by_one.LFPM) == list(batch.LFPM)
+
+
+@pytest.mark.parametrize('seed', range(12))
+def test_cached_estimates_match_uncached(seed):
+    # EstimateCardinality reuses the cached register vectors (moved forward in time between the queries);
+    # a sketch whose cache is cleared before every query recomputes everything
+    rnd = random.Random(seed)
+    storage = rnd.choice(['list', 'compact'])
+    monotonic = rnd.random() < 0.3
+    time_type = int if monotonic or rnd.random() < 0.5 else float
+    W = rnd.choice([50, 500])
+    params = dict(storage=storage, time_type=time_type, monotonic=monotonic, expire_slice=rnd.choice([0, 3]))
+    cached = SlidingHyperLogLog(rnd.choice([4, 6, 8]), W, **params)
+    cached.cache_size = rnd.choice([1, 2, 8])
+    uncached = SlidingHyperLogLog(cached.b, W, **params)
+    t = 0
+    for step in range(200):
+        for k in range(rnd.randint(0, 30)):
+            t += rnd.choice([0, 1, 2]) if time_type is int else rnd.random() * 2
+            val = rnd.randint(0, 5000)
+            cached.Add(val, t)
+            uncached.Add(val, t)
+        if rnd.random() < 0.1:
+            other = SlidingHyperLogLog(cached.b, W, storage=storage, time_type=time_type)
+            for k in range(20):
+                other.Add(rnd.randint(0, 5000), t - rnd.randint(0, 5))
+            cached.Merge(other)
+            uncached.Merge(other)
+        for q in range(rnd.randint(1, 4)):
+            w = rnd.choice([0, 1, 5, 10, 20, 37, W])
+            t_query = t + rnd.choice([0, 0, 1, -3, 5])
+            uncached.cache.clear()
+            assert cached.EstimateCardinality(t_query, w) == uncached.EstimateCardinality(t_query, w)
+        assert len(cached.cache) <= cached.cache_size
+
+
+@pytest.mark.parametrize('seed', range(8))
+def test_merge_many_matches_chained_merge(seed):
+    # few distinct timestamps: the lists have entries with a same t
+    rnd = random.Random(seed)
+    storage = rnd.choice(['list', 'compact'])
+    monotonic = rnd.random() < 0.3
+    params = dict(storage=storage, time_type=int, monotonic=monotonic)
+    sketches = [SlidingHyperLogLog(4, 20, **params) for k in range(rnd.randint(2, 5))]
+    for sketch in sketches:
+        for t in sorted(rnd.randint(0, 50) for k in range(300)):
+            sketch.Add(rnd.randint(0, 10 ** 6), t)
+    chained = SlidingHyperLogLog(4, 20, **params)
+    for sketch in sketches:
+        chained.Merge(sketch)
+    at_once = SlidingHyperLogLog(4, 20, **params)
+    at_once.merge_many(sketches)
+    assert [lst and list(lst) for lst in at_once.LFPM] == [lst and list(lst) for lst in chained.LFPM]
+
+
+def jittered_items(rnd, n, jitter):
+    # (val, t) items arriving out of time order by at most jitter
+    items = []
+    t = 0
+    for k in range(n):
+        t += rnd.choice([0, 1, 1, 2])
+        items.append((rnd.randint(0, 10 ** 6), max(0, t - rnd.randint(0, jitter))))
+    return items
+
+
+@pytest.mark.parametrize('seed', range(6))
+def test_monotonic_tolerance_matches_sorted_items(seed):
+    # late items within the tolerance are inserted at their place in time (insert_late): same estimates as a
+    # default sketch fed the same items sorted by t
+    rnd = random.Random(seed)
+    storage = rnd.choice(['list', 'compact'])
+    items = jittered_items(rnd, 1500, 5)
+    monotonic = SlidingHyperLogLog(6, 100, storage=storage, time_type=int, monotonic=True, tolerance=5)
+    if rnd.random() < 0.5:
+        for val, t in items:
+            monotonic.Add(val, t)
+    else:
+        monotonic.AddMany([val for val, t in items], [t for val, t in items])
+    reference = SlidingHyperLogLog(6, 100, storage=storage, time_type=int)
+    for val, t in sorted(items, key=lambda item: item[1]):
+        reference.Add(val, t)
+    assert monotonic.late == 0
+    t_last = reference.t_last
+    for w in (1, 3, 10, 50, 100):
+        assert monotonic.EstimateCardinality(t_last, w) == reference.EstimateCardinality(t_last, w)
+
+
+@pytest.mark.parametrize('storage', ['list', 'compact'])
+@pytest.mark.parametrize('batch', [False, True])
+def test_monotonic_late_items_are_counted(storage, batch):
+    # on_late='count': the items older than the newest t by more than the tolerance are dropped and counted
+    rnd = random.Random(7)
+    items = jittered_items(rnd, 1500, 10)
+    counted = SlidingHyperLogLog(6, 100, storage=storage, time_type=int, monotonic=True, tolerance=3,
+                                 on_late='count')
+    if batch:
+        counted.AddMany([val for val, t in items], [t for val, t in items])
+    else:
+        for val, t in items:
+            counted.Add(val, t)
+    kept = []
+    newest = None
+    for val, t in items:
+        if newest is not None and newest - t > 3:
+            continue
+        newest = t if newest is None else max(newest, t)
+        kept.append((val, t))
+    assert counted.late == len(items) - len(kept) > 0
+    reference = SlidingHyperLogLog(6, 100, storage=storage, time_type=int)
+    for val, t in sorted(kept, key=lambda item: item[1]):
+        reference.Add(val, t)
+    for w in (1, 3, 10, 50, 100):
+        assert counted.EstimateCardinality(newest, w) == reference.EstimateCardinality(newest, w)
+
+
+@pytest.mark.parametrize('storage', ['list', 'compact'])
+def test_monotonic_late_items_are_rejected(storage):
+    # on_late='reject': a late Add raises, and a batch with a late item is not applied at all
+    shll = SlidingHyperLogLog(6, 100, storage=storage, time_type=int, monotonic=True, tolerance=2)
+    for t in range(50):
+        shll.Add(t, t)
+    with pytest.raises(ValueError):
+        shll.Add(1000, 46)
+    # within the tolerance
+    shll.Add(1001, 47)
+    before = [lst and list(lst) for lst in shll.LFPM]
+    with pytest.raises(ValueError):
+        shll.AddMany([2000, 2001, 2002, 2003], [50, 51, 52, 40])
+    assert [lst and list(lst) for lst in shll.LFPM] == before
+    assert shll.t_last == 49
+    assert shll.late == 0
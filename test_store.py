@@ -0,0 +1,62 @@
+# tests of the keyed sketch store (run with pytest)
+
+import random
+
+import pytest
+
+from store import SketchStore
+
+np = pytest.importorskip('numpy')
+
+
+def add_rows(store, keys, values, timestamps):
+    for key, val, t in zip(keys, values, timestamps):
+        store.add(key, val, t)
+
+
+def test_add_columns_matches_add():
+    rnd = random.Random(0)
+    for trial in range(10):
+        n = 2000
+        keys = [rnd.choice('abcdefgh' if k % 400 < 200 else 'abcd') for k in range(n)]
+        values = [rnd.randint(0, 10 ** 6) for k in range(n)]
+        timestamps = sorted(rnd.random() * 500 for k in range(n))
+        columns = SketchStore(6, 100, max_keys=rnd.choice([None, 20]), ttl=rnd.choice([None, 5, 30]))
+        rows = SketchStore(6, 100, max_keys=columns.max_keys, ttl=columns.ttl)
+        for start in range(0, n, 500):
+            end = start + 500
+            columns.add_columns(np.array(keys[start:end]), np.array(values[start:end]),
+                                np.array(timestamps[start:end]))
+            add_rows(rows, keys[start:end], values[start:end], timestamps[start:end])
+        assert list(columns.keys()) == list(rows.keys())
+        assert columns.evicted == rows.evicted
+        for key in rows:
+            for w in (10, 50, 100):
+                assert columns.estimate(key, timestamps[-1], w) == rows.estimate(key, timestamps[-1], w)
+
+
+def test_add_columns_lru_keeps_batch_keys():
+    # a key of the batch must not be evicted to make room for a new key of the same batch
+    columns = SketchStore(6, 100, max_keys=2)
+    rows = SketchStore(6, 100, max_keys=2)
+    for store in (columns, rows):
+        for val in range(50):
+            store.add('a', val, 0)
+        store.add('x', 0, 1)
+    columns.add_columns(['a', 'b', 'a'], [100, 101, 102], [2, 3, 4])
+    add_rows(rows, ['a', 'b', 'a'], [100, 101, 102], [2, 3, 4])
+    assert list(columns.keys()) == list(rows.keys()) == ['b', 'a']
+    assert columns.estimate('a', 4) == rows.estimate('a', 4)
+    assert columns.estimate('a', 4) > 40
+
+
+def test_add_columns_ttl_inside_batch():
+    # 'a' is idle for 60 > ttl before its last row: only that row is left, as with add
+    keys = ['a'] * 20 + ['b', 'a']
+    timestamps = [0] * 20 + [50, 60]
+    columns = SketchStore(6, 100, ttl=30)
+    rows = SketchStore(6, 100, ttl=30)
+    columns.add_columns(np.array(keys), np.arange(22), np.array(timestamps, dtype=float))
+    add_rows(rows, keys, range(22), timestamps)
+    assert columns.estimate('a', 60, 100) == rows.estimate('a', 60, 100) == 1
+    assert columns.evicted == rows.evicted == 1